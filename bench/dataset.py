@@ -0,0 +1,79 @@
+import random
+from datetime import date, timedelta
+
+from src.services.lead_store import LEAD_HEADERS
+
+
+NOMBRES = ('María', 'José', 'Ana', 'Luis', 'Carmen', 'Juan', 'Rosa', 'Carlos',
+           'Lucía', 'Jorge', 'Elena', 'Miguel', 'Sofía', 'Pedro', 'Valeria', 'Diego')
+APELLIDOS = ('García', 'Rodríguez', 'López', 'Martínez', 'González', 'Pérez',
+             'Sánchez', 'Ramírez', 'Torres', 'Flores', 'Rivera', 'Gómez', 'Díaz')
+FUENTES = (('Facebook', 35), ('Instagram', 20), ('WhatsApp', 20), ('Referido', 15),
+           ('Web', 10))
+PRODUCTOS = ('Curso Básico', 'Curso Avanzado', 'Mentoría', 'Paquete Premium', 'Taller')
+PIPELINE = (('Prospección', 40), ('Contacto', 25), ('Negociación', 20), ('Cierre', 15))
+VENDEDORES = ('Ana', 'Luis', 'Carla', 'Jorge', 'Sofía', 'Martín')
+ACCIONES = ('Llamar', 'Enviar cotización', 'Enviar WhatsApp', 'Reunión', 'Cobrar cuota')
+MONTOS = ('1500', '2500.50', '800', '12000', '$ 3.200,00', '450,75', '')
+
+
+def _weighted(rng, options):
+    return rng.choices([o for o, _ in options], weights=[w for _, w in options])[0]
+
+
+def _fmt(rng, day):
+    # La mayoría ISO, algunas a mano en formato local como en el sheet real
+    if rng.random() < 0.8:
+        return day.isoformat()
+    return day.strftime('%d/%m/%Y')
+
+
+def generate_lead(rng, lead_id, today):
+    """Una fila de lead con valores plausibles."""
+    nombre = f'{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}'
+    registro = today - timedelta(days=rng.randint(0, 365))
+    estado = 'Activo' if rng.random() < 0.8 else 'Inactivo'
+    credito = rng.random() < 0.3
+    con_tarea = rng.random() < 0.35
+    ultimo = registro + timedelta(days=rng.randint(0, 30))
+    proxima = today + timedelta(days=rng.randint(-20, 45))
+    creado = f'{registro.isoformat()} {rng.randint(8, 19):02d}:{rng.randint(0, 59):02d}:00'
+    values = {
+        'id': str(lead_id),
+        'nombre': nombre,
+        'telefono': f'+51 9{rng.randint(10000000, 99999999)}',
+        'email': f"{nombre.split()[0].lower()}{lead_id}@example.com" if rng.random() < 0.7 else '',
+        'fuente': _weighted(rng, FUENTES),
+        'registro': _fmt(rng, registro),
+        'producto_interes': rng.choice(PRODUCTOS),
+        'estado': estado,
+        'pipeline': _weighted(rng, PIPELINE),
+        'vendedor': rng.choice(VENDEDORES),
+        'comentarios': 'Interesado en pagar en cuotas' if credito and rng.random() < 0.5 else '',
+        'fecha_ultimo_contacto': _fmt(rng, ultimo) if rng.random() < 0.6 else '',
+        'proxima_accion': rng.choice(ACCIONES) if con_tarea else '',
+        'fecha_proxima_accion': _fmt(rng, proxima) if con_tarea else '',
+        'conversacion': '',
+        'tipo_pago': 'Crédito' if credito else rng.choice(('Contado', '')),
+        'monto_pendiente': rng.choice(MONTOS) if credito else '',
+        'comprobante': '',
+        'fecha_creacion': creado,
+        'fecha_modificacion': creado,
+    }
+    return [values[h] for h in LEAD_HEADERS]
+
+
+def generate_rows(count, seed=42, today=None):
+    """`count` filas de leads reproducibles (misma semilla → mismos datos)."""
+    rng = random.Random(seed)
+    today = today or date(2025, 6, 1)
+    return [generate_lead(rng, lead_id, today) for lead_id in range(1, count + 1)]
+
+
+def generate_sheets(count, seed=42):
+    """Hojas Leads (con encabezado) y Meta con el contador de ids."""
+    header = [h.replace('_', ' ').title() for h in LEAD_HEADERS]
+    return {
+        'Leads': [header] + generate_rows(count, seed),
+        'Meta': [['next_id', str(count + 1)]],
+    }
@@ -0,0 +1,223 @@
+import random
+import re
+import threading
+import time
+from collections import deque
+
+
+def column_index(letters):
+    """'A' → 0, 'T' → 19, 'AA' → 26."""
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - ord('A') + 1
+    return index - 1
+
+
+_RANGE_RE = re.compile(r"^'?([^'!]+)'?(?:!([A-Z]+)?(\d+)?(?::([A-Z]+)?(\d+)?)?)?$")
+
+
+def parse_range(range_name):
+    """
+    Interpretar un rango A1: devuelve (hoja, fila_inicio, fila_fin,
+    col_inicio, col_fin), con filas base 1 y fin None si es abierto.
+    """
+    match = _RANGE_RE.match(range_name)
+    if not match:
+        raise ValueError(f'Rango inválido: {range_name}')
+    sheet, col1, row1, col2, row2 = match.groups()
+    start_row = int(row1) if row1 else 1
+    if col2 is None and row2 is None:
+        end_row = start_row if row1 else None
+        col2 = col1
+    else:
+        end_row = int(row2) if row2 else None
+    start_col = column_index(col1) if col1 else 0
+    end_col = column_index(col2) if col2 else None
+    return sheet, start_row, end_row, start_col, end_col
+
+
+class _Response(dict):
+    """Imita httplib2.Response: un dict de encabezados con `status`."""
+
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+
+
+class FakeHttpError(Exception):
+    """Error HTTP con la misma forma que googleapiclient.errors.HttpError."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(f'<HttpError {status}: {message}>')
+        self.resp = _Response(status, headers)
+        self.status_code = status
+
+
+class FakeRequest:
+    def __init__(self, backend, method_id, kind, handler):
+        self.backend = backend
+        self.methodId = f'sheets.spreadsheets.{method_id}'
+        self.kind = kind
+        self.handler = handler
+
+    def execute(self, num_retries=0):
+        return self.backend._execute(self, self.kind, self.handler)
+
+
+class _Values:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return FakeRequest(self.backend, 'values.get', 'read',
+                           lambda: self.backend._get(range))
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        def handler():
+            return {'spreadsheetId': spreadsheetId,
+                    'valueRanges': [self.backend._get(r) for r in ranges]}
+        return FakeRequest(self.backend, 'values.batchGet', 'read', handler)
+
+    def append(self, spreadsheetId, range, body, **kwargs):
+        return FakeRequest(self.backend, 'values.append', 'write',
+                           lambda: self.backend._append(range, body['values']))
+
+    def update(self, spreadsheetId, range, body, **kwargs):
+        return FakeRequest(self.backend, 'values.update', 'write',
+                           lambda: self.backend._update(range, body['values']))
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        def handler():
+            responses = [self.backend._update(d['range'], d['values']) for d in body['data']]
+            return {'spreadsheetId': spreadsheetId,
+                    'totalUpdatedRows': sum(r['updatedRows'] for r in responses),
+                    'responses': responses}
+        return FakeRequest(self.backend, 'values.batchUpdate', 'write', handler)
+
+
+class _Spreadsheets:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def values(self):
+        return _Values(self.backend)
+
+    def get(self, spreadsheetId, **kwargs):
+        return FakeRequest(self.backend, 'get', 'read', self.backend._metadata)
+
+
+class FakeSheetsBackend:
+    """
+    Reemplazo en memoria del cliente de Google Sheets v4.
+
+    Implementa spreadsheets().get y values().get/batchGet/append/update/
+    batchUpdate sobre listas de filas (la fila 1 de cada hoja es el
+    encabezado). Se le puede configurar:
+
+    - `latency` (+ `jitter`) en segundos por llamada,
+    - `quota_per_minute` por tipo de llamada (lectura/escritura), con 429
+      al superarla como hace la API real,
+    - `error_rate`: probabilidad de devolver un 503.
+
+    Se pasa como `client_factory` de GoogleSheetsService:
+    `GoogleSheetsService(client_factory=lambda: backend)`.
+    """
+
+    def __init__(self, sheets=None, latency=0.0, jitter=0.0, quota_per_minute=None,
+                 error_rate=0.0, seed=None):
+        self.sheets = sheets if sheets is not None else {}
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_per_minute = quota_per_minute
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._windows = {'read': deque(), 'write': deque()}
+        self.calls = {}
+        self.errors = {}
+
+    def spreadsheets(self):
+        return _Spreadsheets(self)
+
+    # --------------------------- Ejecución --------------------------- #
+
+    def _execute(self, request, kind, handler):
+        method = request.methodId.rsplit('spreadsheets.', 1)[-1]
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            error = self._check_quota(kind)
+            if error is None and self.error_rate and self._random.random() < self.error_rate:
+                error = FakeHttpError(503, 'The service is currently unavailable.')
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if error is not None:
+            with self._lock:
+                self.errors[error.resp.status] = self.errors.get(error.resp.status, 0) + 1
+            raise error
+        with self._lock:
+            return handler()
+
+    def _check_quota(self, kind):
+        if not self.quota_per_minute:
+            return None
+        now = time.monotonic()
+        window = self._windows[kind]
+        while window and now - window[0] >= 60:
+            window.popleft()
+        if len(window) >= self.quota_per_minute:
+            return FakeHttpError(429, 'Quota exceeded for quota metric', {'retry-after': '1'})
+        window.append(now)
+        return None
+
+    # ---------------------------- Valores ---------------------------- #
+
+    def _sheet(self, name):
+        if name not in self.sheets:
+            raise FakeHttpError(400, f'Unable to parse range: {name}')
+        return self.sheets[name]
+
+    def _get(self, range_name):
+        sheet, start, end, start_col, end_col = parse_range(range_name)
+        rows = self._sheet(sheet)[start - 1:end]
+        values = []
+        for row in rows:
+            row = row[start_col:None if end_col is None else end_col + 1]
+            while row and row[-1] == '':
+                row = row[:-1]
+            values.append(list(row))
+        # La API omite las filas vacías del final
+        while values and not values[-1]:
+            values.pop()
+        result = {'range': range_name, 'majorDimension': 'ROWS'}
+        if values:
+            result['values'] = values
+        return result
+
+    def _append(self, range_name, values):
+        sheet, _, _, _, _ = parse_range(range_name)
+        rows = self._sheet(sheet)
+        while rows and not any(rows[-1]):
+            rows.pop()
+        first = len(rows) + 1
+        rows.extend([str(v) for v in row] for row in values)
+        return {'updates': {'updatedRange': f'{sheet}!A{first}:T{len(rows)}',
+                            'updatedRows': len(values)}}
+
+    def _update(self, range_name, values):
+        sheet, start, _, start_col, _ = parse_range(range_name)
+        rows = self._sheet(sheet)
+        for offset, new in enumerate(values):
+            index = start - 1 + offset
+            while len(rows) <= index:
+                rows.append([])
+            row = list(rows[index])
+            row += [''] * (start_col + len(new) - len(row))
+            row[start_col:start_col + len(new)] = [str(v) for v in new]
+            rows[index] = row
+        return {'updatedRange': range_name, 'updatedRows': len(values)}
+
+    def _metadata(self):
+        return {'sheets': [{'properties': {'title': name,
+                                           'gridProperties': {'rowCount': len(rows) + 1000}}}
+                           for name, rows in self.sheets.items()]}
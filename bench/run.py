@@ -0,0 +1,220 @@
+"""
+Benchmark de la API de leads contra un backend de Sheets falso.
+
+    python -m bench.run                          # 1k, 10k y 100k filas
+    python -m bench.run --sizes 1000 --latency 0.05
+    python -m bench.run --compare bench/results/<anterior>.json
+
+Cada corrida se guarda en bench/results/ como JSON; con --compare se
+muestran las diferencias contra otra corrida y el proceso termina con
+código 1 si algún escenario empeoró más que --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Sin límites locales de cuota ni precarga: se mide el código, no la espera
+os.environ.setdefault('LEADS_SHEETS_READ_PER_MINUTE', '1000000')
+os.environ.setdefault('LEADS_SHEETS_WRITE_PER_MINUTE', '1000000')
+os.environ.setdefault('LEADS_SHEETS_QUOTA_BURST', '1000000')
+os.environ.setdefault('LEADS_WARMUP', '0')
+
+from flask import Flask  # noqa: E402
+
+from bench.dataset import generate_sheets  # noqa: E402
+from bench.fake_sheets import FakeSheetsBackend  # noqa: E402
+import src.routes.leads as leads_routes  # noqa: E402
+from src.services.google_sheets import GoogleSheetsService  # noqa: E402
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+DEFAULT_SIZES = (1000, 10000, 100000)
+SCENARIOS = ('cold_load', 'list', 'list_page', 'search', 'detail', 'create',
+             'update', 'stats', 'cobranza', 'dashboard', 'tasks')
+# Escenarios caros: se corren menos veces
+HEAVY = {'cold_load': 0.1, 'list': 0.1}
+
+
+def build_app(size, latency, seed):
+    backend = FakeSheetsBackend(generate_sheets(size, seed), latency=latency, seed=seed)
+    service = GoogleSheetsService(client_factory=lambda: backend)
+    service.set_spreadsheet_id('bench')
+    leads_routes.sheets_service = service
+    leads_routes.reads = service
+    app = Flask(__name__)
+    app.register_blueprint(leads_routes.leads_bp, url_prefix='/api')
+    return app, service, backend
+
+
+def make_requests(size, rng):
+    """Función por escenario que hace una petición y devuelve el status."""
+    def lead_id():
+        return rng.randint(1, size)
+
+    return {
+        'list': lambda c: c.get('/api/leads'),
+        'list_page': lambda c: c.get('/api/leads?estado=Activo&pipeline=Contacto&limit=50'),
+        'search': lambda c: c.get('/api/leads?q=garc&vendedor=Ana&limit=50&sort=-id'),
+        'detail': lambda c: c.get(f'/api/leads/{lead_id()}'),
+        # Siempre el mismo teléfono: se mide el alta, no el rechazo por duplicado
+        'create': lambda c: c.post('/api/leads?on_duplicate=allow', json={
+            'nombre': 'Bench Lead', 'telefono': '+51 999999999', 'fuente': 'Web'}),
+        'update': lambda c: c.put(f'/api/leads/{lead_id()}', json={
+            'pipeline': rng.choice(('Contacto', 'Negociación', 'Cierre'))}),
+        'stats': lambda c: c.get('/api/pipeline/stats'),
+        'cobranza': lambda c: c.get('/api/cobranza'),
+        'dashboard': lambda c: c.get('/api/dashboard/metrics'),
+        'tasks': lambda c: c.get('/api/tasks?from=2025-06-01&to=2025-06-30&limit=100'),
+    }
+
+
+def summarize(latencies, wall, calls):
+    latencies = sorted(latencies)
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(round(p * (len(latencies) - 1))))]
+
+    return {
+        'n': len(latencies),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'p50_ms': round(pct(0.5) * 1000, 3),
+        'p95_ms': round(pct(0.95) * 1000, 3),
+        'p99_ms': round(pct(0.99) * 1000, 3),
+        'ops_per_s': round(len(latencies) / wall, 1) if wall else None,
+        'sheets_calls_per_op': round(calls / len(latencies), 3),
+    }
+
+
+def run_scenario(name, app, service, backend, requests, iterations, concurrency):
+    if name == 'cold_load':
+        def once(_):
+            service.cache.invalidate()
+            started = time.perf_counter()
+            service._snapshot()
+            return time.perf_counter() - started
+    else:
+        request = requests[name]
+
+        def once(client):
+            started = time.perf_counter()
+            response = request(client)
+            elapsed = time.perf_counter() - started
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name}: HTTP {response.status_code} {response.get_data(as_text=True)[:200]}')
+            return elapsed
+
+    # Una pasada de calentamiento (snapshot cargado, índices construidos)
+    service._snapshot()
+    once(app.test_client())
+    calls_before = sum(backend.calls.values())
+    started = time.perf_counter()
+    if concurrency <= 1 or name == 'cold_load':
+        client = app.test_client()
+        latencies = [once(client) for _ in range(iterations)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(lambda _: once(app.test_client()), range(iterations)))
+    wall = time.perf_counter() - started
+    return summarize(latencies, wall, sum(backend.calls.values()) - calls_before)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Imprimir la diferencia de p50 por escenario; devuelve las regresiones."""
+    regressions = []
+    print(f"\n{'filas':>8} {'escenario':<12} {'base p50':>10} {'p50':>10} {'cambio':>8}")
+    for size, scenarios in current['results'].items():
+        for name, stats in scenarios.items():
+            base = baseline.get('results', {}).get(size, {}).get(name)
+            if not base or not base['p50_ms']:
+                continue
+            change = stats['p50_ms'] / base['p50_ms'] - 1
+            flag = '  <-- regresión' if change > threshold else ''
+            print(f"{size:>8} {name:<12} {base['p50_ms']:>10.3f} {stats['p50_ms']:>10.3f} "
+                  f"{change:>+7.1%}{flag}")
+            if flag:
+                regressions.append((size, name, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='tamaños del sheet separados por comas')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='peticiones simultáneas (hilos)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='latencia simulada por llamada a Sheets (segundos)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='archivo de resultados (por defecto bench/results/)')
+    parser.add_argument('--compare', help='resultados anteriores para comparar')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='empeoramiento de p50 tolerado al comparar (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'escenarios desconocidos: {", ".join(sorted(unknown))}')
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'results': {},
+    }
+    for size in sizes:
+        rng = random.Random(args.seed)
+        app, service, backend = build_app(size, args.latency, args.seed)
+        requests = make_requests(size, rng)
+        report['results'][str(size)] = {}
+        for name in scenarios:
+            iterations = max(3, int(args.iterations * HEAVY.get(name, 1)))
+            stats = run_scenario(name, app, service, backend, requests, iterations,
+                                 args.concurrency)
+            report['results'][str(size)][name] = stats
+            print(f"{size:>8} {name:<12} p50 {stats['p50_ms']:>9.3f} ms  "
+                  f"p95 {stats['p95_ms']:>9.3f} ms  {stats['ops_per_s']:>9} op/s  "
+                  f"sheets/op {stats['sheets_calls_per_op']}", flush=True)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}"
+                                           f"-{report['meta']['git'] or 'local'}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResultados guardados en {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
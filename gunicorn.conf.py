@@ -0,0 +1,87 @@
+"""
+Configuración de gunicorn para producción.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Los workers no descargan el sheet cada uno por su cuenta: un proceso
+publicador (src/services/shared_snapshot.py) lo descarga y deja el snapshot
+en LEADS_SNAPSHOT_PATH, y los workers lo leen de ese archivo. El master lo
+vigila y lo relanza si termina.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# Las importaciones y exportaciones en streaming pueden tardar
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+accesslog = '-'
+
+# Heredadas por los workers y por el publicador
+if not os.environ.get('LEADS_SNAPSHOT_PATH'):
+    os.environ['LEADS_SNAPSHOT_PATH'] = os.path.join(
+        tempfile.mkdtemp(prefix='crm-leads-'), 'leads-snapshot.bin')
+os.environ.setdefault('LEADS_JOBS_DIR', os.path.join(
+    os.path.dirname(os.environ['LEADS_SNAPSHOT_PATH']), 'jobs'))
+# Revisar el archivo compartido es barato: los workers lo miran seguido
+os.environ.setdefault('LEADS_CACHE_TTL', '2')
+
+# Si el publicador termina se vuelve a lanzar, esperando entre intentos de
+# PUBLISHER_RESTART_DELAY hasta PUBLISHER_MAX_DELAY segundos
+PUBLISHER_RESTART_DELAY = float(os.environ.get('LEADS_PUBLISHER_RESTART_DELAY', 1))
+PUBLISHER_MAX_DELAY = float(os.environ.get('LEADS_PUBLISHER_MAX_DELAY', 60))
+# Un publicador que vivió al menos esto se considera sano (se reinicia la espera)
+PUBLISHER_HEALTHY_AFTER = 60
+
+_publisher = None
+_stopping = threading.Event()
+
+
+def _start_publisher(server):
+    global _publisher
+    _publisher = subprocess.Popen(
+        [sys.executable, '-m', 'src.services.shared_snapshot'],
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    server.log.info('Publicador del snapshot de leads iniciado (pid %s)', _publisher.pid)
+
+
+def _supervise_publisher(server):
+    """Relanzar el publicador si termina; sin él los workers leen un snapshot viejo."""
+    delay = PUBLISHER_RESTART_DELAY
+    started = time.monotonic()
+    while not _stopping.is_set():
+        code = _publisher.poll()
+        if code is None:
+            _stopping.wait(1)
+            continue
+        if time.monotonic() - started >= PUBLISHER_HEALTHY_AFTER:
+            delay = PUBLISHER_RESTART_DELAY
+        server.log.error('El publicador del snapshot terminó (código %s); '
+                         'se relanza en %g s', code, delay)
+        if _stopping.wait(delay):
+            return
+        try:
+            _start_publisher(server)
+        except OSError as e:
+            server.log.error('No se pudo relanzar el publicador: %s', e)
+        started = time.monotonic()
+        delay = min(delay * 2, PUBLISHER_MAX_DELAY)
+
+
+def when_ready(server):
+    _start_publisher(server)
+    threading.Thread(target=_supervise_publisher, args=(server,),
+                     name='publisher-supervisor', daemon=True).start()
+
+
+def on_exit(server):
+    _stopping.set()
+    if _publisher is not None and _publisher.poll() is None:
+        _publisher.terminate()
+        _publisher.wait(timeout=10)
@@ -4,12 +4,20 @@ from flask_cors import CORS
 from src.models.user import db
 from src.routes.user import user_bp
 from src.routes.leads import leads_bp
+from src.routes.campaigns import campaigns_bp
+from src.routes.events import events_bp
 from src.services.google_sheets import sheets_service  # Importa el servicio de Sheets
+from src.services.campaigns import campaign_dispatcher
+from src.services.lead_replica import READ_BACKEND, lead_replica
+from src.utils.metrics import init_app as init_metrics
 
 # Crear la app y configurar la carpeta de archivos estáticos
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 
+# Latencias por ruta, llamadas a Sheets y /api/metrics (formato Prometheus)
+init_metrics(app)
+
 # Regex para subdominios de vercel, netlify, railway, render (solo HTTPS)
 allowed_origins_regex = r"^https:\/\/([a-zA-Z0-9-]+\.)*(vercel\.app|netlify\.app|railway\.app|render\.com)(:\d+)?$"
 
@@ -42,17 +50,32 @@ with app.app_context():
 
 # >>> NUEVO: establecer el ID del spreadsheet desde la variable de entorno
 # Esto asigna automáticamente sheets_service.spreadsheet_id si la variable está definida.
-sheets_service.authenticate()
+# La autenticación con Google es perezosa (primer uso); aquí sólo se lanza
+# la precarga en segundo plano para no demorar el arranque.
 sheets_service.set_spreadsheet_id(os.environ.get("SPREADSHEET_ID"))
+if os.environ.get('LEADS_WARMUP', '1') != '0':
+    sheets_service.warm_up()
+
+# Réplica SQLite de la hoja Leads: las consultas se sirven desde la base y un
+# hilo la mantiene sincronizada con el sheet
+if READ_BACKEND == 'sqlite':
+    lead_replica.init_app(app)
+
+# Despacho de campañas de WhatsApp en segundo plano (retoma las que estaban en curso)
+campaign_dispatcher.init_app(app)
 
 # Registrar los blueprints
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(leads_bp, url_prefix='/api')
+app.register_blueprint(campaigns_bp, url_prefix='/api')
+app.register_blueprint(events_bp, url_prefix='/api')
 
 # Endpoint de health check para Railway
 @app.route('/api/health')
 def health_check():
-    return jsonify({"status": "healthy", "message": "CRM Backend is running"})
+    # El proceso está sano aunque Sheets todavía no esté listo
+    return jsonify({"status": "healthy", "message": "CRM Backend is running",
+                    "sheets": sheets_service.readiness()})
 
 # Servir archivos estáticos o index.html
 @app.route('/', defaults={'path': ''})
@@ -0,0 +1,85 @@
+import json
+
+from src.models.user import db
+
+
+class Campaign(db.Model):
+    """Campaña de mensajes de WhatsApp a un público de leads."""
+    __tablename__ = 'campaigns'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    template = db.Column(db.Text, nullable=False)
+    # Filtros con los que se armó el público (JSON)
+    audience = db.Column(db.Text, nullable=False, default='{}')
+    gateway = db.Column(db.String(50), nullable=False)
+    # pending → running ⇄ paused → completed / cancelled / failed
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    sent = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.Float, nullable=False)
+    started_at = db.Column(db.Float)
+    finished_at = db.Column(db.Float)
+    # Proceso que la está despachando y último latido (para retomarla si muere)
+    claimed_by = db.Column(db.String(64))
+    heartbeat_at = db.Column(db.Float)
+
+    messages = db.relationship('CampaignMessage', backref='campaign', lazy='dynamic',
+                               cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<Campaign {self.id} {self.name}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'template': self.template,
+            'audience': json.loads(self.audience or '{}'),
+            'gateway': self.gateway,
+            'status': self.status,
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'pending': self.total - self.sent - self.failed,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class CampaignMessage(db.Model):
+    """Un mensaje de una campaña (un lead), con su estado de envío."""
+    __tablename__ = 'campaign_messages'
+    __table_args__ = (
+        db.Index('ix_campaign_messages_campaign_status', 'campaign_id', 'status', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False)
+    lead_id = db.Column(db.String(64), nullable=False)
+    phone = db.Column(db.String(32), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    # pending → sent / failed
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    provider_id = db.Column(db.String(128))
+    updated_at = db.Column(db.Float)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'campaign_id': self.campaign_id,
+            'lead_id': self.lead_id,
+            'phone': self.phone,
+            'body': self.body,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'provider_id': self.provider_id,
+            'updated_at': self.updated_at,
+        }
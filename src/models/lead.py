@@ -0,0 +1,83 @@
+import json
+
+from src.models.user import db
+
+
+class Lead(db.Model):
+    """
+    Copia local de una fila de la hoja Leads (réplica de lectura).
+
+    El lead completo va en `data` (JSON); las demás columnas son claves
+    derivadas para filtrar, buscar, ordenar y agregar con índices. Las
+    columnas `*_key` guardan el texto normalizado (minúsculas, sin tildes).
+    """
+    __tablename__ = 'leads'
+    __table_args__ = (
+        db.Index('ix_leads_vendedor_task_due', 'vendedor_key', 'task_due'),
+    )
+
+    id = db.Column(db.String(64), primary_key=True)
+    row_number = db.Column(db.Integer)
+    row_hash = db.Column(db.String(16), nullable=False)
+    data = db.Column(db.Text, nullable=False)
+
+    id_num = db.Column(db.Float, index=True)
+    estado = db.Column(db.String(120), index=True)
+    pipeline = db.Column(db.String(120), index=True)
+    fuente = db.Column(db.String(120))
+    vendedor = db.Column(db.String(120))
+    producto_interes = db.Column(db.String(120))
+    tipo_pago = db.Column(db.String(120), index=True)
+    # Monto pendiente normalizado (0 si está vacío o no es numérico)
+    monto = db.Column(db.Float, nullable=False, default=0.0)
+    monto_pendiente_num = db.Column(db.Float)
+    # Ordinal de la fecha de la próxima acción si el lead tiene una tarea
+    task_due = db.Column(db.Integer, index=True)
+    # Ordinal de la fecha desde la que corre la antigüedad de la deuda
+    ref_date = db.Column(db.Integer)
+
+    estado_key = db.Column(db.String(120), index=True)
+    pipeline_key = db.Column(db.String(120), index=True)
+    vendedor_key = db.Column(db.String(120), index=True)
+    fuente_key = db.Column(db.String(120), index=True)
+    producto_interes_key = db.Column(db.String(120), index=True)
+    tipo_pago_key = db.Column(db.String(120), index=True)
+    nombre_key = db.Column(db.String(255), index=True)
+    email_key = db.Column(db.String(255), index=True)
+    telefono_key = db.Column(db.String(64))
+    telefono_digits = db.Column(db.String(64), index=True)
+    registro_key = db.Column(db.String(32), index=True)
+    fecha_ultimo_contacto_key = db.Column(db.String(32))
+    fecha_proxima_accion_key = db.Column(db.String(32), index=True)
+    fecha_creacion_key = db.Column(db.String(32))
+    fecha_modificacion_key = db.Column(db.String(32), index=True)
+    monto_pendiente_key = db.Column(db.String(64))
+
+    def __repr__(self):
+        return f'<Lead {self.id}>'
+
+    def to_dict(self):
+        return json.loads(self.data)
+
+
+class LeadSyncState(db.Model):
+    """Estado de la sincronización de la réplica (una sola fila)."""
+    __tablename__ = 'lead_sync_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    spreadsheet_id = db.Column(db.String(128))
+    fingerprint = db.Column(db.String(16))
+    version = db.Column(db.Integer, nullable=False, default=0)
+    watermark = db.Column(db.String(32))
+    synced_at = db.Column(db.Float)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'spreadsheet_id': self.spreadsheet_id,
+            'fingerprint': self.fingerprint,
+            'version': self.version,
+            'watermark': self.watermark,
+            'synced_at': self.synced_at,
+            'rows': self.rows,
+        }
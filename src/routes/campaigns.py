@@ -0,0 +1,151 @@
+from flask import Blueprint, jsonify, request
+from src.models.campaign import Campaign, CampaignMessage
+from src.models.user import db
+from src.routes.leads import error_response, reads
+from src.services.campaigns import campaign_dispatcher, render_batch, select_audience
+
+campaigns_bp = Blueprint('campaigns', __name__)
+
+MESSAGE_STATUSES = ('pending', 'sent', 'failed')
+MESSAGES_DEFAULT_LIMIT = 100
+MESSAGES_MAX_LIMIT = 1000
+PREVIEW_SAMPLE = 5
+
+
+def parse_audience(data):
+    """
+    Filtros y búsqueda del público desde el cuerpo JSON.
+
+    `filters` es un dict campo → valor o lista de valores (también separados
+    por comas); si no incluye `estado` se usa estado=Inactivo.
+    """
+    filters = {}
+    for field, values in (data.get('filters') or {}).items():
+        if isinstance(values, str):
+            values = values.split(',')
+        values = [str(v).strip() for v in values if str(v).strip()]
+        if values:
+            filters[field] = values
+    return filters, (data.get('q') or '').strip() or None
+
+
+def _get_campaign(campaign_id):
+    return db.session.get(Campaign, campaign_id)
+
+
+def _not_found():
+    return jsonify({"success": False, "error": "Campaña no encontrada"}), 404
+
+# ------------------------- Campañas ------------------------- #
+
+@campaigns_bp.route('/campaigns', methods=['GET'])
+def list_campaigns():
+    """Listar las campañas, de la más reciente a la más antigua"""
+    campaigns = Campaign.query.order_by(Campaign.id.desc()).all()
+    return jsonify({"success": True, "data": [c.to_dict() for c in campaigns]})
+
+
+@campaigns_bp.route('/campaigns', methods=['POST'])
+def create_campaign():
+    """
+    Crear una campaña de WhatsApp.
+
+    Cuerpo: `name`, `template` (con campos como {nombre} o {primer_nombre}),
+    `filters` y `q` para el público, `gateway` y `start` (por defecto true).
+    Los mensajes se generan y guardan en el momento; el envío corre en
+    segundo plano y el progreso se consulta en /campaigns/<id>.
+    """
+    try:
+        data = request.get_json() or {}
+        filters, search = parse_audience(data)
+        campaign, skipped = campaign_dispatcher.create(
+            reads, data.get('name'), data.get('template'), filters, search,
+            gateway=data.get('gateway'), start=data.get('start', True) is not False)
+        return jsonify({"success": True, "data": campaign.to_dict(), "skipped": skipped}), 202
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return error_response(e)
+
+
+@campaigns_bp.route('/campaigns/preview', methods=['POST'])
+def preview_campaign():
+    """Tamaño del público y algunos mensajes de ejemplo, sin crear la campaña"""
+    try:
+        data = request.get_json() or {}
+        filters, search = parse_audience(data)
+        leads, phones, skipped = select_audience(reads, filters, search)
+        sample = leads[:PREVIEW_SAMPLE]
+        bodies = render_batch(data.get('template'), sample)
+        return jsonify({"success": True, "total": len(leads), "skipped": skipped,
+                        "sample": [{"lead_id": lead['id'], "phone": phone, "body": body}
+                                   for lead, phone, body in zip(sample, phones, bodies)]})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return error_response(e)
+
+
+@campaigns_bp.route('/campaigns/<int:campaign_id>', methods=['GET'])
+def get_campaign(campaign_id):
+    """Obtener una campaña con su progreso"""
+    campaign = _get_campaign(campaign_id)
+    if campaign is None:
+        return _not_found()
+    return jsonify({"success": True, "data": campaign.to_dict()})
+
+
+@campaigns_bp.route('/campaigns/<int:campaign_id>/messages', methods=['GET'])
+def get_campaign_messages(campaign_id):
+    """
+    Mensajes de una campaña, por id. `status` filtra (pending, sent,
+    failed); `after` es el último id recibido para pedir la página siguiente.
+    """
+    if _get_campaign(campaign_id) is None:
+        return _not_found()
+    status = request.args.get('status')
+    if status is not None and status not in MESSAGE_STATUSES:
+        return jsonify({"success": False,
+                        "error": "status debe ser pending, sent o failed"}), 400
+    limit = max(1, min(request.args.get('limit', MESSAGES_DEFAULT_LIMIT, type=int),
+                       MESSAGES_MAX_LIMIT))
+    query = CampaignMessage.query.filter(
+        CampaignMessage.campaign_id == campaign_id,
+        CampaignMessage.id > request.args.get('after', 0, type=int))
+    if status is not None:
+        query = query.filter(CampaignMessage.status == status)
+    messages = query.order_by(CampaignMessage.id).limit(limit + 1).all()
+    data = [m.to_dict() for m in messages[:limit]]
+    return jsonify({"success": True, "data": data, "count": len(data),
+                    "next_after": data[-1]['id'] if len(messages) > limit else None})
+
+
+def _change_status(campaign_id, action):
+    campaign = _get_campaign(campaign_id)
+    if campaign is None:
+        return _not_found()
+    try:
+        campaign_dispatcher.set_status(campaign, action)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    return jsonify({"success": True, "data": campaign.to_dict()})
+
+
+@campaigns_bp.route('/campaigns/<int:campaign_id>/start', methods=['POST'])
+def start_campaign(campaign_id):
+    """Iniciar una campaña creada sin iniciar o retomar una pausada"""
+    return _change_status(campaign_id, 'start')
+
+
+@campaigns_bp.route('/campaigns/<int:campaign_id>/pause', methods=['POST'])
+def pause_campaign(campaign_id):
+    """Pausar el envío (los mensajes pendientes se conservan)"""
+    return _change_status(campaign_id, 'pause')
+
+
+@campaigns_bp.route('/campaigns/<int:campaign_id>/cancel', methods=['POST'])
+def cancel_campaign(campaign_id):
+    """Cancelar el envío de los mensajes que quedan"""
+    return _change_status(campaign_id, 'cancel')
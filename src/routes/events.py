@@ -0,0 +1,82 @@
+import os
+import time
+from flask import Blueprint, Response, request
+from src.services.change_feed import format_event
+from src.services.google_sheets import sheets_service
+
+events_bp = Blueprint('events', __name__)
+
+# Comentario de keepalive para que proxies y navegadores no corten la conexión
+KEEPALIVE_INTERVAL = float(os.environ.get('EVENTS_KEEPALIVE', 15))
+# Cada stream se cierra tras este tiempo y el navegador se reconecta con
+# Last-Event-ID; evita dejar un worker tomado indefinidamente
+MAX_STREAM_SECONDS = float(os.environ.get('EVENTS_MAX_STREAM_SECONDS', 300))
+# Espera sugerida al navegador antes de reconectar (ms)
+RETRY_MS = 3000
+# Cada stream ocupa un hilo del worker mientras dura: se limitan por proceso
+# para que siempre quede al menos uno libre para el resto de la API
+MAX_SUBSCRIBERS = int(os.environ.get(
+    'EVENTS_MAX_SUBSCRIBERS', max(int(os.environ.get('GUNICORN_THREADS', 4)) - 1, 1)))
+# Espera sugerida cuando el worker ya tiene MAX_SUBSCRIBERS streams (ms)
+BUSY_RETRY_MS = int(os.environ.get('EVENTS_BUSY_RETRY_MS', 10000))
+
+
+@events_bp.route('/events', methods=['GET'])
+def stream_events():
+    """
+    Cambios de los leads como Server-Sent Events.
+
+    Eventos: `lead.created` (lead completo), `lead.updated` y `lead.deleted`
+    (sólo los campos cambiados), `lead.removed` (fila borrada del sheet);
+    los que afectan al dashboard incluyen `delta` con la diferencia en los
+    agregados. `resync` indica que hay que volver a pedir los datos
+    (demasiados cambios juntos o eventos perdidos).
+
+    Al conectar se envía `ready` con la versión de los datos. Para retomar
+    tras una desconexión el navegador manda Last-Event-ID automáticamente;
+    también se acepta ?since=<id>.
+
+    Si el worker ya tiene EVENTS_MAX_SUBSCRIBERS streams abiertos se responde
+    sólo con `retry` y se cierra: el navegador vuelve a intentar más tarde,
+    posiblemente contra otro worker.
+    """
+    feed = sheets_service.changes
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    version = sheets_service.cache.data_version
+    headers = {
+        'Cache-Control': 'no-cache',
+        # Sin buffering en nginx/Railway: cada evento sale en el momento
+        'X-Accel-Buffering': 'no',
+    }
+
+    if not feed.subscribe(limit=MAX_SUBSCRIBERS):
+        return Response(f'retry: {BUSY_RETRY_MS}\n: busy\n\n',
+                        mimetype='text/event-stream', headers=headers)
+
+    def generate():
+        yield f'retry: {RETRY_MS}\n\n'
+        after = feed.parse_id(last_id) if last_id else None
+        current, current_id = feed.current()
+        if after is None:
+            after = current
+            if last_id:
+                # Id viejo o de otro proceso con otros datos: no se puede retomar
+                yield format_event(current_id, 'resync', {'reason': 'unknown_id'})
+        ready_id = current_id if after == current else feed.event_id(after)
+        yield format_event(ready_id, 'ready', {'version': version})
+        deadline = time.monotonic() + MAX_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            events, missed = feed.wait(after, KEEPALIVE_INTERVAL)
+            if missed:
+                after, current_id = feed.current()
+                yield format_event(current_id, 'resync', {'reason': 'missed'})
+            elif events:
+                after = events[-1][0]
+                yield ''.join(chunk for _, chunk in events)
+            else:
+                yield ': keepalive\n\n'
+
+    response = Response(generate(), mimetype='text/event-stream', headers=headers)
+    # Se libera aunque el stream no llegue a empezar (cliente que se va antes)
+    response.call_on_close(feed.unsubscribe)
+    return response
@@ -1,38 +1,210 @@
-from flask import Blueprint, request, jsonify
-from src.services.google_sheets import sheets_service   # ← ruta correcta
+import csv
+import io
+import itertools
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from src.services.google_sheets import LEAD_HEADERS, sheets_service, validate_lead_data   # ← ruta correcta
+from src.services.jobs import jobs
+from src.services.lead_import import IMPORT_FORMATS, iter_import_rows
+from src.services.lead_dedupe import DUPLICATE_POLICIES
+from src.services.lead_index import FILTER_FIELDS, lead_matches
+from src.services.lead_replica import READ_BACKEND, lead_replica
+from src.services.lead_store import parse_date
+from src.services.sheets_transport import SheetsError
+from src.utils.responses import conditional_json
 
 leads_bp = Blueprint('leads', __name__)
 
+# Importaciones más grandes que esto se procesan en segundo plano
+IMPORT_SYNC_MAX_BYTES = int(os.environ.get('LEADS_IMPORT_SYNC_MAX_BYTES', 1024 * 1024))
+
+LIST_PARAMS = ('q', 'match', 'sort', 'cursor', 'limit') + FILTER_FIELDS
+
+COBRANZA_PARAMS = ('sort', 'vendedor', 'producto', 'cursor', 'limit')
+
+# Rango por defecto de /tasks cuando no se indica `to`
+TASKS_DEFAULT_DAYS = 30
+
+# Las consultas se sirven desde el snapshot en memoria o desde la réplica
+# SQLite (LEADS_READ_BACKEND=sqlite); las escrituras siempre van al sheet
+reads = lead_replica if READ_BACKEND == 'sqlite' else sheets_service
+
+
+def error_response(e):
+    """
+    Respuesta de error: 503 (con Retry-After si se conoce) cuando Google
+    Sheets no está disponible o se agotó la cuota, 500 para lo demás.
+    """
+    if isinstance(e, SheetsError) and (e.retryable or e.status is None):
+        response = jsonify({"success": False, "error": str(e), "retryable": True})
+        response.status_code = 503
+        if e.retry_after:
+            response.headers['Retry-After'] = str(int(e.retry_after + 0.999))
+        return response
+    return jsonify({"success": False, "error": str(e)}), 500
+
+
+def write_status(result, success_status=200):
+    if result.get('success'):
+        return success_status
+    if result.get('not_found'):
+        return 404
+    if result.get('duplicate'):
+        return 409
+    return 503 if result.get('retryable') else 500
+
+
+@leads_bp.after_request
+def mark_stale(response):
+    """Avisar en los encabezados cuando se sirven datos de un snapshot viejo."""
+    degraded = reads.degraded()
+    if degraded is not None and request.method == 'GET':
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['X-Data-Stale'] = degraded['since']
+    return response
+
+
+def with_status(payload):
+    """Agregar al cuerpo el estado de degradación, si lo hay."""
+    degraded = reads.degraded()
+    if degraded is not None:
+        payload['degraded'] = degraded
+    return payload
+
+
+def parse_list_params(args):
+    """
+    Leer filtros, búsqueda y orden de la query string.
+
+    Los filtros aceptan varios valores repetidos o separados por comas
+    (?estado=Activo&pipeline=Contacto,Cierre). `sort=-campo` ordena de forma
+    descendente.
+    """
+    filters = {}
+    for field in FILTER_FIELDS:
+        values = [v.strip() for raw in args.getlist(field)
+                  for v in raw.split(',') if v.strip()]
+        if values:
+            filters[field] = values
+    sort = args.get('sort', 'id')
+    match = args.get('match', 'substring')
+    if match not in ('substring', 'prefix'):
+        raise ValueError('match debe ser "substring" o "prefix"')
+    return {
+        'filters': filters,
+        'search': args.get('q', '').strip() or None,
+        'match': match,
+        'sort': sort.lstrip('-'),
+        'descending': sort.startswith('-'),
+    }
+
 # ------------------------- CRUD Leads ------------------------- #
 
 @leads_bp.route('/leads', methods=['GET'])
 def get_leads():
-    """Obtener todos los leads"""
+    """
+    Obtener leads.
+
+    Sin parámetros devuelve todos los leads (comportamiento original). Con
+    filtros, `q`, `sort`, `limit` o `cursor` responde sólo la página pedida.
+    Soporta If-None-Match: si los datos no cambiaron responde 304.
+    """
+    def build_all():
+        leads = reads.get_all_leads()
+        return with_status({"success": True, "data": leads, "count": len(leads)})
+
+    def build_page():
+        params = parse_list_params(request.args)
+        limit = request.args.get('limit', type=int)
+        result = reads.query_leads(cursor=request.args.get('cursor'),
+                                   limit=limit, **params)
+        return with_status({"success": True,
+                            "data": result['data'],
+                            "count": len(result['data']),
+                            "total": result['total'],
+                            "next_cursor": result['next_cursor']})
+
     try:
-        leads = sheets_service.get_all_leads()
-        return jsonify({"success": True, "data": leads, "count": len(leads)})
+        paged = any(param in request.args for param in LIST_PARAMS)
+        return conditional_json(reads.data_version(),
+                                build_page if paged else build_all)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return error_response(e)
 
 
 @leads_bp.route('/leads', methods=['POST'])
 def create_lead():
-    """Crear un nuevo lead"""
+    """
+    Crear un nuevo lead.
+
+    Por defecto (LEADS_ON_DUPLICATE=allow) se crea aunque el teléfono o el
+    email ya existan. Con ?on_duplicate=reject responde 409 con
+    `duplicate_of` y con ?on_duplicate=merge completa el lead existente
+    (200, `merged`).
+    """
     try:
         data = request.get_json()
 
         # Validar campos requeridos
-        for field in ('nombre', 'telefono'):
-            if not data.get(field):
-                return jsonify({"success": False,
-                                "error": f'Campo requerido: {field}'}), 400
+        error = validate_lead_data(data)
+        if error:
+            return jsonify({"success": False, "error": error}), 400
 
-        result = sheets_service.create_lead(data)
-        status = 201 if result.get('success') else 500
-        return jsonify(result), status
+        result = sheets_service.create_lead(data, on_duplicate=request.args.get('on_duplicate'))
+        return jsonify(result), write_status(result, 200 if result.get('merged') else 201)
 
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return error_response(e)
+
+
+@leads_bp.route('/leads/duplicates', methods=['GET'])
+def find_duplicate_leads():
+    """Leads existentes con el mismo teléfono o email (?telefono=&email=)"""
+    try:
+        ids = sheets_service.find_duplicates({'telefono': request.args.get('telefono'),
+                                              'email': request.args.get('email')})
+        leads = [lead for lead in (sheets_service.cache.lookup(i) for i in ids) if lead]
+        return jsonify({"success": True, "data": leads, "count": len(leads)})
+    except Exception as e:
+        return error_response(e)
+
+
+@leads_bp.route('/leads/dedupe', methods=['POST'])
+def dedupe_leads():
+    """
+    Buscar duplicados en todo el sheet en segundo plano.
+
+    Por defecto sólo propone las fusiones; con {"apply": true} las aplica.
+    Responde 202 con un job_id consultable en /leads/dedupe/<job_id>.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        apply = data.get('apply') is True
+
+        def run(job):
+            return sheets_service.dedupe_leads(apply=apply, progress=job.progress)
+
+        job = jobs.start('dedupe', run)
+        return jsonify({"success": True, "job_id": job.id,
+                        "status_url": f"/api/leads/dedupe/{job.id}"}), 202
+    except Exception as e:
+        return error_response(e)
+
+
+@leads_bp.route('/leads/dedupe/<job_id>', methods=['GET'])
+def get_dedupe_job(job_id):
+    """Consultar el progreso y el resultado de una deduplicación"""
+    job = jobs.get(job_id)
+    if job is None or job.kind != 'dedupe':
+        return jsonify({"success": False, "error": "Deduplicación no encontrada"}), 404
+    return jsonify({"success": True, "data": job.to_dict()})
 
 
 @leads_bp.route('/leads/<int:lead_id>', methods=['PUT'])
@@ -41,10 +213,107 @@ def update_lead(lead_id):
     try:
         data = request.get_json()
         result = sheets_service.update_lead(lead_id, data)
-        status = 200 if result.get('success') else 500
+        return jsonify(result), write_status(result)
+    except Exception as e:
+        return error_response(e)
+
+
+def _import_format(req):
+    fmt = req.args.get('format')
+    if fmt:
+        return fmt.lower()
+    mimetype = req.files['file'].mimetype if 'file' in req.files else req.mimetype
+    filename = req.files['file'].filename if 'file' in req.files else ''
+    if 'ndjson' in mimetype or 'jsonl' in mimetype or filename.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+
+@leads_bp.route('/leads/import', methods=['POST'])
+def import_leads():
+    """
+    Importar leads desde un CSV o NDJSON.
+
+    El archivo puede venir como cuerpo crudo (text/csv, application/x-ndjson)
+    o como campo `file` de un formulario multipart. Se copia a disco por
+    bloques y se procesa en streaming; si supera LEADS_IMPORT_SYNC_MAX_BYTES
+    se responde 202 con un job_id consultable en /leads/import/<job_id>.
+    """
+    try:
+        on_duplicate = request.args.get('on_duplicate')
+        if on_duplicate not in (None,) + DUPLICATE_POLICIES:
+            return jsonify({"success": False,
+                            "error": "on_duplicate debe ser reject, merge o allow"}), 400
+        fmt = _import_format(request)
+        if fmt not in IMPORT_FORMATS:
+            return jsonify({"success": False,
+                            "error": "format debe ser csv o ndjson"}), 400
+
+        source = request.files['file'].stream if 'file' in request.files else request.stream
+        spool = tempfile.TemporaryFile()
+        size = 0
+        for block in iter(lambda: source.read(64 * 1024), b''):
+            spool.write(block)
+            size += len(block)
+        spool.seek(0)
+        if size == 0:
+            spool.close()
+            return jsonify({"success": False, "error": "Archivo vacío"}), 400
+
+        def run(job=None):
+            with spool:
+                progress = job.progress if job is not None else None
+                return sheets_service.import_leads(iter_import_rows(spool, fmt),
+                                                   progress=progress,
+                                                   on_duplicate=on_duplicate)
+
+        if size <= IMPORT_SYNC_MAX_BYTES:
+            result = run()
+            status = 201 if result['created'] or result['merged'] else 400
+            return jsonify(result), status
+
+        job = jobs.start('import', run)
+        return jsonify({"success": True, "job_id": job.id,
+                        "status_url": f"/api/leads/import/{job.id}"}), 202
+    except Exception as e:
+        return error_response(e)
+
+
+@leads_bp.route('/leads/import/<job_id>', methods=['GET'])
+def get_import_job(job_id):
+    """Consultar el progreso de una importación en segundo plano"""
+    job = jobs.get(job_id)
+    if job is None or job.kind != 'import':
+        return jsonify({"success": False, "error": "Importación no encontrada"}), 404
+    return jsonify({"success": True, "data": job.to_dict()})
+
+
+@leads_bp.route('/leads/bulk', methods=['PATCH'])
+def bulk_update_leads():
+    """
+    Actualizar muchos leads en una sola escritura.
+
+    Acepta {"patches": [{"id": 1, "fields": {...}}, ...]} o, para mover
+    varios leads al mismo estado/etapa, {"ids": [1, 2], "fields": {...}}.
+    """
+    try:
+        data = request.get_json() or {}
+        if 'patches' in data:
+            patches = data['patches']
+        elif 'ids' in data:
+            patches = [{'id': lead_id, 'fields': data.get('fields')}
+                       for lead_id in data['ids']]
+        else:
+            patches = None
+        if not isinstance(patches, list) or not patches:
+            return jsonify({"success": False,
+                            "error": "Se requiere patches o ids + fields"}), 400
+
+        result = sheets_service.update_leads_bulk(patches)
+        status = 200 if result['success'] else 207
         return jsonify(result), status
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return error_response(e)
 
 
 @leads_bp.route('/leads/<int:lead_id>', methods=['DELETE'])
@@ -52,78 +321,214 @@ def delete_lead(lead_id):
     """Marcar un lead como inactivo"""
     try:
         result = sheets_service.delete_lead(lead_id)
-        status = 200 if result.get('success') else 500
-        return jsonify(result), status
+        return jsonify(result), write_status(result)
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return error_response(e)
+
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+@leads_bp.route('/leads/export', methods=['GET'])
+def export_leads():
+    """
+    Exportar leads en streaming como CSV o NDJSON.
+
+    Acepta los mismos filtros y búsqueda que GET /leads. Las filas se leen
+    del sheet por páginas y se emiten a medida que llegan, en el orden del
+    sheet.
+
+    La primera página se lee antes de responder, así que los errores de
+    configuración o de Google Sheets devuelven el código habitual. Si el
+    sheet falla a mitad del stream, el archivo termina con una marca de
+    error: una línea `# ERROR: ...` en CSV o `{"error": ...}` en NDJSON.
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"success": False,
+                        "error": "format debe ser csv o ndjson"}), 400
+    try:
+        params = parse_list_params(request.args)
+        rows = sheets_service.iter_leads()
+        # iter_leads es un generador: se pide ya la primera página
+        first = next(rows, None)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return error_response(e)
+
+    def generate():
+        if fmt == 'csv':
+            yield _csv_line(LEAD_HEADERS)
+        try:
+            for lead in itertools.chain(() if first is None else (first,), rows):
+                if not lead['id'] or not lead_matches(lead, params['filters'],
+                                                      params['search'], params['match']):
+                    continue
+                if fmt == 'csv':
+                    yield _csv_line([lead[h] for h in LEAD_HEADERS])
+                else:
+                    yield json.dumps(lead, ensure_ascii=False) + '\n'
+        except Exception as e:
+            # Los encabezados ya se enviaron: se marca el archivo como incompleto
+            print(f'Error al exportar leads: {e}')
+            if fmt == 'csv':
+                yield '# ERROR: exportación incompleta: ' + ' '.join(str(e).split()) + '\n'
+            else:
+                yield json.dumps({'error': f'Exportación incompleta: {e}'},
+                                 ensure_ascii=False) + '\n'
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=leads.{fmt}'})
 
 
 @leads_bp.route('/leads/<int:lead_id>', methods=['GET'])
 def get_lead(lead_id):
     """Obtener un lead específico"""
     try:
-        leads = sheets_service.get_all_leads()
-        lead = next((l for l in leads if l['id'] == lead_id), None)
+        lead = reads.get_lead(lead_id)
         if lead:
             return jsonify({"success": True, "data": lead})
         return jsonify({"success": False, "error": "Lead no encontrado"}), 404
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return error_response(e)
 
 # ----------------------- Métricas & Otros --------------------- #
 
 @leads_bp.route('/pipeline/stats', methods=['GET'])
 def get_pipeline_stats():
     try:
-        stats = sheets_service.get_pipeline_stats()
-        return jsonify({"success": True, "data": stats})
+        return conditional_json(reads.data_version(), lambda: with_status({
+            "success": True, "data": reads.get_pipeline_stats()}))
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return error_response(e)
 
 
 @leads_bp.route('/cobranza', methods=['GET'])
 def get_cobranza():
+    """
+    Deudores (leads a crédito con monto pendiente) y totales de cobranza.
+
+    Sin parámetros devuelve todos los deudores por id (comportamiento
+    original). Con `sort` (monto, dias o id; `-` para descendente, por
+    defecto -monto), `vendedor`, `producto`, `limit` o `cursor` responde sólo
+    la página pedida. `summary` trae el total, por vendedor, por producto y
+    por tramo de antigüedad de los deudores filtrados.
+    """
+    def values(name):
+        return [v.strip() for raw in request.args.getlist(name)
+                for v in raw.split(',') if v.strip()]
+
+    def build():
+        vendedores = values('vendedor')
+        productos = values('producto')
+        summary = reads.get_receivables_summary(vendedores=vendedores, productos=productos)
+        if not any(param in request.args for param in COBRANZA_PARAMS):
+            data = reads.get_cobranza_data()
+            return with_status({"success": True, "data": data, "count": len(data),
+                                "summary": summary})
+        sort = request.args.get('sort', '-monto')
+        result = reads.get_receivables(sort=sort.lstrip('-'),
+                                       descending=sort.startswith('-'),
+                                       vendedores=vendedores, productos=productos,
+                                       cursor=request.args.get('cursor'),
+                                       limit=request.args.get('limit', type=int))
+        return with_status({"success": True,
+                            "data": result['data'],
+                            "count": len(result['data']),
+                            "total": result['total'],
+                            "next_cursor": result['next_cursor'],
+                            "summary": summary})
+
     try:
-        data = sheets_service.get_cobranza_data()
-        return jsonify({"success": True, "data": data, "count": len(data)})
+        # La antigüedad depende del día: entra en el ETag
+        version = reads.data_version()
+        return conditional_json(version and f'{version}.{date.today().isoformat()}', build)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return error_response(e)
 
 
 @leads_bp.route('/dashboard/metrics', methods=['GET'])
 def get_dashboard_metrics():
     """Métricas generales para el dashboard"""
     try:
-        leads = sheets_service.get_all_leads()
-        activos = [l for l in leads if l['estado'] == 'Activo']
-
-        total = len(activos)
-        pipeline = {}
-        fuente = {}
-        tareas = []
-
-        for lead in activos:
-            pipeline[lead['pipeline']] = pipeline.get(lead['pipeline'], 0) + 1
-            fuente[lead['fuente']] = fuente.get(lead['fuente'], 0) + 1
-            if lead['fecha_proxima_accion'] and lead['proxima_accion']:
-                tareas.append({
-                    "lead_id": lead['id'],
-                    "lead_name": lead['nombre'],
-                    "action": lead['proxima_accion'],
-                    "date": lead['fecha_proxima_accion']
-                })
-
-        return jsonify({
-            "success": True,
-            "data": {
-                "total_leads": total,
-                "pipeline_distribution": pipeline,
-                "source_distribution": fuente,
-                "upcoming_tasks": tareas[:10]
-            }
-        })
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return conditional_json(reads.data_version(), lambda: with_status({
+            "success": True, "data": reads.get_dashboard_metrics()}))
+    except Exception as e:
+        return error_response(e)
+
+
+@leads_bp.route('/tasks', methods=['GET'])
+def get_tasks():
+    """
+    Tareas (próximas acciones) por rango de fechas, ordenadas por fecha.
+
+    `from` y `to` son inclusivos (por defecto desde hoy y TASKS_DEFAULT_DAYS
+    días); `vendedor` acepta varios valores; `overdue=1` devuelve las
+    vencidas (fecha anterior a hoy). Pagina con `limit` y `cursor`.
+    """
+    def parse(name, default):
+        value = request.args.get(name)
+        if not value:
+            return default
+        parsed = parse_date(value)
+        if parsed is None:
+            raise ValueError(f'{name} no es una fecha válida: {value}')
+        return parsed
+
+    try:
+        today = date.today()
+        if request.args.get('overdue') in ('1', 'true'):
+            start = parse('from', date.min)
+            end = min(parse('to', today), today - timedelta(days=1))
+        else:
+            start = parse('from', today)
+            end = parse('to', start + timedelta(days=TASKS_DEFAULT_DAYS))
+        if start > end:
+            return jsonify({"success": False,
+                            "error": "from debe ser anterior a to"}), 400
+        vendedores = [v.strip() for raw in request.args.getlist('vendedor')
+                      for v in raw.split(',') if v.strip()]
+
+        def build():
+            result = reads.get_tasks(start, end, vendedores=vendedores,
+                                     cursor=request.args.get('cursor'),
+                                     limit=request.args.get('limit', type=int))
+            return with_status({"success": True,
+                                "data": result['data'],
+                                "count": len(result['data']),
+                                "total": result['total'],
+                                "next_cursor": result['next_cursor'],
+                                "from": start.isoformat(),
+                                "to": end.isoformat()})
+
+        # `overdue` depende del día: entra en el ETag
+        version = reads.data_version()
+        return conditional_json(version and f'{version}.{today.isoformat()}', build)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return error_response(e)
+
+
+@leads_bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Contadores del cache de leads y del transporte de Sheets"""
+    try:
+        data = sheets_service.get_cache_stats()
+        data['transport'] = sheets_service.get_transport_stats()
+        data['degraded'] = sheets_service.degraded()
+        if reads is lead_replica:
+            data['replica'] = lead_replica.get_stats()
+        return jsonify({"success": True, "data": data})
+    except Exception as e:
+        return error_response(e)
 
 # ---------------------- Configuración API --------------------- #
 
@@ -139,7 +544,7 @@ def set_spreadsheet_config():
         return jsonify({"success": True,
                         "message": "Spreadsheet configurado correctamente"})
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return error_response(e)
 
 
 @leads_bp.route('/config/auth', methods=['POST'])
@@ -152,4 +557,4 @@ def authenticate_sheets():
         return jsonify({"success": False,
                         "error": "Error en la autenticación"}), 500
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return error_response(e)
@@ -0,0 +1,608 @@
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+from sqlalchemy import func, insert, select, text, update
+
+try:
+    import fcntl
+except ImportError:  # sin flock (Windows): cada proceso despacha por su cuenta
+    fcntl = None
+
+from src.models.campaign import Campaign, CampaignMessage
+from src.models.user import db
+from src.services.lead_index import MAX_LIMIT as QUERY_MAX_LIMIT, _digits
+from src.services.lead_store import LEAD_HEADERS
+from src.utils.metrics import registry
+
+
+# Envíos simultáneos por campaña
+CONCURRENCY = int(os.environ.get('CAMPAIGN_CONCURRENCY', 20))
+# Intentos por mensaje antes de darlo por fallido
+MAX_ATTEMPTS = int(os.environ.get('CAMPAIGN_MAX_ATTEMPTS', 3))
+# Espera base entre reintentos (se duplica en cada intento)
+RETRY_BACKOFF = float(os.environ.get('CAMPAIGN_RETRY_BACKOFF', 1.0))
+# Cada cuánto se guarda el progreso en la base (segundos)
+FLUSH_INTERVAL = float(os.environ.get('CAMPAIGN_FLUSH_INTERVAL', 1.0))
+# Una campaña en curso sin latido durante este tiempo se retoma
+STALE_AFTER = float(os.environ.get('CAMPAIGN_STALE_AFTER', 60))
+# Código de país para teléfonos guardados sin él (vacío: no se agrega)
+COUNTRY_CODE = os.environ.get('CAMPAIGN_COUNTRY_CODE', '')
+DEFAULT_GATEWAY = os.environ.get('CAMPAIGN_GATEWAY', 'stub')
+# Candado (flock) que elige al único proceso de la máquina que despacha; así
+# el límite de envíos por segundo del gateway no se multiplica por worker
+LOCK_PATH = os.environ.get('CAMPAIGN_LOCK_PATH',
+                           os.path.join(tempfile.gettempdir(), 'crm-campaigns.lock'))
+
+# Mensajes pendientes que se leen de la base por vuelta
+PENDING_PAGE_SIZE = 500
+INSERT_CHUNK_SIZE = 1000
+SCAN_INTERVAL = 5.0
+MIN_PHONE_DIGITS = 8
+# Público por defecto: leads inactivos
+DEFAULT_AUDIENCE = {'estado': ['Inactivo']}
+# Campos extra disponibles en las plantillas además de las columnas del lead
+TEMPLATE_EXTRA_FIELDS = ('primer_nombre',)
+
+_PLACEHOLDER_RE = re.compile(r'\{\{|\}\}|\{([^{}]*)\}')
+
+campaign_messages = registry.counter('campaign_messages_total',
+                                     'Mensajes de campaña enviados o fallidos')
+
+
+# ----------------------------- Plantillas ----------------------------- #
+
+def compile_template(template):
+    """
+    Separar la plantilla en texto fijo y campos.
+
+    Los campos se escriben `{nombre}`, `{producto_interes}`, etc. (cualquier
+    columna del lead, más `{primer_nombre}`); `{{` y `}}` son llaves
+    literales. Lanza ValueError si hay un campo desconocido.
+    """
+    if not str(template or '').strip():
+        raise ValueError('La plantilla no puede estar vacía')
+    parts = []
+    last = 0
+    for match in _PLACEHOLDER_RE.finditer(template):
+        parts.append(template[last:match.start()])
+        token = match.group(0)
+        if token in ('{{', '}}'):
+            parts.append(token[0])
+        else:
+            field = match.group(1).strip()
+            if field not in LEAD_HEADERS and field not in TEMPLATE_EXTRA_FIELDS:
+                raise ValueError(f'Campo desconocido en la plantilla: {{{field}}}')
+            parts.append((field,))
+        last = match.end()
+    parts.append(template[last:])
+    return [p for p in parts if p != '']
+
+
+def _field_value(lead, field):
+    if field == 'primer_nombre':
+        return (str(lead.get('nombre') or '').split() or [''])[0]
+    return str(lead.get(field) or '')
+
+
+def render_batch(template, leads):
+    """Cuerpo del mensaje para cada lead (la plantilla se analiza una vez)."""
+    parts = compile_template(template)
+    return [''.join(p if isinstance(p, str) else _field_value(lead, p[0]) for p in parts)
+            for lead in leads]
+
+
+def normalize_phone(value):
+    """Teléfono en formato internacional sólo con dígitos, o None si no sirve."""
+    raw = str(value or '').strip()
+    digits = _digits(raw)
+    if raw.startswith('00'):
+        digits = digits[2:]
+    elif COUNTRY_CODE and not raw.startswith('+') and not digits.startswith(COUNTRY_CODE):
+        digits = COUNTRY_CODE + digits
+    return digits if len(digits) >= MIN_PHONE_DIGITS else None
+
+
+# ------------------------------ Público ------------------------------ #
+
+def audience_filters(filters=None):
+    """Filtros del público: los pedidos, con estado=Inactivo por defecto."""
+    merged = dict(DEFAULT_AUDIENCE)
+    merged.update({field: list(values) for field, values in (filters or {}).items()})
+    return merged
+
+
+def select_audience(source, filters=None, search=None):
+    """
+    Leads del público y destinatarios de la campaña.
+
+    `source` es cualquier objeto con `query_leads` (el servicio de Sheets o
+    la réplica). Devuelve (leads, teléfonos, omitidos): se omiten los leads
+    sin teléfono válido y los teléfonos repetidos.
+    """
+    leads = []
+    cursor = None
+    while True:
+        page = source.query_leads(filters=audience_filters(filters), search=search,
+                                  cursor=cursor, limit=QUERY_MAX_LIMIT)
+        leads.extend(page['data'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    selected, phones = [], []
+    seen = set()
+    for lead in leads:
+        phone = normalize_phone(lead.get('telefono'))
+        if phone is None or phone in seen:
+            continue
+        seen.add(phone)
+        selected.append(lead)
+        phones.append(phone)
+    return selected, phones, len(leads) - len(selected)
+
+
+# ------------------------------ Gateways ------------------------------ #
+
+class GatewayError(Exception):
+    """Error de envío; `retryable` indica si tiene sentido reintentar."""
+
+    def __init__(self, message, retryable=True, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class StubGateway:
+    """
+    Gateway local para desarrollo y pruebas: no envía nada.
+
+    Simula la latencia del proveedor y, opcionalmente, una proporción de
+    fallos transitorios (CAMPAIGN_STUB_LATENCY, CAMPAIGN_STUB_FAILURE_RATE).
+    """
+    name = 'stub'
+
+    def __init__(self):
+        self.rate_limit = float(os.environ.get('CAMPAIGN_STUB_RATE_LIMIT', 200))
+        self.latency = float(os.environ.get('CAMPAIGN_STUB_LATENCY', 0.05))
+        self.failure_rate = float(os.environ.get('CAMPAIGN_STUB_FAILURE_RATE', 0))
+
+    async def send(self, phone, body):
+        await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise GatewayError('Fallo simulado del gateway de prueba')
+        return f'stub-{uuid.uuid4().hex[:12]}'
+
+
+class WhatsAppCloudGateway:
+    """
+    WhatsApp Business Cloud API (mensajes de texto).
+
+    Usa WHATSAPP_TOKEN y WHATSAPP_PHONE_NUMBER_ID. Los 429 y 5xx se
+    reintentan; los demás errores (número inválido, fuera de la ventana de
+    conversación, etc.) marcan el mensaje como fallido.
+    """
+    name = 'whatsapp_cloud'
+
+    def __init__(self):
+        self.token = os.environ.get('WHATSAPP_TOKEN')
+        phone_number_id = os.environ.get('WHATSAPP_PHONE_NUMBER_ID')
+        if not self.token or not phone_number_id:
+            raise ValueError('Faltan WHATSAPP_TOKEN o WHATSAPP_PHONE_NUMBER_ID')
+        version = os.environ.get('WHATSAPP_API_VERSION', 'v19.0')
+        self.url = f'https://graph.facebook.com/{version}/{phone_number_id}/messages'
+        self.rate_limit = float(os.environ.get('WHATSAPP_RATE_LIMIT', 80))
+        self.timeout = float(os.environ.get('WHATSAPP_TIMEOUT', 15))
+        self._session = requests.Session()
+
+    def _post(self, phone, body):
+        return self._session.post(
+            self.url, timeout=self.timeout,
+            headers={'Authorization': f'Bearer {self.token}'},
+            json={'messaging_product': 'whatsapp', 'to': phone, 'type': 'text',
+                  'text': {'body': body}})
+
+    async def send(self, phone, body):
+        try:
+            response = await asyncio.to_thread(self._post, phone, body)
+        except requests.RequestException as e:
+            raise GatewayError(f'Error de conexión con WhatsApp: {e}')
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        if response.status_code == 200:
+            return (payload.get('messages') or [{}])[0].get('id')
+        error = (payload.get('error') or {}).get('message') or response.text[:200]
+        retryable = response.status_code == 429 or response.status_code >= 500
+        retry_after = response.headers.get('Retry-After')
+        raise GatewayError(f'WhatsApp {response.status_code}: {error}', retryable,
+                           float(retry_after) if retry_after and retry_after.isdigit() else None)
+
+
+# Gateways disponibles por nombre; se pueden registrar otros con register_gateway
+GATEWAYS = {'stub': StubGateway, 'whatsapp_cloud': WhatsAppCloudGateway}
+
+
+def register_gateway(name, factory):
+    """Registrar un gateway: `factory()` devuelve un objeto con `send` y `rate_limit`."""
+    GATEWAYS[name] = factory
+
+
+class AsyncRateLimiter:
+    """Token bucket para corrutinas: a lo sumo `rate` envíos por segundo."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        # Ráfaga de 100 ms para no perder tokens por la granularidad del sleep
+        self.capacity = max(1.0, rate / 10)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# ---------------------------- Despachador ---------------------------- #
+
+class CampaignDispatcher:
+    """
+    Despacho de campañas en segundo plano.
+
+    Un hilo corre un event loop de asyncio donde cada campaña en curso tiene
+    una cola con CONCURRENCY corrutinas de envío. Los envíos pasan por un
+    token bucket por gateway (compartido entre campañas) y los errores
+    transitorios se reintentan con espera exponencial. Los resultados se
+    acumulan y se escriben en la base cada FLUSH_INTERVAL segundos, junto con
+    un latido de la campaña.
+
+    El estado vive en la base: una campaña `running` la toma el primer
+    proceso que la reclama (UPDATE atómico sobre `claimed_by`), y si su
+    latido queda viejo (el proceso murió) otro la retoma desde los mensajes
+    todavía pendientes. Pausar o cancelar es cambiar el estado en la base;
+    el despachador lo ve en el siguiente guardado.
+
+    Con varios workers de gunicorn sólo despacha el que tiene el candado
+    LOCK_PATH, así que los token buckets (que son de cada proceso) no
+    multiplican el límite del gateway. Si ese worker muere el sistema libera
+    el candado, otro lo toma y retoma sus campañas cuando el latido vence.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._loop = None
+        self._thread = None
+        self._wake = None
+        self._gateways = {}
+        self._limiters = {}
+        self._running = {}
+        self._lock_file = None
+
+    def init_app(self, app):
+        """Arrancar el hilo del despachador (retoma las campañas en curso)."""
+        self.app = app
+        with app.app_context():
+            # WAL: las consultas de progreso no esperan a los guardados
+            db.session.execute(text('PRAGMA journal_mode=WAL'))
+            db.session.commit()
+        if self._thread is None or not self._thread.is_alive():
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run, name='campaigns', daemon=True)
+            self._thread.start()
+        registry.gauge('campaigns_running', 'Campañas despachándose en este proceso',
+                       lambda: len(self._running))
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._wake = asyncio.Event()
+        self._loop.run_until_complete(self._watch())
+
+    def wake(self):
+        """Buscar ya campañas para despachar (sin esperar SCAN_INTERVAL)."""
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # ----------------------------- Base ----------------------------- #
+
+    async def _db(self, fn, *args):
+        """Ejecutar `fn` en un hilo, con contexto de app, sin bloquear el loop."""
+        def call():
+            with self.app.app_context():
+                try:
+                    return fn(*args)
+                except Exception:
+                    db.session.rollback()
+                    raise
+        return await asyncio.to_thread(call)
+
+    def _claim(self):
+        """Reclamar las campañas en curso sin dueño o con el latido vencido."""
+        now = time.time()
+        ids = db.session.execute(
+            select(Campaign.id).where(Campaign.status == 'running')).scalars().all()
+        claimed = []
+        for campaign_id in ids:
+            if campaign_id in self._running:
+                continue
+            result = db.session.execute(
+                update(Campaign)
+                .where(Campaign.id == campaign_id, Campaign.status == 'running',
+                       (Campaign.claimed_by.is_(None))
+                       | (Campaign.heartbeat_at < now - STALE_AFTER))
+                .values(claimed_by=self.worker_id, heartbeat_at=now,
+                        started_at=func.coalesce(Campaign.started_at, now)))
+            if result.rowcount == 1:
+                campaign = db.session.get(Campaign, campaign_id)
+                claimed.append((campaign_id, campaign.gateway))
+        db.session.commit()
+        return claimed
+
+    def _pending(self, campaign_id, after_id):
+        rows = db.session.execute(
+            select(CampaignMessage.id, CampaignMessage.phone, CampaignMessage.body,
+                   CampaignMessage.attempts)
+            .where(CampaignMessage.campaign_id == campaign_id,
+                   CampaignMessage.status == 'pending', CampaignMessage.id > after_id)
+            .order_by(CampaignMessage.id).limit(PENDING_PAGE_SIZE))
+        return [tuple(row) for row in rows]
+
+    def _flush(self, campaign_id, results):
+        """Guardar resultados y latido; devuelve el estado actual de la campaña."""
+        if results:
+            db.session.execute(update(CampaignMessage), results)
+        counts = dict(db.session.execute(
+            select(CampaignMessage.status, func.count())
+            .where(CampaignMessage.campaign_id == campaign_id)
+            .group_by(CampaignMessage.status)).all())
+        owned = db.session.execute(
+            update(Campaign)
+            .where(Campaign.id == campaign_id, Campaign.claimed_by == self.worker_id)
+            .values(sent=counts.get('sent', 0), failed=counts.get('failed', 0),
+                    heartbeat_at=time.time())).rowcount == 1
+        db.session.commit()
+        if not owned:
+            return None
+        return db.session.execute(
+            select(Campaign.status).where(Campaign.id == campaign_id)).scalar()
+
+    def _finish(self, campaign_id, status=None, error=None):
+        """Liberar la campaña; con `status` la marca terminada si seguía en curso."""
+        values = {'claimed_by': None}
+        if status is not None:
+            values.update(status=status, error=error, finished_at=time.time())
+        db.session.execute(
+            update(Campaign)
+            .where(Campaign.id == campaign_id, Campaign.claimed_by == self.worker_id,
+                   Campaign.status == 'running')
+            .values(**values))
+        db.session.execute(
+            update(Campaign)
+            .where(Campaign.id == campaign_id, Campaign.claimed_by == self.worker_id)
+            .values(claimed_by=None))
+        db.session.commit()
+
+    # ---------------------------- Envío ---------------------------- #
+
+    def _lead(self):
+        """True si este proceso tiene (o acaba de tomar) el candado de despacho."""
+        if fcntl is None or self._lock_file is not None:
+            return True
+        f = open(LOCK_PATH, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        # Se conserva abierto: el candado dura lo que el proceso
+        self._lock_file = f
+        print(f'Despachador de campañas activo en {self.worker_id}')
+        return True
+
+    async def _watch(self):
+        while True:
+            try:
+                # Los demás workers esperan a que el candado quede libre
+                if self._lead():
+                    for campaign_id, gateway in await self._db(self._claim):
+                        self._running[campaign_id] = asyncio.create_task(
+                            self._dispatch(campaign_id, gateway))
+            except Exception as e:
+                print(f'Error al buscar campañas para despachar: {e}')
+            try:
+                await asyncio.wait_for(self._wake.wait(), SCAN_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _gateway(self, name):
+        gateway = self._gateways.get(name)
+        if gateway is None:
+            if name not in GATEWAYS:
+                raise ValueError(f'Gateway desconocido: {name}')
+            gateway = self._gateways[name] = GATEWAYS[name]()
+            self._limiters[name] = AsyncRateLimiter(getattr(gateway, 'rate_limit', 0))
+        return gateway, self._limiters[name]
+
+    async def _dispatch(self, campaign_id, gateway_name):
+        try:
+            try:
+                gateway, limiter = self._gateway(gateway_name)
+            except Exception as e:
+                print(f'No se pudo iniciar el gateway {gateway_name}: {e}')
+                await self._db(self._finish, campaign_id, 'failed', str(e))
+                return
+            await self._send_all(campaign_id, gateway, limiter)
+        except Exception as e:
+            print(f'Error al despachar la campaña {campaign_id}: {e}')
+            try:
+                await self._db(self._finish, campaign_id)
+            except Exception:
+                pass
+        finally:
+            self._running.pop(campaign_id, None)
+
+    async def _send_all(self, campaign_id, gateway, limiter):
+        queue = asyncio.Queue(maxsize=CONCURRENCY * 2)
+        results = []
+        stop = asyncio.Event()
+        workers = [asyncio.create_task(self._worker(queue, gateway, limiter, results, stop))
+                   for _ in range(CONCURRENCY)]
+        flusher = asyncio.create_task(self._flusher(campaign_id, results, stop))
+        try:
+            after_id = 0
+            while not stop.is_set():
+                batch = await self._db(self._pending, campaign_id, after_id)
+                if not batch:
+                    break
+                for message in batch:
+                    if stop.is_set():
+                        break
+                    await queue.put(message)
+                after_id = batch[-1][0]
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            flusher.cancel()
+            for worker in workers:
+                worker.cancel()
+        pending, results[:] = list(results), []
+        status = await self._db(self._flush, campaign_id, pending)
+        if status == 'running' and not stop.is_set():
+            await self._db(self._finish, campaign_id, 'completed')
+        else:
+            # Pausada, cancelada o tomada por otro proceso
+            await self._db(self._finish, campaign_id)
+
+    async def _flusher(self, campaign_id, results, stop):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            batch, results[:] = list(results), []
+            try:
+                status = await self._db(self._flush, campaign_id, batch)
+            except Exception as e:
+                print(f'Error al guardar el progreso de la campaña {campaign_id}: {e}')
+                results[:0] = batch
+                continue
+            if status != 'running':
+                stop.set()
+
+    async def _worker(self, queue, gateway, limiter, results, stop):
+        while True:
+            message = await queue.get()
+            if message is None:
+                return
+            if stop.is_set():
+                # Queda pendiente en la base para cuando se retome
+                continue
+            results.append(await self._send(message, gateway, limiter, stop))
+
+    async def _send(self, message, gateway, limiter, stop):
+        message_id, phone, body, attempts = message
+        while True:
+            await limiter.acquire()
+            attempts += 1
+            try:
+                provider_id = await gateway.send(phone, body)
+                campaign_messages.inc(status='sent', gateway=gateway.name)
+                return {'id': message_id, 'status': 'sent', 'attempts': attempts,
+                        'error': None, 'provider_id': provider_id, 'updated_at': time.time()}
+            except GatewayError as e:
+                error, retryable, retry_after = str(e), e.retryable, e.retry_after
+            except Exception as e:
+                error, retryable, retry_after = str(e), True, None
+            if not retryable or attempts >= MAX_ATTEMPTS:
+                campaign_messages.inc(status='failed', gateway=gateway.name)
+                return {'id': message_id, 'status': 'failed', 'attempts': attempts,
+                        'error': error, 'provider_id': None, 'updated_at': time.time()}
+            delay = retry_after or RETRY_BACKOFF * 2 ** (attempts - 1) * (0.5 + random.random())
+            try:
+                await asyncio.wait_for(stop.wait(), delay)
+            except asyncio.TimeoutError:
+                continue
+            return {'id': message_id, 'status': 'pending', 'attempts': attempts,
+                    'error': error, 'provider_id': None, 'updated_at': time.time()}
+
+    # --------------------------- Campañas --------------------------- #
+
+    def create(self, source, name, template, filters=None, search=None, gateway=None,
+               start=True):
+        """
+        Crear una campaña: selecciona el público, renderiza todos los
+        mensajes y los guarda como pendientes. Con `start` queda en curso y
+        el despachador la toma enseguida. Devuelve (campaña, omitidos).
+        """
+        gateway = gateway or DEFAULT_GATEWAY
+        if gateway not in GATEWAYS:
+            raise ValueError(f'Gateway desconocido: {gateway}')
+        if not str(name or '').strip():
+            raise ValueError('La campaña necesita un nombre')
+        compile_template(template)
+        leads, phones, skipped = select_audience(source, filters, search)
+        bodies = render_batch(template, leads)
+
+        now = time.time()
+        campaign = Campaign(name=name.strip(), template=template, gateway=gateway,
+                            audience=json.dumps({'filters': audience_filters(filters),
+                                                 'q': search}, ensure_ascii=False),
+                            status='running' if start else 'pending',
+                            total=len(leads), sent=0, failed=0, created_at=now)
+        db.session.add(campaign)
+        db.session.flush()
+        rows = [{'campaign_id': campaign.id, 'lead_id': str(lead['id']), 'phone': phone,
+                 'body': body, 'status': 'pending', 'attempts': 0, 'updated_at': now}
+                for lead, phone, body in zip(leads, phones, bodies)]
+        for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+            db.session.execute(insert(CampaignMessage), rows[i:i + INSERT_CHUNK_SIZE])
+        if not rows:
+            campaign.status = 'completed'
+            campaign.finished_at = now
+        db.session.commit()
+        if campaign.status == 'running':
+            self.wake()
+        return campaign, skipped
+
+    def set_status(self, campaign, action):
+        """Iniciar/retomar (`start`), pausar (`pause`) o cancelar (`cancel`)."""
+        allowed = {'start': ('pending', 'paused'), 'pause': ('running',),
+                   'cancel': ('pending', 'running', 'paused')}
+        if campaign.status not in allowed[action]:
+            raise ValueError(f'No se puede {_ACTIONS[action]} una campaña {campaign.status}')
+        if action == 'start':
+            campaign.status = 'running'
+        elif action == 'pause':
+            campaign.status = 'paused'
+        else:
+            campaign.status = 'cancelled'
+            campaign.finished_at = time.time()
+        db.session.commit()
+        if action == 'start':
+            self.wake()
+        return campaign
+
+
+_ACTIONS = {'start': 'iniciar', 'pause': 'pausar', 'cancel': 'cancelar'}
+
+
+# Instancia global del despachador
+campaign_dispatcher = CampaignDispatcher()
@@ -0,0 +1,291 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from src.services.lead_aggregates import PIPELINE_STAGES
+from src.services.lead_store import LEAD_HEADERS, parse_amount
+from src.utils.responses import dumps
+
+
+# Eventos que se conservan para que un cliente que se reconecta los recupere
+BUFFER_SIZE = int(os.environ.get('EVENTS_BUFFER_SIZE', 10000))
+# Si un refresco trae más cambios que esto se emite un único `resync`
+RESYNC_THRESHOLD = int(os.environ.get('EVENTS_RESYNC_THRESHOLD', 500))
+# Cada cuánto se revisa el sheet mientras haya clientes conectados (segundos)
+REFRESH_INTERVAL = float(os.environ.get('EVENTS_REFRESH_INTERVAL', 5))
+
+
+def _contribution(lead):
+    """Aporte de un lead a los agregados del dashboard (sólo los activos)."""
+    if lead is None or not lead['id'] or lead['estado'] != 'Activo':
+        return None
+    return lead['pipeline'], lead['fuente'], parse_amount(lead['monto_pendiente'])
+
+
+def aggregate_delta(old, new):
+    """
+    Diferencia que produce un cambio en los agregados de /dashboard/metrics
+    y /pipeline/stats (total de activos, por pipeline, por fuente y monto
+    por etapa). None si no cambia nada.
+    """
+    total = 0
+    pipeline = {}
+    sources = {}
+    values = {}
+    for lead, sign in ((old, -1), (new, 1)):
+        contribution = _contribution(lead)
+        if contribution is None:
+            continue
+        stage, source, amount = contribution
+        total += sign
+        pipeline[stage] = pipeline.get(stage, 0) + sign
+        sources[source] = sources.get(source, 0) + sign
+        if stage in PIPELINE_STAGES:
+            values[stage] = values.get(stage, 0.0) + sign * amount
+    delta = {'total_leads': total,
+             'pipeline': {k: v for k, v in pipeline.items() if v},
+             'sources': {k: v for k, v in sources.items() if v},
+             'pipeline_value': {k: round(v, 2) for k, v in values.items() if round(v, 2)}}
+    delta = {k: v for k, v in delta.items() if v}
+    return delta or None
+
+
+def lead_event(old, new):
+    """(tipo, datos) del evento de un lead creado, modificado o dado de baja."""
+    if old is None:
+        kind, data = 'lead.created', {'id': new['id'], 'lead': new}
+    else:
+        changes = {h: new[h] for h in LEAD_HEADERS if old.get(h) != new.get(h)}
+        if not changes:
+            return None
+        deleted = new['estado'] == 'Inactivo' and old['estado'] != 'Inactivo'
+        kind = 'lead.deleted' if deleted else 'lead.updated'
+        data = {'id': new['id'], 'changes': changes}
+    delta = aggregate_delta(old, new)
+    if delta:
+        data['delta'] = delta
+    return kind, data
+
+
+def _rows(store):
+    """id → fila (tupla de valores) de todo el snapshot, armadas por columnas."""
+    rows = list(zip(*(store.column(h) for h in LEAD_HEADERS)))
+    return {lead_id: rows[pos] for lead_id, pos in store.positions()}
+
+
+def diff_stores(previous, store):
+    """
+    Ids creados o modificados y borrados entre dos snapshots.
+
+    Si las filas anteriores siguen en el mismo orden (lo habitual: sólo se
+    editan o se agregan al final) se comparan columnas enteras y sólo se
+    recorren las que cambiaron; si no, fila a fila por id.
+    """
+    ids = store.column('id')
+    old_ids = previous.column('id')
+    size = len(old_ids)
+    if ids[:size] == old_ids:
+        positions = set(range(size, len(ids)))
+        for field in LEAD_HEADERS[1:]:
+            old, new = previous.column(field), store.column(field)[:size]
+            if old != new:
+                positions.update(i for i, (a, b) in enumerate(zip(old, new)) if a != b)
+        return [ids[pos] for pos in sorted(positions) if ids[pos]], []
+    old_rows = _rows(previous)
+    new_rows = _rows(store)
+    changed = [lead_id for lead_id, row in new_rows.items() if old_rows.get(lead_id) != row]
+    removed = [lead_id for lead_id in old_rows if lead_id not in new_rows]
+    return changed, removed
+
+
+def format_event(event_id, kind, data):
+    """Evento en formato text/event-stream."""
+    payload = dumps(data).decode('utf-8')
+    return f'id: {event_id}\nevent: {kind}\ndata: {payload}\n\n'
+
+
+class ChangeFeed:
+    """
+    Feed de cambios de los leads para /api/events (Server-Sent Events).
+
+    Se registra como listener de LeadCache: cada escritura del servicio
+    (`apply`) genera un evento compacto (lead creado, campos cambiados o baja,
+    con la diferencia en los agregados del dashboard) y cada refresco
+    (`rebuild`) se compara fila a fila con el snapshot anterior para emitir
+    también los cambios hechos directamente en el sheet o por otro proceso.
+
+    Los eventos llevan un número de secuencia y se guardan ya formateados en
+    un buffer circular de BUFFER_SIZE, compartido por todos los clientes; un
+    cliente que se reconecta con Last-Event-ID recibe lo que se perdió o, si
+    ya no está en el buffer, un `resync`.
+
+    Las secuencias son de cada proceso, pero el último evento de cada
+    refresco lleva además la huella del snapshot compartido: si el cliente se
+    reconecta a otro worker que tiene exactamente ese snapshot (sin
+    escrituras locales después) sigue desde ahí sin `resync`.
+    """
+
+    def __init__(self, refresh=None):
+        # Identifica este proceso: las secuencias de otro no son comparables
+        self.epoch = uuid.uuid4().hex[:8]
+        self._refresh = refresh
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=BUFFER_SIZE)
+        self._seq = 0
+        # Huella del snapshot con el que coincide el estado del feed; None
+        # tras una escritura local (ese estado no lo tienen otros procesos)
+        self._anchor = None
+        self._store = None
+        self._subscribers = 0
+        self._refresher = None
+
+    # ------------------------ Listener del cache ------------------------ #
+
+    def rebuild(self, store):
+        if store is None:
+            # Se conserva el snapshot anterior para comparar con el próximo
+            return
+        previous, self._store = self._store, store
+        anchor = f'{store.fingerprint:08x}'
+        events = []
+        if previous is not None:
+            events = self._diff_events(previous, store)
+        with self._cond:
+            for i, (kind, data) in enumerate(events):
+                # Sólo el último evento deja al cliente en el estado del snapshot
+                self._append(kind, data, anchor if i == len(events) - 1 else None)
+            self._anchor = anchor
+
+    def _diff_events(self, previous, store):
+        changed, removed = diff_stores(previous, store)
+        if len(changed) + len(removed) > RESYNC_THRESHOLD:
+            return [('resync', {'reason': 'refresh', 'changed': len(changed),
+                                'removed': len(removed)})]
+        events = []
+        for lead_id in changed:
+            pos = previous.position(lead_id)
+            old = previous.lead(pos) if pos is not None else None
+            event = lead_event(old, store.lead(store.position(lead_id)))
+            if event is not None:
+                events.append(event)
+        for lead_id in removed:
+            old = previous.lead(previous.position(lead_id))
+            data = {'id': lead_id}
+            delta = aggregate_delta(old, None)
+            if delta:
+                data['delta'] = delta
+            events.append(('lead.removed', data))
+        return events
+
+    def apply(self, old, new):
+        if not new.get('id'):
+            return
+        event = lead_event(old, new)
+        with self._cond:
+            self._anchor = None
+            if event is not None:
+                self._append(*event)
+
+    # ----------------------------- Eventos ----------------------------- #
+
+    def publish(self, kind, data):
+        with self._cond:
+            self._append(kind, data)
+
+    def _append(self, kind, data, anchor=None):
+        self._seq += 1
+        chunk = format_event(self.event_id(self._seq, anchor), kind, data)
+        self._events.append((self._seq, chunk))
+        self._cond.notify_all()
+
+    def event_id(self, seq, anchor=None):
+        if anchor is None:
+            return f'{self.epoch}-{seq}'
+        return f'{self.epoch}-{seq}-{anchor}'
+
+    def current(self):
+        """(secuencia, id) del estado actual, con la huella si la tiene."""
+        with self._cond:
+            return self._seq, self.event_id(self._seq, self._anchor)
+
+    def last_seq(self):
+        with self._cond:
+            return self._seq
+
+    def parse_id(self, event_id):
+        """
+        Secuencia desde la que retomar un Last-Event-ID, o None.
+
+        Ids de este proceso se retoman por secuencia; los de otro, sólo si
+        traen la huella del snapshot en el que está ahora este feed.
+        """
+        epoch, _, rest = str(event_id or '').partition('-')
+        seq, _, anchor = rest.partition('-')
+        with self._cond:
+            if epoch == self.epoch:
+                if not seq.isdigit() or int(seq) > self._seq:
+                    return None
+                return int(seq)
+            if anchor and anchor == self._anchor:
+                return self._seq
+            return None
+
+    def wait(self, after, timeout):
+        """
+        Eventos posteriores a la secuencia `after`, esperando hasta `timeout`
+        segundos si no hay. Devuelve (eventos, perdidos): con perdidos=True
+        algunos ya salieron del buffer y el cliente debe resincronizar.
+        """
+        with self._cond:
+            if self._seq <= after:
+                self._cond.wait(timeout)
+            if self._seq <= after:
+                return [], False
+            oldest = self._events[0][0] if self._events else self._seq + 1
+            if after + 1 < oldest:
+                return [], True
+            # Los eventos son consecutivos: se salta directo al siguiente
+            start = after + 1 - oldest
+            return [self._events[i] for i in range(start, len(self._events))], False
+
+    # ---------------------------- Clientes ---------------------------- #
+
+    def subscribe(self, limit=None):
+        """
+        Registrar un cliente conectado, salvo que ya haya `limit`; devuelve
+        False en ese caso. Mientras haya alguno, un hilo revisa el sheet cada
+        REFRESH_INTERVAL para que los cambios externos lleguen aunque nadie
+        lea los leads.
+        """
+        with self._cond:
+            if limit is not None and self._subscribers >= limit:
+                return False
+            self._subscribers += 1
+            if self._refresh is not None and (self._refresher is None
+                                              or not self._refresher.is_alive()):
+                self._refresher = threading.Thread(target=self._refresh_loop,
+                                                   name='events-refresh', daemon=True)
+                self._refresher.start()
+        return True
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+
+    def subscribers(self):
+        return self._subscribers
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(REFRESH_INTERVAL)
+            with self._cond:
+                if not self._subscribers:
+                    self._refresher = None
+                    return
+            try:
+                # Si el snapshot expiró se descarga y el diff llega por rebuild()
+                self._refresh()
+            except Exception as e:
+                print(f'Error al refrescar los leads para /events: {e}')
@@ -1,21 +1,221 @@
 import os
 import json
 import base64
+import re
 import tempfile
-from datetime import datetime
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google.oauth2 import service_account  
+import threading
+import time
+from datetime import datetime, timezone
+from src.services.change_feed import ChangeFeed
+from src.services.id_allocator import IdAllocator
+from src.services.lead_aggregates import LeadAggregates
+from src.services.lead_cache import LeadCache
+from src.services.lead_calendar import UPCOMING_TASKS_LIMIT, LeadCalendar
+from src.services.lead_dedupe import (DUPLICATE_POLICIES, DUPLICATE_POLICY, DuplicateIndex,
+                                      lead_keys, merge_fields, merge_plan)
+from src.services.lead_index import LeadIndex, _id_key
+from src.services.lead_store import LEAD_HEADERS, LeadColumns, row_to_lead
+from src.services.receivables import ReceivablesLedger
+from src.services.sharded_fetch import fetch_rows_sharded
+from src.services.sheets_transport import SheetsError, SheetsTransport
+from src.utils.metrics import registry
+from src.services.shared_snapshot import (SNAPSHOT_PATH, ChangeNotifier,
+                                          SnapshotReader, shared_lock)
+
+
+# Columnas editables por la API (índice dentro de la fila)
+FIELD_MAPPING = {
+    'nombre': 1, 'telefono': 2, 'email': 3, 'fuente': 4,
+    'registro': 5, 'producto_interes': 6, 'estado': 7,
+    'pipeline': 8, 'vendedor': 9, 'comentarios': 10,
+    'fecha_ultimo_contacto': 11, 'proxima_accion': 12,
+    'fecha_proxima_accion': 13, 'conversacion': 14,
+    'tipo_pago': 15, 'monto_pendiente': 16, 'comprobante': 17
+}
+
+# Rangos por llamada a values().batchUpdate
+BULK_CHUNK_SIZE = int(os.environ.get('LEADS_BULK_CHUNK_SIZE', 500))
+
+
+def merge_lead_values(current_values, lead_data):
+    """Aplicar los campos editables de `lead_data` sobre una fila existente."""
+    updated_values = list(current_values)
+    updated_values += [''] * (len(LEAD_HEADERS) - len(updated_values))
+    for field, index in FIELD_MAPPING.items():
+        if field in lead_data:
+            updated_values[index] = lead_data[field]
+
+    updated_values[19] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return updated_values
+
+
+REQUIRED_FIELDS = ('nombre', 'telefono')
+
+# Filas por llamada a values().append en las importaciones masivas
+IMPORT_CHUNK_SIZE = int(os.environ.get('LEADS_IMPORT_CHUNK_SIZE', 1000))
+MAX_IMPORT_ERRORS = 100
+# Grupos de duplicados que se devuelven en el resultado de la deduplicación
+MAX_DEDUPE_PROPOSALS = 1000
+
+# Filas por rango leído al exportar en streaming
+EXPORT_PAGE_SIZE = int(os.environ.get('LEADS_EXPORT_PAGE_SIZE', 2000))
+
+# Descarga completa: 'single' (un solo values().get) o 'sharded' (por rangos
+# de FETCH_SHARD_SIZE filas en FETCH_CONCURRENCY hilos)
+FETCH_MODE = os.environ.get('LEADS_FETCH_MODE', 'single')
+FETCH_SHARD_SIZE = int(os.environ.get('LEADS_FETCH_SHARD_SIZE', 5000))
+FETCH_CONCURRENCY = int(os.environ.get('LEADS_FETCH_CONCURRENCY', 4))
+FETCH_RETRIES = int(os.environ.get('LEADS_FETCH_RETRIES', 2))
+
+# Con el sheet inaccesible se sirve el último snapshot y sólo se reintenta
+# la descarga cada STALE_RETRY_INTERVAL segundos
+STALE_RETRY_INTERVAL = float(os.environ.get('LEADS_STALE_RETRY_INTERVAL', 10))
+# Espera máxima de la precarga de un worker por el snapshot del publicador
+WARMUP_SNAPSHOT_WAIT = float(os.environ.get('LEADS_WARMUP_SNAPSHOT_WAIT', 60))
+
+
+# El token de acceso se renueva en segundo plano con este margen (segundos)
+TOKEN_REFRESH_MARGIN = int(os.environ.get('GOOGLE_TOKEN_REFRESH_MARGIN', 300))
+
+_DISCOVERY_DOCUMENT = None
+
+
+def sheets_discovery_document():
+    """
+    Documento de descubrimiento de Sheets v4 incluido en googleapiclient.
+
+    Se lee del paquete (sin red) y se interpreta una sola vez; todos los
+    clientes del pool se construyen a partir de él.
+    """
+    global _DISCOVERY_DOCUMENT
+    if _DISCOVERY_DOCUMENT is None:
+        from googleapiclient.discovery_cache import get_static_doc
+        _DISCOVERY_DOCUMENT = json.loads(get_static_doc('sheets', 'v4'))
+    return _DISCOVERY_DOCUMENT
+
+
+def build_sheets_client(credentials):
+    """Cliente de Sheets v4 con el documento de descubrimiento estático."""
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(sheets_discovery_document(), credentials=credentials)
+
+
+def _seconds_to_expiry(credentials):
+    if credentials.expiry is None:
+        return 0
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return (credentials.expiry - now).total_seconds()
+
+
+def validate_lead_data(lead_data):
+    """Devolver el mensaje de error de validación, o None si el lead es válido."""
+    for field in REQUIRED_FIELDS:
+        if not lead_data.get(field):
+            return f'Campo requerido: {field}'
+    return None
+
+
+def _duplicate_policy(on_duplicate):
+    policy = on_duplicate or DUPLICATE_POLICY
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError('on_duplicate debe ser reject, merge o allow')
+    return policy
+
+
+def _duplicate_result(duplicates):
+    if duplicates:
+        error = f'Ya existe un lead con ese teléfono o email (#{duplicates[0]})'
+    else:
+        error = 'Hay otra alta en curso con ese teléfono o email'
+    return {'success': False, 'error': error, 'duplicate': True,
+            'duplicate_of': duplicates}
+
+
+def new_lead_values(lead_id, lead_data):
+    """Fila completa para un lead nuevo, con los valores por defecto."""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return [
+        lead_id,
+        lead_data.get('nombre', ''),
+        lead_data.get('telefono', ''),
+        lead_data.get('email', ''),
+        lead_data.get('fuente', ''),
+        lead_data.get('registro', datetime.now().strftime('%Y-%m-%d')),
+        lead_data.get('producto_interes', ''),
+        lead_data.get('estado', 'Activo'),
+        lead_data.get('pipeline', 'Prospección'),
+        lead_data.get('vendedor', ''),
+        lead_data.get('comentarios', ''),
+        lead_data.get('fecha_ultimo_contacto', ''),
+        lead_data.get('proxima_accion', ''),
+        lead_data.get('fecha_proxima_accion', ''),
+        lead_data.get('conversacion', ''),
+        lead_data.get('tipo_pago', ''),
+        lead_data.get('monto_pendiente', ''),
+        lead_data.get('comprobante', ''),
+        now,
+        now
+    ]
+
+
+def _cell(value):
+    """Representar un valor como lo devuelve la API (texto)."""
+    return '' if value is None else str(value)
+
+
+def _column_letter(index):
+    """Letra de la columna `index` (0 = A); la hoja Leads llega hasta T."""
+    return chr(ord('A') + index)
+
+
+def _updated_row(result):
+    """Primera fila escrita según la respuesta de values().append."""
+    updated_range = result.get('updates', {}).get('updatedRange', '')
+    match = re.search(r'![A-Z]+(\d+)', updated_range)
+    return int(match.group(1)) if match else None
 
 
 class GoogleSheetsService:
-    def __init__(self):
+    def __init__(self, client_factory=None):
         self.SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
         self.service = None
+        self._credentials = None
         self.spreadsheet_id = None
+        # Todas las llamadas a la API pasan por el transporte (pool de
+        # clientes, cuotas y reintentos); `client_factory` permite inyectar
+        # otro cliente, por ejemplo un backend falso
+        self._client_factory = client_factory
+        self.transport = SheetsTransport(client_factory or self._new_client)
+        self._degraded = None
+        # La autenticación es perezosa: se hace en el primer uso
+        self._auth_lock = threading.Lock()
+        self._auth_error = None
+        self._token_refresher = None
+        self.cache = LeadCache()
+        self.index = LeadIndex()
+        self.cache.add_listener(self.index)
+        self.aggregates = LeadAggregates()
+        self.cache.add_listener(self.aggregates)
+        self.calendar = LeadCalendar()
+        self.cache.add_listener(self.calendar)
+        self.receivables = ReceivablesLedger()
+        self.cache.add_listener(self.receivables)
+        self.duplicates = DuplicateIndex()
+        self.cache.add_listener(self.duplicates)
+        # Eventos de cambios para /api/events
+        self.changes = ChangeFeed(refresh=self._snapshot)
+        self.cache.add_listener(self.changes)
+        # Con varios workers (LEADS_SNAPSHOT_PATH) el snapshot lo descarga un
+        # proceso publicador y cada worker lo lee del archivo compartido
+        self.snapshot_reader = None
+        if SNAPSHOT_PATH:
+            self.snapshot_reader = SnapshotReader(SNAPSHOT_PATH)
+            self.cache.add_listener(ChangeNotifier(SNAPSHOT_PATH))
+        # Celda donde se persiste el próximo id libre (hoja de metadatos)
+        self.meta_range = os.environ.get('LEADS_META_RANGE', 'Meta!B1')
+        self.ids = IdAllocator()
+        # Sin celda de contador: próximo id mínimo dentro de este proceso
+        self._unsaved_next_id = 0
 
     def authenticate(self):
         """
@@ -77,8 +277,11 @@ class GoogleSheetsService:
         # -------------------------------------------
         # Autentica con la API de Google Sheets usando credenciales
         # decodificadas desde una variable de entorno Base64.
+        # No hace llamadas de red: el cliente se arma con el documento de
+        # descubrimiento incluido y el token se obtiene en segundo plano.
         # -------------------------------------------
         try:
+            from google.oauth2 import service_account
             creds_base64 = os.environ.get("GOOGLE_CREDENTIALS_BASE64")
             if not creds_base64:
                 raise ValueError(
@@ -90,184 +293,905 @@ class GoogleSheetsService:
             creds = service_account.Credentials.from_service_account_info(
                 creds_dict, scopes=self.SCOPES
             )
-            self.service = build("sheets", "v4", credentials=creds)
+            self._credentials = creds
+            self.service = build_sheets_client(creds)
+            self.transport.reset()
+            self._auth_error = None
+            self._start_token_refresher()
             print("Autenticado con Google Sheets correctamente.")
+            return True
         except Exception as e:
+            self._auth_error = str(e)
             raise Exception(f"Error al autenticar con Google Sheets: {e}")
 
+    def _ensure_authenticated(self):
+        """Autenticar en el primer uso si hay credenciales configuradas."""
+        if self.service is not None or self._client_factory is not None:
+            return
+        with self._auth_lock:
+            if self.service is None and os.environ.get("GOOGLE_CREDENTIALS_BASE64"):
+                self.authenticate()
+
+    def _start_token_refresher(self):
+        if self._token_refresher is None or not self._token_refresher.is_alive():
+            self._token_refresher = threading.Thread(
+                target=self._refresh_token_loop, name='sheets-token', daemon=True)
+            self._token_refresher.start()
+
+    def _refresh_token_loop(self):
+        """
+        Renovar el token de acceso antes de que expire, para que las
+        peticiones no tengan que esperar la renovación.
+        """
+        from google.auth.transport.requests import Request
+        while True:
+            creds = self._credentials
+            try:
+                if not creds.valid or _seconds_to_expiry(creds) < TOKEN_REFRESH_MARGIN:
+                    creds.refresh(Request())
+                delay = _seconds_to_expiry(creds) - TOKEN_REFRESH_MARGIN
+                self._auth_error = None
+            except Exception as e:
+                print(f'Error al renovar el token de Google: {e}')
+                self._auth_error = str(e)
+                delay = 30
+            time.sleep(max(delay, 30))
+
+    def warm_up(self):
+        """
+        Autenticar y descargar el snapshot en un hilo aparte, para que el
+        arranque no espere a Google. Con LEADS_SNAPSHOT_PATH no se descarga:
+        se espera a que el publicador deje el snapshot y se carga de ahí.
+        """
+        configured = (self.service is not None or self._client_factory is not None
+                      or os.environ.get("GOOGLE_CREDENTIALS_BASE64"))
+        if not configured or not self.spreadsheet_id:
+            return None
+
+        def run():
+            try:
+                self._require_ready()
+                if self.snapshot_reader is not None and not self._wait_for_published():
+                    # Sin snapshot publicado todavía: no se descarga el sheet
+                    # desde cada worker; la primera petición lo resolverá
+                    print('Precarga omitida: el publicador aún no dejó el snapshot')
+                    return
+                self._snapshot()
+            except Exception as e:
+                print(f'No se pudo precargar Google Sheets: {e}')
+
+        thread = threading.Thread(target=run, name='sheets-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def _wait_for_published(self):
+        """Esperar hasta WARMUP_SNAPSHOT_WAIT segundos el snapshot del publicador."""
+        deadline = time.monotonic() + WARMUP_SNAPSHOT_WAIT
+        while not os.path.exists(SNAPSHOT_PATH):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.5)
+        return True
+
+    def readiness(self):
+        """Estado de la conexión con Sheets para el health check (sin red)."""
+        creds = self._credentials
+        if self._auth_error:
+            state = 'error'
+        elif self.service is None and self._client_factory is None:
+            state = ('pending' if os.environ.get("GOOGLE_CREDENTIALS_BASE64")
+                     else 'not_configured')
+        elif creds is not None and not creds.valid:
+            state = 'pending'
+        elif self._degraded is not None:
+            state = 'degraded'
+        else:
+            state = 'ready'
+        degraded = self._degraded
+        return {
+            'state': state,
+            'spreadsheet_configured': bool(self.spreadsheet_id),
+            'token_valid': creds.valid if creds is not None else None,
+            'snapshot_loaded': self.cache.peek() is not None,
+            'error': self._auth_error or (degraded['error'] if degraded else None),
+        }
+
     def set_spreadsheet_id(self, spreadsheet_id):
         """Establecer el ID del spreadsheet a usar."""
+        if spreadsheet_id != self.spreadsheet_id:
+            self.cache.invalidate()
+            self.ids.reset()
+            self._unsaved_next_id = 0
         self.spreadsheet_id = spreadsheet_id
 
-    def get_all_leads(self):
-        """Obtener todos los leads del spreadsheet."""
-        if not self.service or not self.spreadsheet_id:
+    def _require_ready(self):
+        self._ensure_authenticated()
+        if not (self.service or self._client_factory) or not self.spreadsheet_id:
             raise Exception("Servicio no autenticado o spreadsheet_id no establecido")
 
+    def get_all_leads(self):
+        """Obtener todos los leads (desde el cache si el snapshot está vigente)."""
+        return self._snapshot().leads()
+
+    def _snapshot(self):
+        """Snapshot columnar vigente (LeadColumns), refrescándolo si expiró."""
+        self._require_ready()
+
+        stale = self.cache.peek()
+        degraded = self._degraded
+        if (degraded is not None and stale is not None
+                and time.time() - degraded['checked_at'] < STALE_RETRY_INTERVAL):
+            return stale
         try:
-            range_name = 'Leads!A2:T'
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id,
-                range=range_name
-            ).execute()
+            store = self.cache.get(self._fetch_leads)
+        except SheetsError as error:
+            print(f'Error al obtener leads: {error}')
+            now = time.time()
+            self._degraded = {'error': str(error), 'status': error.status,
+                              'since': degraded['since'] if degraded else now,
+                              'checked_at': now}
+            stale = self.cache.peek()
+            if stale is None:
+                raise
+            return stale
+        self._degraded = None
+        return store
+
+    def degraded(self):
+        """
+        Estado de degradación de las lecturas, o None si el último refresco
+        funcionó. Mientras no sea None se están sirviendo datos viejos.
+        """
+        degraded = self._degraded
+        if degraded is None:
+            return None
+        return {'stale': True,
+                'error': degraded['error'],
+                'status': degraded['status'],
+                'since': datetime.fromtimestamp(degraded['since']).strftime('%Y-%m-%d %H:%M:%S'),
+                'data_age': self.cache.get_stats()['age']}
+
+    def _fetch_leads(self):
+        """
+        Cargar todos los leads: del snapshot publicado si hay uno vigente,
+        o descargándolos del spreadsheet.
+        """
+        if self.snapshot_reader is not None:
+            store = self.snapshot_reader.load(self.spreadsheet_id, self.cache.peek())
+            if store is not None:
+                return store
+        return self._download_leads()
 
-            values = result.get('values', [])
+    def _download_leads(self):
+        """Descargar todos los leads del spreadsheet."""
+        if FETCH_MODE == 'sharded':
+            last_row = self._sheet_row_count()
+            if last_row > LeadCache.FIRST_ROW + FETCH_SHARD_SIZE:
+                rows = fetch_rows_sharded(
+                    self._read_range, LeadCache.FIRST_ROW, last_row,
+                    shard_size=FETCH_SHARD_SIZE,
+                    concurrency=FETCH_CONCURRENCY,
+                    retries=FETCH_RETRIES)
+                return LeadColumns.from_rows(rows)
 
-            headers = [
-                "id", "nombre", "telefono", "email", "fuente", "registro",
-                "producto_interes", "estado", "pipeline", "vendedor", "comentarios",
-                "fecha_ultimo_contacto", "proxima_accion", "fecha_proxima_accion",
-                "conversacion", "tipo_pago", "monto_pendiente", "comprobante",
-                "fecha_creacion", "fecha_modificacion"
-            ]
+        range_name = 'Leads!A2:T'
+        result = self.transport.read(lambda api: api.values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=range_name
+        ), key=(self.spreadsheet_id, range_name))
 
-            leads = []
+        return LeadColumns.from_rows(result.get('values', []))
+
+    def _read_range(self, start, end):
+        """Filas [start, end] de la hoja Leads."""
+        range_name = f'Leads!A{start}:T{end}'
+        result = self.transport.read(lambda api: api.values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=range_name
+        ), key=(self.spreadsheet_id, range_name))
+        return result.get('values', [])
+
+    def _new_client(self):
+        """Nuevo cliente de Sheets para el pool del transporte."""
+        if self._credentials is None:
+            # Servicio asignado a mano: no se puede clonar, se comparte
+            return self.service
+        return build_sheets_client(self._credentials)
+
+    def _sheet_row_count(self):
+        """Cantidad de filas de la grilla de la hoja Leads (metadatos)."""
+        result = self.transport.read(lambda api: api.get(
+            spreadsheetId=self.spreadsheet_id,
+            ranges=['Leads'],
+            fields='sheets(properties(title,gridProperties(rowCount)))'
+        ), key=(self.spreadsheet_id, 'rowCount'))
+        for sheet in result.get('sheets', []):
+            properties = sheet.get('properties', {})
+            if properties.get('title') == 'Leads':
+                return properties.get('gridProperties', {}).get('rowCount', 0)
+        return 0
+
+    def iter_leads(self, page_size=None):
+        """
+        Recorrer el sheet por rangos de `page_size` filas, lead a lead.
+
+        No usa ni llena el snapshot: cada página se descarga, se emite y se
+        descarta, así que la memoria no depende del tamaño del sheet.
+
+        Se pagina hasta el rowCount de la grilla, igual que la descarga por
+        rangos: la API omite las filas vacías del final de cada rango, así
+        que una página corta no indica que el sheet terminó.
+        """
+        self._require_ready()
+
+        page_size = page_size or EXPORT_PAGE_SIZE
+        row_count = self._sheet_row_count()
+        start = LeadCache.FIRST_ROW
+        while True:
+            end = start + page_size - 1
+            values = self._read_range(start, end)
             for row in values:
-                while len(row) < len(headers):
-                    row.append('')
-                lead = {headers[i]: row[i] for i in range(len(headers))}
-                leads.append(lead)
+                yield row_to_lead(row)
+            start = end + 1
+            # Una página llena al final de la grilla: se agregaron filas
+            if start > row_count and len(values) < page_size:
+                return
 
-            return leads
+    def _fetch_row(self, row_number):
+        """Descargar una sola fila del sheet (rellenada a 20 columnas)."""
+        values = self._read_range(row_number, row_number)
+        row = list(values[0]) if values else []
+        return row + [''] * (len(LEAD_HEADERS) - len(row))
 
-        except HttpError as error:
-            print(f'Error al obtener leads: {error}')
-            return []
+    def _read_lead_row(self, lead_id):
+        """
+        Localizar y leer la fila de un lead usando el índice id → fila.
 
-    def create_lead(self, lead_data):
-        """Crear un nuevo lead en el spreadsheet."""
-        if not self.service or not self.spreadsheet_id:
-            raise Exception("Servicio no autenticado o spreadsheet_id no establecido")
+        Si el índice no conoce el id se consulta el snapshot (refrescándolo si
+        expiró); si la fila ya no corresponde a ese id (filas movidas a mano),
+        se fuerza un refresco una vez y se reintenta.
+        Devuelve (None, None) si el lead no existe.
+        """
+        lead_id = str(lead_id)
+        for attempt in range(2):
+            row_number = self.cache.row_of(lead_id)
+            if row_number is None and attempt == 0:
+                self._snapshot()
+                row_number = self.cache.row_of(lead_id)
+            if row_number is None:
+                return None, None
+            row = self._fetch_row(row_number)
+            if row[0] == lead_id:
+                return row_number, row
+            self.cache.invalidate()
+            self._snapshot()
+        return None, None
+
+    def get_lead(self, lead_id):
+        """
+        Obtener un lead por id.
+
+        Se responde desde el snapshot si está vigente; si no, se lee sólo la
+        fila indicada por el índice id → fila.
+        """
+        self._require_ready()
+
+        lead_id = str(lead_id)
+        lead = self.cache.lookup(lead_id)
+        if lead is not None:
+            return lead
+        if self.cache.row_of(lead_id) is None:
+            # Sin índice todavía: una descarga completa lo construye
+            self._snapshot()
+            lead = self.cache.lookup(lead_id)
+            if lead is not None or self.cache.row_of(lead_id) is None:
+                return lead
 
         try:
-            existing_leads = self.get_all_leads()
-            next_id = len(existing_leads) + 1
+            row_number, row = self._read_lead_row(lead_id)
+        except SheetsError as error:
+            print(f'Error al obtener lead: {error}')
+            # Sin acceso al sheet: el snapshot, aunque esté expirado
+            stale = self.cache.peek()
+            pos = stale.position(lead_id) if stale is not None else None
+            if pos is None:
+                raise
+            return stale.lead(pos)
+        if row_number is None:
+            return None
+        lead = row_to_lead(row)
+        self.cache.upsert(lead, row=row_number)
+        return lead
 
-            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            values = [
-                next_id,
-                lead_data.get('nombre', ''),
-                lead_data.get('telefono', ''),
-                lead_data.get('email', ''),
-                lead_data.get('fuente', ''),
-                lead_data.get('registro', datetime.now().strftime('%Y-%m-%d')),
-                lead_data.get('producto_interes', ''),
-                lead_data.get('estado', 'Activo'),
-                lead_data.get('pipeline', 'Prospección'),
-                lead_data.get('vendedor', ''),
-                lead_data.get('comentarios', ''),
-                lead_data.get('fecha_ultimo_contacto', ''),
-                lead_data.get('proxima_accion', ''),
-                lead_data.get('fecha_proxima_accion', ''),
-                lead_data.get('conversacion', ''),
-                lead_data.get('tipo_pago', ''),
-                lead_data.get('monto_pendiente', ''),
-                lead_data.get('comprobante', ''),
-                now,
-                now
-            ]
-
-            range_name = 'Leads!A:T'
-            body = {'values': [values]}
-
-            self.service.spreadsheets().values().append(
-                spreadsheetId=self.spreadsheet_id,
-                range=range_name,
-                valueInputOption='USER_ENTERED',
-                body=body
-            ).execute()
+    def query_leads(self, filters=None, search=None, match='substring',
+                    sort='id', descending=False, cursor=None, limit=None):
+        """Filtrar, buscar y paginar leads usando los índices en memoria."""
+        self._snapshot()
+        kwargs = {} if limit is None else {'limit': limit}
+        return self.index.query(filters=filters, search=search, match=match,
+                                sort=sort, descending=descending,
+                                cursor=cursor, **kwargs)
+
+    def data_version(self):
+        """Versión de los datos del snapshot vigente (base de los ETags)."""
+        self._snapshot()
+        return self.cache.data_version
+
+    def get_cache_stats(self):
+        """Contadores de hits/misses/refrescos del cache de leads."""
+        return self.cache.get_stats()
+
+    def get_transport_stats(self):
+        """Contadores de llamadas, reintentos y esperas por cuota."""
+        return self.transport.get_stats()
 
+    def create_lead(self, lead_data, on_duplicate=None):
+        """
+        Crear un nuevo lead en el spreadsheet.
+
+        Si el teléfono o el email ya son de otro lead, según `on_duplicate`
+        (por defecto LEADS_ON_DUPLICATE) se rechaza (`reject`), se completa el
+        lead existente con los datos nuevos (`merge`) o se crea igual
+        (`allow`).
+        """
+        self._require_ready()
+        policy = _duplicate_policy(on_duplicate)
+
+        keys = ()
+        try:
+            if policy != 'allow':
+                # Contra el índice del último snapshot, aunque esté expirado:
+                # un alta no fuerza una descarga completa del sheet
+                keys = lead_keys(lead_data)
+                duplicates, reserved = self.duplicates.reserve(keys)
+                if reserved and not self.duplicates.ready():
+                    duplicates = self._duplicates_in_sheet(keys)
+                    if duplicates:
+                        self.duplicates.release(keys)
+                        reserved = False
+                if not reserved:
+                    if duplicates and policy == 'merge':
+                        return self._merge_into(duplicates[0], lead_data)
+                    return _duplicate_result(duplicates)
+            try:
+                next_id = self.ids.allocate(self._reserve_id_block)[0]
+                self._append_rows([new_lead_values(next_id, lead_data)])
+            finally:
+                self.duplicates.release(keys)
             return {'success': True, 'id': next_id}
 
-        except HttpError as error:
+        except SheetsError as error:
             print(f'Error al crear lead: {error}')
-            return {'success': False, 'error': str(error)}
+            return {'success': False, 'error': str(error),
+                    'retryable': error.retryable}
 
-    def update_lead(self, lead_id, lead_data):
-        """Actualizar un lead existente."""
-        if not self.service or not self.spreadsheet_id:
-            raise Exception("Servicio no autenticado o spreadsheet_id no establecido")
+    def _duplicates_in_sheet(self, keys):
+        """
+        Ids con alguna de `keys` leyendo sólo las columnas A:D del sheet;
+        para cuando todavía no hay snapshot con el que armar el índice.
+        """
+        if not keys:
+            return []
+        result = self.transport.read(lambda api: api.values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range='Leads!A2:D'
+        ), key=(self.spreadsheet_id, 'Leads!A2:D'))
+        keys = set(keys)
+        found = set()
+        for row in result.get('values', []):
+            row = row + [''] * (4 - len(row))
+            lead = {'telefono': row[2], 'email': row[3]}
+            if row[0] and keys.intersection(lead_keys(lead)):
+                found.add(_cell(row[0]))
+        return sorted(found, key=_id_key)
+
+    def _known_lead(self, lead_id):
+        """
+        Lead actual para fusionar: del último snapshot (aunque esté
+        expirado) o, si no está ahí, leyendo su fila. None si no existe.
+        """
+        store = self.cache.peek()
+        pos = store.position(lead_id) if store is not None else None
+        if pos is not None:
+            return store.lead(pos)
+        return self.get_lead(lead_id)
+
+    def _merge_into(self, lead_id, lead_data):
+        """Completar un lead existente con los datos de un alta duplicada."""
+        current = self._known_lead(lead_id)
+        if current is None:
+            return {'success': False, 'error': f'Lead #{lead_id} no encontrado para fusionar',
+                    'not_found': True}
+        patch = merge_fields(current, lead_data)
+        if patch:
+            result = self.update_lead(lead_id, patch)
+            if not result['success']:
+                return result
+        return {'success': True, 'id': lead_id, 'merged': True, 'fields': sorted(patch)}
+
+    def _append_rows(self, rows):
+        """Agregar filas con un solo values().append y actualizar el snapshot."""
+        result = self.transport.write(lambda api: api.values().append(
+            spreadsheetId=self.spreadsheet_id,
+            range='Leads!A:T',
+            valueInputOption='USER_ENTERED',
+            insertDataOption='INSERT_ROWS',
+            body={'values': rows}
+        ), idempotent=False)
+        first_row = _updated_row(result)
+        self.cache.upsert_many([
+            (row_to_lead([_cell(v) for v in values]),
+             first_row + i if first_row is not None else None)
+            for i, values in enumerate(rows)])
+
+    def import_leads(self, rows, progress=None, on_duplicate=None):
+        """
+        Importar leads en bloque desde un iterable de (línea, datos, error).
+
+        Cada fila se valida con las mismas reglas que create_lead; las válidas
+        reciben ids en bloque y se escriben en lotes de IMPORT_CHUNK_SIZE filas
+        con un values().append por lote. `progress` (dict) se actualiza en vivo
+        para poder consultarlo desde otra petición.
+
+        Las filas cuyo teléfono o email ya existen (en el sheet o en una fila
+        anterior del mismo archivo) se rechazan o se fusionan según
+        `on_duplicate`, igual que en create_lead; las fusiones con leads
+        existentes se escriben al final con update_leads_bulk.
+        """
+        self._require_ready()
+        policy = _duplicate_policy(on_duplicate)
+        if policy != 'allow':
+            self._snapshot()
+
+        if progress is None:
+            progress = {}
+        progress.update({'processed': 0, 'created': 0, 'failed': 0,
+                         'duplicates': 0, 'merged': 0, 'errors': []})
+        # Leads existentes a completar: id → (lead fusionado, campos cambiados)
+        merges = {}
+
+        def fail(line_number, error):
+            progress['failed'] += 1
+            if len(progress['errors']) < MAX_IMPORT_ERRORS:
+                progress['errors'].append({'line': line_number, 'error': error})
+
+        def flush(batch):
+            ids = self.ids.allocate(self._reserve_id_block, len(batch))
+            values = [new_lead_values(lead_id, data)
+                      for lead_id, (_, data) in zip(ids, batch)]
+            try:
+                self._append_rows(values)
+                progress['created'] += len(batch)
+            except SheetsError as error:
+                print(f'Error al importar leads: {error}')
+                for line_number, _ in batch:
+                    fail(line_number, str(error))
+
+        def duplicate(line_number, data, keys):
+            """Resolver una fila duplicada; devuelve False si no lo es."""
+            existing = self.duplicates.find(data)
+            if existing:
+                progress['duplicates'] += 1
+                if policy == 'reject':
+                    fail(line_number, f'Duplicado del lead #{existing[0]}')
+                    return True
+                lead_id = existing[0]
+                if lead_id not in merges:
+                    try:
+                        current = self._known_lead(lead_id)
+                    except SheetsError as error:
+                        fail(line_number, f'No se pudo leer el lead #{lead_id}: {error}')
+                        return True
+                    if current is None:
+                        fail(line_number, f'Lead #{lead_id} no encontrado para fusionar')
+                        return True
+                    merges[lead_id] = (dict(current), {})
+                merged, patch = merges[lead_id]
+                changes = merge_fields(merged, data)
+                merged.update(changes)
+                patch.update(changes)
+                progress['merged'] += 1
+                return True
+            earlier = next((pending[key] for key in keys if key in pending), None)
+            if earlier is None:
+                return False
+            progress['duplicates'] += 1
+            if policy == 'reject':
+                fail(line_number, f'Duplicado de la línea {earlier[0]}')
+            else:
+                earlier[1].update(merge_fields(earlier[1], data))
+                progress['merged'] += 1
+            return True
+
+        batch = []
+        # Claves de las filas del lote todavía no escritas → (línea, datos)
+        pending = {}
+        for line_number, data, error in rows:
+            progress['processed'] += 1
+            if data is not None:
+                # Las celdas vacías toman el valor por defecto
+                data = {k: v for k, v in data.items()
+                        if k in FIELD_MAPPING and v not in ('', None)}
+                error = validate_lead_data(data)
+            if error:
+                fail(line_number, error)
+                continue
+            if policy != 'allow':
+                keys = lead_keys(data)
+                if duplicate(line_number, data, keys):
+                    continue
+                for key in keys:
+                    pending[key] = (line_number, data)
+            batch.append((line_number, data))
+            if len(batch) >= IMPORT_CHUNK_SIZE:
+                flush(batch)
+                batch = []
+                # Ya escritas: desde ahora las encuentra el índice
+                pending = {}
+        if batch:
+            flush(batch)
+
+        patches = [{'id': lead_id, 'fields': patch}
+                   for lead_id, (_, patch) in merges.items() if patch]
+        if patches:
+            result = self.update_leads_bulk(patches)
+            for item in result['results']:
+                if not item['success']:
+                    fail(None, f"No se pudo fusionar con el lead #{item['id']}: {item['error']}")
+
+        return {'success': progress['failed'] == 0, **progress}
+
+    def _max_lead_id(self, store=None, fresh=False):
+        """
+        Mayor id numérico del snapshot o, sin snapshot (o con `fresh`), de la
+        columna A leída en el momento.
+        """
+        if store is None and not fresh:
+            store = self.cache.peek()
+        if store is not None:
+            ids = store.column('id')
+        else:
+            result = self.transport.read(lambda api: api.values().get(
+                spreadsheetId=self.spreadsheet_id,
+                range='Leads!A2:A'
+            ))
+            ids = (row[0] for row in result.get('values', []) if row)
+        max_id = 0
+        for lead_id in ids:
+            try:
+                max_id = max(max_id, int(float(lead_id)))
+            except (TypeError, ValueError):
+                continue
+        return max_id
+
+    def _reserve_id_block(self, size):
+        """
+        Reservar `size` ids en el contador persistido en `meta_range`.
+
+        Devuelve (primer id, cantidad reservada). Si la celda está vacía se
+        inicializa con el mayor id existente + 1. Si el contador no se puede
+        leer (no existe la hoja de metadatos) se reserva un solo id, a partir
+        del mayor id de la columna A leído en ese momento.
+        """
+        if SNAPSHOT_PATH:
+            # Varios workers en la máquina: la lectura y escritura del
+            # contador no deben intercalarse
+            with shared_lock(SNAPSHOT_PATH):
+                return self._reserve_id_block_unlocked(size)
+        return self._reserve_id_block_unlocked(size)
 
+    def _reserve_id_block_unlocked(self, size):
         try:
-            row_number = int(lead_id) + 1
-            current_range = f'Leads!A{row_number}:T{row_number}'
-            current_result = self.service.spreadsheets().values().get(
+            result = self.transport.read(lambda api: api.values().get(
                 spreadsheetId=self.spreadsheet_id,
-                range=current_range
-            ).execute()
+                range=self.meta_range
+            ))
+            stored = result.get('values', [['']])[0]
+        except SheetsError as error:
+            if error.retryable:
+                raise
+            print(f'Sin contador de ids en {self.meta_range}: {error}')
+            return self._reserve_unsaved_id(), 1
 
-            current_values = current_result.get('values', [[]])[0]
-            while len(current_values) < 20:
-                current_values.append('')
+        try:
+            counter = int(float(stored[0])) if stored and str(stored[0]).strip() else None
+        except ValueError:
+            counter = None
 
-            updated_values = current_values.copy()
-            field_mapping = {
-                'nombre': 1, 'telefono': 2, 'email': 3, 'fuente': 4,
-                'registro': 5, 'producto_interes': 6, 'estado': 7,
-                'pipeline': 8, 'vendedor': 9, 'comentarios': 10,
-                'fecha_ultimo_contacto': 11, 'proxima_accion': 12,
-                'fecha_proxima_accion': 13, 'conversacion': 14,
-                'tipo_pago': 15, 'monto_pendiente': 16, 'comprobante': 17
-            }
+        if counter is None:
+            start = self._max_lead_id(fresh=True) + 1
+        else:
+            # Filas agregadas a mano con ids mayores no deben repetirse
+            store = self.cache.peek()
+            start = max(counter, self._max_lead_id(store) + 1) if store is not None else counter
 
-            for field, index in field_mapping.items():
-                if field in lead_data:
-                    updated_values[index] = lead_data[field]
+        self.transport.write(lambda api: api.values().update(
+            spreadsheetId=self.spreadsheet_id,
+            range=self.meta_range,
+            valueInputOption='RAW',
+            body={'values': [[start + size]]}
+        ))
+        return start, size
 
-            updated_values[19] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    def _reserve_unsaved_id(self):
+        """
+        Un id sin contador en el sheet: el mayor de la columna A + 1, sin
+        bajar de los ya entregados. Con LEADS_SNAPSHOT_PATH el último entregado
+        se guarda junto al snapshot (bajo el candado compartido) para que otro
+        worker que todavía no ve la fila nueva no repita el id.
+        """
+        start = max(self._max_lead_id(fresh=True) + 1, self._unsaved_next_id)
+        path = SNAPSHOT_PATH + '.next-id' if SNAPSHOT_PATH else None
+        if path:
+            try:
+                with open(path) as f:
+                    start = max(start, int(f.read().strip() or 0))
+            except (OSError, ValueError):
+                pass
+            try:
+                with open(path, 'w') as f:
+                    f.write(str(start + 1))
+            except OSError as e:
+                print(f'No se pudo guardar el próximo id en {path}: {e}')
+        self._unsaved_next_id = start + 1
+        return start
+
+    def update_lead(self, lead_id, lead_data):
+        """Actualizar un lead existente."""
+        self._require_ready()
+
+        try:
+            row_number, current_values = self._read_lead_row(lead_id)
+            if row_number is None:
+                return {'success': False, 'error': 'Lead no encontrado',
+                        'not_found': True}
+            current_range = f'Leads!A{row_number}:T{row_number}'
+
+            updated_values = merge_lead_values(current_values, lead_data)
 
             body = {'values': [updated_values]}
-            self.service.spreadsheets().values().update(
+            self.transport.write(lambda api: api.values().update(
                 spreadsheetId=self.spreadsheet_id,
                 range=current_range,
                 valueInputOption='USER_ENTERED',
                 body=body
-            ).execute()
+            ))
 
+            self.cache.upsert(row_to_lead([_cell(v) for v in updated_values]),
+                              row=row_number)
             return {'success': True}
 
-        except HttpError as error:
+        except SheetsError as error:
             print(f'Error al actualizar lead: {error}')
-            return {'success': False, 'error': str(error)}
+            return {'success': False, 'error': str(error),
+                    'retryable': error.retryable}
 
     def delete_lead(self, lead_id):
         """Marcar un lead como inactivo (soft delete)."""
         return self.update_lead(lead_id, {'estado': 'Inactivo'})
 
-    def get_pipeline_stats(self):
-        """Obtener estadísticas del pipeline."""
-        leads = self.get_all_leads()
-
-        stats = {
-            'Prospección': {'count': 0, 'value': 0},
-            'Contacto': {'count': 0, 'value': 0},
-            'Negociación': {'count': 0, 'value': 0},
-            'Cierre': {'count': 0, 'value': 0}
-        }
+    def _rows_holding(self, targets):
+        """
+        Ids de `targets` (pares id → fila) cuya fila todavía tiene ese id en
+        la columna A, comprobado con un values().batchGet por lote.
+        """
+        confirmed = set()
+        items = list(targets.items())
+        for start in range(0, len(items), BULK_CHUNK_SIZE):
+            chunk = items[start:start + BULK_CHUNK_SIZE]
+            ranges = [f'Leads!A{row}' for _, row in chunk]
+            result = self.transport.read(lambda api: api.values().batchGet(
+                spreadsheetId=self.spreadsheet_id,
+                ranges=ranges
+            ))
+            for (lead_id, _), value_range in zip(chunk, result.get('valueRanges', [])):
+                values = value_range.get('values') or [['']]
+                if _cell(values[0][0] if values[0] else '') == lead_id:
+                    confirmed.add(lead_id)
+        return confirmed
 
-        for lead in leads:
-            if lead['estado'] == 'Activo' and lead['pipeline'] in stats:
-                stats[lead['pipeline']]['count'] += 1
+    def update_leads_bulk(self, patches):
+        """
+        Actualizar muchos leads con values().batchUpdate.
 
-        return stats
+        `patches` es una lista de {'id': ..., 'fields': {...}}. Las filas salen
+        del índice id → fila y se confirman con un values().batchGet de la
+        columna A antes de escribir; si alguna ya no tiene su id (filas
+        borradas o movidas a mano) se refresca el snapshot y se vuelve a
+        resolver una vez, y si sigue sin coincidir ese lead falla. Sólo se
+        escriben las celdas de los campos pedidos y fecha_modificacion, en
+        lotes de BULK_CHUNK_SIZE leads. Con el cache degradado no se escribe
+        nada. Devuelve un resultado por elemento, en el mismo orden.
+        """
+        self._require_ready()
+
+        self._snapshot()
+        results = [None] * len(patches)
+        if self._degraded is not None:
+            error = 'Google Sheets no está disponible; no se puede confirmar la fila de cada lead'
+            for i, patch in enumerate(patches):
+                results[i] = {'id': str(patch.get('id', '')).strip() or None,
+                              'success': False, 'error': error, 'retryable': True}
+            return {'success': False, 'updated': 0, 'failed': len(results),
+                    'results': results}
+
+        merged = {}
+        for i, patch in enumerate(patches):
+            lead_id = str(patch.get('id', '')).strip()
+            fields = patch.get('fields')
+            if not lead_id or not isinstance(fields, dict):
+                results[i] = {'id': lead_id or None, 'success': False,
+                              'error': 'Se requiere id y fields'}
+                continue
+            item = merged.setdefault(lead_id, {'fields': {}, 'items': []})
+            item['fields'].update({k: v for k, v in fields.items() if k in FIELD_MAPPING})
+            item['items'].append(i)
+
+        def not_found(lead_id, error='Lead no encontrado'):
+            for i in merged.pop(lead_id)['items']:
+                results[i] = {'id': lead_id, 'success': False, 'error': error,
+                              'not_found': True}
+
+        try:
+            pending = {lead_id: self.cache.row_of(lead_id) for lead_id in merged}
+            for attempt in range(2):
+                for lead_id in [i for i, row in pending.items() if row is None]:
+                    del pending[lead_id]
+                    not_found(lead_id)
+                confirmed = self._rows_holding(pending)
+                for lead_id in confirmed:
+                    merged[lead_id]['row'] = pending.pop(lead_id)
+                if not pending:
+                    break
+                if attempt == 0:
+                    # Filas movidas o borradas a mano: se vuelve a leer el sheet
+                    self.cache.invalidate()
+                    self._snapshot()
+                    pending = {lead_id: self.cache.row_of(lead_id) for lead_id in pending}
+            for lead_id in pending:
+                not_found(lead_id, 'La fila del lead cambió en el sheet; reintente')
+        except SheetsError as e:
+            print(f'Error al confirmar las filas de la actualización masiva: {e}')
+            for lead_id, item in merged.items():
+                for i in item['items']:
+                    results[i] = {'id': lead_id, 'success': False, 'error': str(e),
+                                  'retryable': e.retryable}
+            merged = {}
+
+        store = self.cache.peek()
+        entries = list(merged.items())
+        for start in range(0, len(entries), BULK_CHUNK_SIZE):
+            chunk = entries[start:start + BULK_CHUNK_SIZE]
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            data = []
+            for _, item in chunk:
+                row = item['row']
+                for field, value in item['fields'].items():
+                    column = _column_letter(FIELD_MAPPING[field])
+                    data.append({'range': f'Leads!{column}{row}', 'values': [[value]]})
+                data.append({'range': f'Leads!T{row}', 'values': [[now]]})
+            body = {'valueInputOption': 'USER_ENTERED', 'data': data}
+            try:
+                self.transport.write(lambda api: api.values().batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body=body
+                ))
+                error = None
+            except SheetsError as e:
+                print(f'Error en actualización masiva: {e}')
+                error = str(e)
+
+            if error is None and store is not None:
+                updated = []
+                for lead_id, item in chunk:
+                    pos = store.position(lead_id)
+                    if pos is None:
+                        continue
+                    lead = store.lead(pos)
+                    lead.update({k: _cell(v) for k, v in item['fields'].items()})
+                    lead['fecha_modificacion'] = now
+                    updated.append((lead, item['row']))
+                self.cache.upsert_many(updated)
+            for lead_id, item in chunk:
+                for i in item['items']:
+                    results[i] = ({'id': lead_id, 'success': True} if error is None
+                                  else {'id': lead_id, 'success': False, 'error': error})
+
+        updated = sum(1 for r in results if r['success'])
+        return {'success': updated == len(results), 'updated': updated,
+                'failed': len(results) - updated, 'results': results}
+
+    def find_duplicates(self, lead_data):
+        """Ids de los leads con el mismo teléfono o email que `lead_data`."""
+        self._snapshot()
+        return self.duplicates.find(lead_data)
+
+    def dedupe_leads(self, apply=False, progress=None):
+        """
+        Buscar grupos de leads duplicados (mismo teléfono o email) en todo el
+        sheet y, con `apply`, fusionarlos: el lead de menor id absorbe los
+        datos de los demás, que quedan en estado Duplicado. Las escrituras
+        van en lotes con update_leads_bulk.
+        """
+        self._require_ready()
+        if progress is None:
+            progress = {}
+        self._snapshot()
+        clusters = self.duplicates.clusters()
+        proposals, patches = merge_plan(clusters, self._known_lead)
+        duplicates = sum(len(p['duplicates']) for p in proposals)
+        progress.update({'clusters': len(proposals), 'duplicates': duplicates})
+        result = {'success': True, 'applied': False, 'clusters': len(proposals),
+                  'duplicates': duplicates, 'proposals': proposals[:MAX_DEDUPE_PROPOSALS]}
+        if apply and patches:
+            progress['writes'] = len(patches)
+            written = self.update_leads_bulk(patches)
+            result.update({'success': written['success'], 'applied': True,
+                           'updated': written['updated'], 'failed': written['failed'],
+                           'errors': [r for r in written['results'] if not r['success']]
+                                     [:MAX_IMPORT_ERRORS]})
+        return result
+
+    def get_pipeline_stats(self):
+        """Obtener estadísticas del pipeline (conteo y monto pendiente por etapa)."""
+        self._snapshot()
+        return self.aggregates.pipeline_stats()
 
     def get_cobranza_data(self):
-        """Obtener datos de cobranza (leads con tipo_pago = Crédito)."""
-        leads = self.get_all_leads()
-
-        cobranza_leads = []
-        for lead in leads:
-            if lead['tipo_pago'] == 'Crédito' and lead['monto_pendiente']:
-                try:
-                    monto_pendiente = float(lead['monto_pendiente']) if lead['monto_pendiente'] else 0
-                    if monto_pendiente > 0:
-                        cobranza_leads.append(lead)
-                except ValueError:
-                    continue
+        """Obtener datos de cobranza (leads con tipo_pago = Crédito), por id."""
+        self._snapshot()
+        return self.receivables.debtors(sort='id', limit=None)['data']
+
+    def get_receivables(self, sort='monto', descending=False, vendedores=None,
+                        productos=None, cursor=None, limit=None):
+        """Página de deudores ordenada por monto, antigüedad o id."""
+        self._snapshot()
+        kwargs = {} if limit is None else {'limit': limit}
+        return self.receivables.debtors(sort=sort, descending=descending,
+                                        vendedores=vendedores, productos=productos,
+                                        cursor=cursor, **kwargs)
+
+    def get_receivables_summary(self, vendedores=None, productos=None):
+        """Totales de cobranza por vendedor, producto y tramo de antigüedad."""
+        self._snapshot()
+        return self.receivables.summary(vendedores=vendedores, productos=productos)
 
-        return cobranza_leads
+    def get_dashboard_metrics(self):
+        """Métricas generales del dashboard sobre los leads activos."""
+        self._snapshot()
+        metrics = self.aggregates.dashboard()
+        metrics['upcoming_tasks'] = self.calendar.upcoming(UPCOMING_TASKS_LIMIT)
+        return metrics
+
+    def get_tasks(self, start, end, vendedores=None, cursor=None, limit=None):
+        """Tareas agendadas entre dos fechas, ordenadas por fecha."""
+        self._snapshot()
+        kwargs = {} if limit is None else {'limit': limit}
+        return self.calendar.query(start, end, vendedores=vendedores,
+                                   cursor=cursor, **kwargs)
 
 # Instancia global del servicio
 sheets_service = GoogleSheetsService()
 # Asignar automáticamente el spreadsheet_id desde la variable de entorno, si existe
 sheets_service.set_spreadsheet_id(os.environ.get("SPREADSHEET_ID"))
+
+# Métricas del cache y del transporte, calculadas en cada scrape de /api/metrics
+registry.gauge('leads_cache_events', 'Contadores acumulados del cache de leads',
+               lambda: {k: v for k, v in sheets_service.get_cache_stats().items()
+                        if k in ('hits', 'misses', 'coalesced', 'refreshes',
+                                 'refresh_errors', 'patches', 'invalidations')},
+               label='event')
+registry.gauge('leads_cache_hit_ratio', 'Proporción de lecturas servidas desde el cache',
+               lambda: sheets_service.get_cache_stats()['hit_ratio'])
+registry.gauge('leads_snapshot_rows', 'Filas del snapshot en memoria',
+               lambda: sheets_service.get_cache_stats()['size'])
+registry.gauge('leads_snapshot_age_seconds', 'Antigüedad del snapshot en memoria',
+               lambda: sheets_service.get_cache_stats()['age'])
+registry.gauge('events_subscribers', 'Clientes conectados a /api/events',
+               lambda: sheets_service.changes.subscribers())
+registry.gauge('leads_degraded', '1 si se están sirviendo datos viejos',
+               lambda: 0 if sheets_service.degraded() is None else 1)
+registry.gauge('sheets_transport_events', 'Reintentos, esperas por cuota y llamadas agrupadas',
+               lambda: {k: v for k, v in sheets_service.get_transport_stats().items()
+                        if k in ('retries', 'coalesced', 'throttled', 'throttle_wait', 'clients')},
+               label='event')
@@ -0,0 +1,43 @@
+import os
+import threading
+
+
+class IdAllocator:
+    """
+    Asignador de ids de leads por bloques.
+
+    Cada vez que se agota el bloque local se reserva uno nuevo con
+    `reserve_block(n)`, que debe persistir el contador (celda de metadatos del
+    spreadsheet) y devolver (primer id, cantidad reservada); la cantidad puede
+    ser menor que `n` si no se pudo reservar el bloque entero. Dentro del proceso la
+    asignación es atómica; entre procesos, los bloques evitan que dos workers
+    pisen el mismo contador en cada alta.
+    """
+
+    def __init__(self, block_size=None):
+        if block_size is None:
+            block_size = int(os.environ.get('LEADS_ID_BLOCK_SIZE', 20))
+        self.block_size = max(1, block_size)
+        self._lock = threading.Lock()
+        self._next = None
+        self._limit = None
+
+    def allocate(self, reserve_block, count=1):
+        """Devolver `count` ids consecutivos o no, siempre únicos."""
+        ids = []
+        with self._lock:
+            while len(ids) < count:
+                if self._next is None or self._next >= self._limit:
+                    size = max(self.block_size, count - len(ids))
+                    self._next, reserved = reserve_block(size)
+                    self._limit = self._next + max(1, reserved)
+                take = min(self._limit - self._next, count - len(ids))
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+        return ids
+
+    def reset(self):
+        """Descartar el bloque local (p. ej. al cambiar de spreadsheet)."""
+        with self._lock:
+            self._next = None
+            self._limit = None
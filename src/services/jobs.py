@@ -0,0 +1,133 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+
+# Directorio compartido entre workers donde se refleja el estado de las
+# tareas, para poder consultarlas desde cualquier proceso
+JOBS_DIR = os.environ.get('LEADS_JOBS_DIR')
+JOB_SYNC_INTERVAL = 1.0
+
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class Job:
+    """Tarea en segundo plano con progreso consultable."""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = 'pending'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['kind'])
+        for key, value in data.items():
+            setattr(job, key, value)
+        return job
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'progress': dict(self.progress),
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobRegistry:
+    """
+    Registro en memoria de tareas lanzadas en hilos daemon.
+
+    Si hay `directory` (LEADS_JOBS_DIR), el estado de cada tarea se escribe
+    además allí cada JOB_SYNC_INTERVAL segundos y al terminar, y `get` lo lee
+    de ese directorio cuando la tarea corre en otro proceso.
+    """
+
+    def __init__(self, max_jobs=100, directory=None):
+        self.max_jobs = max_jobs
+        self.directory = JOBS_DIR if directory is None else directory
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def _save(self, job):
+        if not self.directory:
+            return
+        path = self._path(job.id)
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(job.to_dict(), f, default=str)
+            os.replace(path + '.tmp', path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f'No se pudo guardar el estado de la tarea {job.id}: {e}')
+
+    def start(self, kind, target):
+        """Ejecutar `target(job)` en un hilo; su retorno queda en job.result."""
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+            # Conservar sólo las tareas más recientes
+            while len(self._jobs) > self.max_jobs:
+                old_id = next(iter(self._jobs))
+                del self._jobs[old_id]
+                if self.directory:
+                    try:
+                        os.unlink(self._path(old_id))
+                    except OSError:
+                        pass
+        self._save(job)
+
+        def sync(stop):
+            while not stop.wait(JOB_SYNC_INTERVAL):
+                self._save(job)
+
+        def run():
+            job.state = 'running'
+            stop = threading.Event()
+            if self.directory:
+                threading.Thread(target=sync, args=(stop,), daemon=True).start()
+            try:
+                job.result = target(job)
+                job.state = 'done'
+            except Exception as e:
+                job.error = str(e)
+                job.state = 'failed'
+            finally:
+                job.finished_at = time.time()
+                stop.set()
+                self._save(job)
+
+        threading.Thread(target=run, name=f'{kind}-{job.id[:8]}', daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or not self.directory or not _JOB_ID_RE.match(job_id):
+            return job
+        try:
+            with open(self._path(job_id)) as f:
+                return Job.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+# Instancia global del registro de tareas
+jobs = JobRegistry()
@@ -0,0 +1,108 @@
+import threading
+
+from src.services.lead_store import parse_amount
+
+
+PIPELINE_STAGES = ('Prospección', 'Contacto', 'Negociación', 'Cierre')
+
+
+def _bump(counter, key, delta):
+    value = counter.get(key, 0) + delta
+    if value:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
+
+
+class LeadAggregates:
+    """
+    Agregados del pipeline y del dashboard mantenidos en memoria.
+
+    Se calculan en una sola pasada sobre las columnas del snapshot al
+    refrescarlo (contando códigos de diccionario, sin materializar leads) y
+    después se ajustan por diferencia (se resta la contribución del lead
+    anterior y se suma la del nuevo) en cada escritura.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._store = None
+        self._reset()
+
+    def _reset(self):
+        self._total_activos = 0
+        self._pipeline = {}
+        self._sources = {}
+        self._stage_count = {stage: 0 for stage in PIPELINE_STAGES}
+        self._stage_value = {stage: 0.0 for stage in PIPELINE_STAGES}
+
+    # ------------------------- Mantenimiento ------------------------- #
+
+    def rebuild(self, store):
+        with self._lock:
+            self._store = store
+            self._reset()
+            if store is None:
+                return
+            activo = store.code_of('estado', 'Activo')
+            estados = store.codes('estado')
+            pipelines = store.codes('pipeline')
+            fuentes = store.codes('fuente')
+            montos = store.amounts('monto_pendiente')
+
+            pipeline_counts = [0] * len(store.dictionary('pipeline'))
+            pipeline_values = [0.0] * len(pipeline_counts)
+            source_counts = [0] * len(store.dictionary('fuente'))
+            for _, pos in store.positions():
+                if estados[pos] != activo:
+                    continue
+                self._total_activos += 1
+                pipeline_counts[pipelines[pos]] += 1
+                pipeline_values[pipelines[pos]] += montos[pos]
+                source_counts[fuentes[pos]] += 1
+
+            for code, pipeline in enumerate(store.dictionary('pipeline')):
+                if pipeline_counts[code]:
+                    _bump(self._pipeline, pipeline, pipeline_counts[code])
+                if pipeline in self._stage_count:
+                    self._stage_count[pipeline] += pipeline_counts[code]
+                    self._stage_value[pipeline] += pipeline_values[code]
+            for code, fuente in enumerate(store.dictionary('fuente')):
+                if source_counts[code]:
+                    _bump(self._sources, fuente, source_counts[code])
+
+    def apply(self, old, new):
+        with self._lock:
+            if self._store is None:
+                return
+            if old is not None:
+                self._account(old, -1)
+            if new is not None:
+                self._account(new, 1)
+
+    def _account(self, lead, sign):
+        if not lead['id'] or lead['estado'] != 'Activo':
+            return
+        self._total_activos += sign
+        _bump(self._pipeline, lead['pipeline'], sign)
+        _bump(self._sources, lead['fuente'], sign)
+        if lead['pipeline'] in self._stage_count:
+            self._stage_count[lead['pipeline']] += sign
+            self._stage_value[lead['pipeline']] += sign * parse_amount(lead['monto_pendiente'])
+
+    # --------------------------- Consultas --------------------------- #
+
+    def pipeline_stats(self):
+        with self._lock:
+            return {stage: {'count': self._stage_count[stage],
+                            'value': round(self._stage_value[stage], 2)}
+                    for stage in PIPELINE_STAGES}
+
+    def dashboard(self):
+        """Totales del dashboard (las próximas tareas las agrega LeadCalendar)."""
+        with self._lock:
+            return {
+                "total_leads": self._total_activos,
+                "pipeline_distribution": dict(self._pipeline),
+                "source_distribution": dict(self._sources),
+            }
@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+import zlib
+
+from src.services.lead_store import LEAD_HEADERS
+
+
+class _Flight:
+    """Refresco en curso compartido por todas las peticiones concurrentes."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.pending = []
+
+
+def _patch_crc(crc, leads):
+    """Encadenar al CRC32 `crc` el contenido de los leads escritos."""
+    for lead in leads:
+        row = '\x1f'.join(str(lead.get(h, '')) for h in LEAD_HEADERS)
+        crc = zlib.crc32(row.encode('utf-8') + b'\x1e', crc)
+    return crc
+
+
+class LeadCache:
+    """
+    Snapshot versionado de los leads en memoria.
+
+    El snapshot (un LeadColumns) se considera válido durante `ttl` segundos
+    (variable de entorno LEADS_CACHE_TTL). Cuando expira, la primera petición
+    descarga los datos y las demás esperan ese mismo resultado
+    (single-flight). Las escrituras del servicio parchean el snapshot en lugar
+    de invalidarlo.
+
+    Junto al snapshot se mantiene un índice id → fila del sheet que sobrevive
+    a la expiración del TTL, para poder leer o escribir un lead puntual sin
+    descargar toda la hoja.
+
+    Otros componentes (índices, agregados) se registran con `add_listener` y
+    reciben `rebuild(store)` tras cada refresco y `apply(old, new)` por cada
+    lead parcheado, siempre bajo el lock de escritura.
+    """
+
+    FIRST_ROW = 2
+
+    def __init__(self, ttl=None):
+        if ttl is None:
+            ttl = float(os.environ.get('LEADS_CACHE_TTL', 30))
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._flight = None
+        self._store = None
+        self._rows = {}
+        self._version = 0
+        self._fetched_at = 0.0
+        # CRC32 encadenado de los leads escritos desde el último refresco
+        self._patch_crc = 0
+        self._listeners = []
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'patches': 0,
+            'invalidations': 0,
+        }
+
+    def add_listener(self, listener):
+        """Registrar un componente que se mantiene en sincronía con el snapshot."""
+        with self._write_lock:
+            self._listeners.append(listener)
+            if self._store is not None:
+                listener.rebuild(self._store)
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def data_version(self):
+        """
+        Identificador del contenido del snapshot para ETags.
+
+        Combina la huella del contenido descargado con un hash encadenado de
+        las escrituras aplicadas desde entonces: dos procesos con el mismo
+        sheet y sin escrituras locales producen el mismo valor, y dos que
+        aplicaron escrituras distintas (aunque sean la misma cantidad) no.
+        """
+        store = self._store
+        if store is None:
+            return None
+        return f'{store.fingerprint:08x}.{self._patch_crc:08x}'
+
+    def _is_fresh(self):
+        return (self._store is not None
+                and time.monotonic() - self._fetched_at < self.ttl)
+
+    def get(self, loader):
+        """Devolver el snapshot vigente, refrescándolo con `loader` si expiró."""
+        with self._lock:
+            if self._is_fresh():
+                self._stats['hits'] += 1
+                return self._store
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                self._stats['misses'] += 1
+                flight = self._flight = _Flight()
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            store = loader()
+        except Exception as e:
+            with self._lock:
+                self._stats['refresh_errors'] += 1
+                self._flight = None
+            flight.error = e
+            flight.event.set()
+            raise
+
+        with self._write_lock:
+            with self._lock:
+                pending = flight.pending
+                self._flight = None
+                if store is self._store:
+                    # El loader confirmó que el snapshot no cambió (ya tiene
+                    # aplicadas las escrituras locales): sólo se renueva el TTL
+                    self._fetched_at = time.monotonic()
+                    self._stats['refreshes'] += 1
+                    flight.result = store
+                    flight.event.set()
+                    return store
+            rows = {lead_id: pos + self.FIRST_ROW for lead_id, pos in store.positions()}
+            # Reaplicar las escrituras hechas mientras se descargaban los datos
+            for lead, row in pending:
+                pos, _ = store.upsert(lead)
+                rows[lead['id']] = row or pos + self.FIRST_ROW
+            for listener in self._listeners:
+                listener.rebuild(store)
+            with self._lock:
+                self._store = store
+                self._rows = rows
+                self._fetched_at = time.monotonic()
+                self._patch_crc = _patch_crc(0, (lead for lead, _ in pending))
+                self._version += 1
+                self._stats['refreshes'] += 1
+
+        flight.result = store
+        flight.event.set()
+        return store
+
+    def peek(self):
+        """Devolver el último snapshot disponible (aunque esté expirado)."""
+        return self._store
+
+    def lookup(self, lead_id):
+        """Buscar un lead por id si el snapshot está vigente (O(1))."""
+        with self._lock:
+            if not self._is_fresh():
+                return None
+            store = self._store
+            pos = store.position(lead_id)
+            if pos is None:
+                return None
+            self._stats['hits'] += 1
+        return store.lead(pos)
+
+    def row_of(self, lead_id):
+        """Número de fila del sheet para un id, o None si no está indexado."""
+        return self._rows.get(lead_id)
+
+    def upsert(self, lead, row=None):
+        """
+        Reemplazar o agregar un lead en el snapshot.
+
+        `row` es la fila del sheet donde quedó escrito, si se conoce.
+        """
+        self.upsert_many([(lead, row)])
+
+    def upsert_many(self, items):
+        """Aplicar varios pares (lead, fila) al snapshot de una vez."""
+        changes = []
+        with self._write_lock:
+            with self._lock:
+                if self._flight is not None:
+                    self._flight.pending.extend(items)
+                store = self._store
+                rows = self._rows
+                for lead, row in items:
+                    if store is not None:
+                        pos, old = store.upsert(lead)
+                        changes.append((old, lead))
+                        rows.setdefault(lead['id'], pos + self.FIRST_ROW)
+                    if row is not None:
+                        rows[lead['id']] = row
+                if store is None:
+                    return
+                self._version += 1
+                self._patch_crc = _patch_crc(self._patch_crc, (lead for lead, _ in items))
+                self._stats['patches'] += len(items)
+            for listener in self._listeners:
+                for old, new in changes:
+                    listener.apply(old, new)
+
+    def invalidate(self):
+        """Descartar el snapshot; la próxima lectura irá al spreadsheet."""
+        with self._write_lock:
+            with self._lock:
+                self._store = None
+                self._rows = {}
+                self._fetched_at = 0.0
+                self._version += 1
+                self._stats['invalidations'] += 1
+            for listener in self._listeners:
+                listener.rebuild(None)
+
+    def get_stats(self):
+        """Contadores de uso del cache."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['version'] = self._version
+            stats['size'] = len(self._store) if self._store is not None else 0
+            stats['age'] = (round(time.monotonic() - self._fetched_at, 3)
+                            if self._store is not None else None)
+            stats['ttl'] = self.ttl
+        lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,180 @@
+import bisect
+import heapq
+import threading
+from datetime import date
+
+from src.services.lead_index import _id_key, decode_cursor, encode_cursor, normalize_text
+from src.services.lead_store import parse_date
+
+
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+# Tareas que muestra el dashboard
+UPCOMING_TASKS_LIMIT = 10
+
+
+def task_ordinal(lead):
+    """
+    Ordinal de la fecha de la próxima acción si el lead tiene una tarea
+    agendada (activo, con acción y fecha válida), o None.
+    """
+    if lead['estado'] != 'Activo' or not lead['proxima_accion']:
+        return None
+    due = parse_date(lead['fecha_proxima_accion'])
+    return due.toordinal() if due else None
+
+
+def task_entry(lead, ordinal, today=None):
+    """Tarea tal como la devuelve la API."""
+    today = (today or date.today()).toordinal()
+    return {
+        "lead_id": lead['id'],
+        "lead_name": lead['nombre'],
+        "action": lead['proxima_accion'],
+        "date": lead['fecha_proxima_accion'],
+        "due": date.fromordinal(ordinal).isoformat(),
+        "overdue": ordinal < today,
+        "vendedor": lead['vendedor'],
+        "pipeline": lead['pipeline'],
+        "telefono": lead['telefono'],
+    }
+
+
+def _after(cursor):
+    (ordinal,), id_key = decode_cursor(cursor)
+    # Justo después de la última tarea devuelta
+    return (ordinal, id_key + (float('inf'),))
+
+
+class LeadCalendar:
+    """
+    Índice de tareas (próximas acciones) ordenado por fecha.
+
+    Mantiene una lista ordenada de entradas (ordinal de la fecha, clave del
+    id, id) con todas las tareas y otra por vendedor (normalizado), de modo
+    que un rango de fechas se resuelve con dos bisect y sólo se recorren las
+    tareas devueltas. Como listener de LeadCache se reconstruye al refrescar
+    el snapshot (usando la columna de fechas ya convertidas) y se actualiza
+    con insort / borrado puntual en cada escritura.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._store = None
+        self._reset()
+
+    def _reset(self):
+        self._all = []
+        self._by_seller = {}
+        self._entries = {}
+
+    # ------------------------- Mantenimiento ------------------------- #
+
+    def rebuild(self, store):
+        with self._lock:
+            self._store = store
+            self._reset()
+            if store is None:
+                return
+            activo = store.code_of('estado', 'Activo')
+            estados = store.codes('estado')
+            fechas = store.dates('fecha_proxima_accion')
+            acciones = store.column('proxima_accion')
+            sellers = [normalize_text(v) for v in store.dictionary('vendedor')]
+            vendedores = store.codes('vendedor')
+            for lead_id, pos in store.positions():
+                if estados[pos] != activo or not fechas[pos] or not acciones[pos]:
+                    continue
+                entry = (fechas[pos], _id_key(lead_id), lead_id)
+                seller = sellers[vendedores[pos]]
+                self._entries[lead_id] = (entry, seller)
+                self._all.append(entry)
+                self._by_seller.setdefault(seller, []).append(entry)
+            self._all.sort()
+            for entries in self._by_seller.values():
+                entries.sort()
+
+    def apply(self, old, new):
+        with self._lock:
+            if self._store is None or not new.get('id'):
+                return
+            self._remove(new['id'])
+            ordinal = task_ordinal(new)
+            if ordinal is None:
+                return
+            entry = (ordinal, _id_key(new['id']), new['id'])
+            seller = normalize_text(new['vendedor'])
+            self._entries[new['id']] = (entry, seller)
+            bisect.insort(self._all, entry)
+            bisect.insort(self._by_seller.setdefault(seller, []), entry)
+
+    def _remove(self, lead_id):
+        current = self._entries.pop(lead_id, None)
+        if current is None:
+            return
+        entry, seller = current
+        for entries in (self._all, self._by_seller.get(seller, [])):
+            i = bisect.bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+
+    # --------------------------- Consultas --------------------------- #
+
+    def query(self, start, end, vendedores=None, cursor=None, limit=DEFAULT_LIMIT,
+              today=None):
+        """
+        Tareas con fecha entre `start` y `end` (inclusive), por fecha.
+
+        `vendedores` limita a esos vendedores (sin distinguir mayúsculas ni
+        tildes). Devuelve `data`, `total` (todas las del rango) y
+        `next_cursor` para la página siguiente.
+        """
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        low = (start.toordinal(),)
+        high = (end.toordinal() + 1,)
+        after = _after(cursor) if cursor else None
+
+        with self._lock:
+            if self._store is None:
+                return {'data': [], 'total': 0, 'next_cursor': None}
+            if vendedores:
+                lists = [self._by_seller.get(normalize_text(v), [])
+                         for v in set(vendedores)]
+            else:
+                lists = [self._all]
+            walks = []
+            total = 0
+            for entries in lists:
+                i = bisect.bisect_left(entries, low)
+                j = bisect.bisect_left(entries, high)
+                total += j - i
+                if after is not None:
+                    i = max(i, bisect.bisect_right(entries, after))
+                walks.append(map(entries.__getitem__, range(i, j)))
+            walk = walks[0] if len(walks) == 1 else heapq.merge(*walks)
+
+            page = []
+            for entry in walk:
+                page.append(entry)
+                if len(page) > limit:
+                    break
+            has_more = len(page) > limit
+            page = page[:limit]
+            store = self._store
+            data = [task_entry(store.lead(store.position(lead_id)), ordinal, today)
+                    for ordinal, _, lead_id in page]
+
+        next_cursor = None
+        if has_more:
+            ordinal, id_key, _ = page[-1]
+            next_cursor = encode_cursor([[ordinal], list(id_key)])
+        return {'data': data, 'total': total, 'next_cursor': next_cursor}
+
+    def upcoming(self, limit, today=None):
+        """Las próximas `limit` tareas desde hoy."""
+        today = today or date.today()
+        with self._lock:
+            i = bisect.bisect_left(self._all, (today.toordinal(),))
+            store = self._store
+            return [task_entry(store.lead(store.position(lead_id)), ordinal, today)
+                    for ordinal, _, lead_id in self._all[i:i + limit]]
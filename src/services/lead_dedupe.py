@@ -0,0 +1,242 @@
+import os
+import threading
+
+from src.services.lead_index import _digits, _id_key
+from src.services.lead_store import LEAD_HEADERS
+
+
+# Qué hacer al crear o importar un lead con el teléfono o email de otro:
+# 'reject' (rechazarlo), 'merge' (completar el existente) o 'allow' (crearlo
+# igual; es el comportamiento de siempre y el valor por defecto)
+DUPLICATE_POLICY = os.environ.get('LEADS_ON_DUPLICATE', 'allow')
+DUPLICATE_POLICIES = ('reject', 'merge', 'allow')
+# Código de país para teléfonos guardados sin él (vacío: se comparan tal cual)
+PHONE_COUNTRY_CODE = os.environ.get('LEADS_PHONE_COUNTRY_CODE', '')
+# Estado con el que quedan los leads absorbidos por una fusión; no se indexan
+DUPLICATE_STATE = 'Duplicado'
+MIN_PHONE_DIGITS = 7
+# Campos de texto libre que se concatenan al fusionar en vez de completarse
+NOTE_FIELDS = ('comentarios', 'conversacion')
+MERGE_FIELDS = tuple(h for h in LEAD_HEADERS
+                     if h not in ('id', 'fecha_creacion', 'fecha_modificacion'))
+
+
+def phone_key(value):
+    """
+    Teléfono normalizado tipo E.164 (+ y dígitos), o None si no alcanza.
+
+    `00` se toma como prefijo internacional; sin `+` ni `00` se antepone
+    LEADS_PHONE_COUNTRY_CODE (quitando el 0 troncal) si está configurado.
+    """
+    raw = str(value or '').strip()
+    digits = _digits(raw)
+    if len(digits) < MIN_PHONE_DIGITS:
+        return None
+    if raw.startswith('+'):
+        return '+' + digits
+    if raw.startswith('00'):
+        return '+' + digits[2:]
+    if PHONE_COUNTRY_CODE and not digits.startswith(PHONE_COUNTRY_CODE):
+        return '+' + PHONE_COUNTRY_CODE + digits.lstrip('0')
+    return '+' + digits
+
+
+def email_key(value):
+    """Email en minúsculas y sin espacios, o None si no parece un email."""
+    email = str(value or '').strip().lower()
+    return email if '@' in email else None
+
+
+def lead_keys(lead):
+    """Claves de duplicado de un lead: (('telefono', …), ('email', …)) válidas."""
+    keys = []
+    phone = phone_key(lead.get('telefono'))
+    if phone:
+        keys.append(('telefono', phone))
+    email = email_key(lead.get('email'))
+    if email:
+        keys.append(('email', email))
+    return tuple(keys)
+
+
+def merge_fields(target, source):
+    """
+    Campos a cambiar en `target` para absorber `source`: se completan los
+    vacíos y las notas (comentarios, conversación) se concatenan.
+    """
+    patch = {}
+    for field in MERGE_FIELDS:
+        if field not in source:
+            continue
+        current = str(target.get(field) or '').strip()
+        incoming = str(source.get(field) or '').strip()
+        if not incoming or incoming == current:
+            continue
+        if not current:
+            patch[field] = incoming
+        elif field in NOTE_FIELDS and incoming not in current:
+            patch[field] = f'{current}\n{incoming}'
+    return patch
+
+
+class DuplicateIndex:
+    """
+    Índice hash de teléfonos y emails normalizados → ids de lead.
+
+    Permite saber en O(1) si un lead nuevo repite el teléfono o el email de
+    otro. Los leads en estado DUPLICATE_STATE no se indexan. Las claves de
+    un alta en curso quedan reservadas (`reserve`/`release`) hasta que el lead
+    llega al índice, para que dos envíos simultáneos del mismo formulario no
+    pasen ambos. Como listener de LeadCache se reconstruye en cada refresco
+    y se ajusta en cada escritura.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._store = None
+        self._ids = {}
+        self._keys = {}
+        self._pending = set()
+
+    # ------------------------- Mantenimiento ------------------------- #
+
+    def rebuild(self, store):
+        with self._lock:
+            self._store = store
+            self._ids = {}
+            self._keys = {}
+            if store is None:
+                return
+            duplicado = store.code_of('estado', DUPLICATE_STATE)
+            estados = store.codes('estado')
+            telefonos = store.column('telefono')
+            emails = store.column('email')
+            for lead_id, pos in store.positions():
+                if duplicado is not None and estados[pos] == duplicado:
+                    continue
+                self._add(lead_id, lead_keys({'telefono': telefonos[pos],
+                                              'email': emails[pos]}))
+
+    def apply(self, old, new):
+        with self._lock:
+            if self._store is None or not new.get('id'):
+                return
+            self._remove(new['id'])
+            if new['estado'] != DUPLICATE_STATE:
+                self._add(new['id'], lead_keys(new))
+
+    def _add(self, lead_id, keys):
+        if not keys:
+            return
+        self._keys[lead_id] = keys
+        for key in keys:
+            self._ids.setdefault(key, set()).add(lead_id)
+
+    def _remove(self, lead_id):
+        for key in self._keys.pop(lead_id, ()):
+            ids = self._ids.get(key)
+            if ids is not None:
+                ids.discard(lead_id)
+                if not ids:
+                    del self._ids[key]
+
+    # --------------------------- Consultas --------------------------- #
+
+    def find(self, lead):
+        """Ids de los leads con el mismo teléfono o email, ordenados por id."""
+        with self._lock:
+            found = set()
+            for key in lead_keys(lead):
+                found |= self._ids.get(key, set())
+        return sorted(found, key=_id_key)
+
+    def ready(self):
+        """True si el índice ya se armó a partir de un snapshot."""
+        with self._lock:
+            return self._store is not None
+
+    def reserve(self, keys):
+        """
+        Ids duplicados de `keys` o, si no hay, reservarlas para un alta.
+
+        Devuelve (ids, reservado). Con ids vacíos y reservado=False hay otra
+        alta en curso con la misma clave.
+        """
+        with self._lock:
+            found = set()
+            for key in keys:
+                found |= self._ids.get(key, set())
+            if found:
+                return sorted(found, key=_id_key), False
+            if any(key in self._pending for key in keys):
+                return [], False
+            self._pending.update(keys)
+            return [], True
+
+    def release(self, keys):
+        with self._lock:
+            self._pending.difference_update(keys)
+
+    def clusters(self):
+        """
+        Grupos de leads duplicados, en una pasada sobre las claves repetidas
+        (union-find: dos leads quedan juntos si comparten teléfono o email,
+        directa o transitivamente). Cada grupo es una lista de ids ordenada;
+        el primero, el de menor id, es el que se conserva.
+        """
+        parent = {}
+
+        def root(lead_id):
+            while parent[lead_id] != lead_id:
+                parent[lead_id] = parent[parent[lead_id]]
+                lead_id = parent[lead_id]
+            return lead_id
+
+        with self._lock:
+            for ids in self._ids.values():
+                if len(ids) < 2:
+                    continue
+                ids = iter(ids)
+                first = next(ids)
+                parent.setdefault(first, first)
+                for lead_id in ids:
+                    parent.setdefault(lead_id, lead_id)
+                    a, b = root(first), root(lead_id)
+                    if a != b:
+                        parent[b] = a
+
+        groups = {}
+        for lead_id in parent:
+            groups.setdefault(root(lead_id), []).append(lead_id)
+        clusters = [sorted(ids, key=_id_key) for ids in groups.values()]
+        clusters.sort(key=lambda ids: _id_key(ids[0]))
+        return clusters
+
+
+def merge_plan(clusters, lookup):
+    """
+    Parches para fusionar cada grupo: el primer lead absorbe los datos de
+    los demás (por orden de id) y los demás pasan a DUPLICATE_STATE con una
+    nota que apunta al conservado. `lookup(id)` devuelve el lead actual.
+    """
+    proposals = []
+    patches = []
+    for ids in clusters:
+        leads = [lookup(lead_id) for lead_id in ids]
+        if any(lead is None for lead in leads):
+            continue
+        keeper = leads[0]
+        merged = dict(keeper)
+        for lead in leads[1:]:
+            merged.update(merge_fields(merged, lead))
+        patch = {field: merged[field] for field in MERGE_FIELDS
+                 if merged[field] != keeper[field]}
+        proposals.append({'keep': ids[0], 'duplicates': ids[1:], 'fields': patch})
+        if patch:
+            patches.append({'id': ids[0], 'fields': patch})
+        note = f'Duplicado de #{ids[0]}'
+        for lead in leads[1:]:
+            comentarios = f"{lead['comentarios']}\n{note}" if lead['comentarios'] else note
+            patches.append({'id': lead['id'], 'fields': {'estado': DUPLICATE_STATE,
+                                                         'comentarios': comentarios}})
+    return proposals, patches
@@ -0,0 +1,52 @@
+import csv
+import io
+import json
+
+from src.services.lead_index import normalize_text
+
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+
+def _field_name(header):
+    """'Teléfono ' → 'telefono', 'Producto Interes' → 'producto_interes'."""
+    return normalize_text(header).replace(' ', '_')
+
+
+def iter_import_rows(stream, fmt):
+    """
+    Recorrer un archivo binario CSV o NDJSON fila por fila.
+
+    Genera tuplas (línea, datos, error): `datos` es un dict con los campos
+    de la fila o None si la línea no pudo leerse, en cuyo caso `error`
+    explica el motivo. Nunca se carga el archivo completo en memoria.
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f'Formato no soportado: {fmt}')
+
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.reader(text)
+        headers = next(reader, None)
+        if headers is None:
+            return
+        fields = [_field_name(h) for h in headers]
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            yield reader.line_num, dict(zip(fields, row)), None
+        return
+
+    for line_number, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f'JSON inválido: {e}'
+            continue
+        if not isinstance(data, dict):
+            yield line_number, None, 'Cada línea debe ser un objeto JSON'
+            continue
+        yield line_number, {_field_name(k): v for k, v in data.items()}, None
@@ -0,0 +1,336 @@
+import base64
+import bisect
+import json
+import re
+import threading
+import unicodedata
+
+from src.services.lead_store import CATEGORICAL_FIELDS, normalize_amount
+
+
+# Campos filtrables por valor exacto (sin distinguir mayúsculas ni tildes)
+FILTER_FIELDS = CATEGORICAL_FIELDS
+# Campos cubiertos por la búsqueda de texto
+SEARCH_FIELDS = ('nombre', 'telefono', 'email')
+NUMERIC_FIELDS = ('id', 'monto_pendiente')
+SORT_FIELDS = ('id', 'registro', 'fecha_ultimo_contacto', 'fecha_proxima_accion',
+               'fecha_creacion', 'fecha_modificacion', 'monto_pendiente'
+               ) + FILTER_FIELDS + SEARCH_FIELDS
+NGRAM = 3
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+_PHONE_RE = re.compile(r'^[\d\s+().-]+$')
+
+
+def normalize_text(value):
+    """Minúsculas, sin tildes y sin espacios sobrantes."""
+    value = str(value or '')
+    if value.isascii():
+        return ' '.join(value.lower().split())
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    return ' '.join(value.lower().split())
+
+
+def _digits(value):
+    return ''.join(c for c in str(value or '') if c.isdigit())
+
+
+def _number(value):
+    try:
+        return float(str(value).replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+def sort_key(field, value):
+    """
+    Clave comparable para ordenar: (grupo, número, texto), con los números
+    en el grupo 0, el texto en el 1 y los vacíos en el 2. En orden
+    descendente sólo se invierte el orden dentro de cada grupo, así que los
+    vacíos quedan siempre al final.
+    """
+    if field in NUMERIC_FIELDS:
+        number = _number(value) if field == 'id' else normalize_amount(value)
+        if number is not None:
+            return (0, number, '')
+    text = normalize_text(value)
+    return (1 if text else 2, 0, text)
+
+
+def _id_key(lead_id):
+    number = _number(lead_id)
+    return (0, number, '') if number is not None else (1, 0, str(lead_id))
+
+
+def _search_fields(lead):
+    """Textos normalizados sobre los que se busca (nombre, email, teléfono)."""
+    return (normalize_text(lead.get('nombre')),
+            normalize_text(lead.get('email')),
+            _digits(lead.get('telefono')))
+
+
+def _search_terms(search):
+    terms = []
+    for term in search.split():
+        if _PHONE_RE.match(term) and _digits(term):
+            terms.append(_digits(term))
+        else:
+            term = normalize_text(term)
+            if term:
+                terms.append(term)
+    return terms
+
+
+def _grams(text):
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+def _term_matches(term, fields, prefix):
+    if not prefix:
+        return any(term in field for field in fields)
+    for field in fields:
+        if field.startswith(term) or f' {term}' in field:
+            return True
+    return False
+
+
+def lead_matches(lead, filters=None, search=None, match='substring'):
+    """
+    Evaluar filtros y búsqueda sobre un lead suelto (sin índice).
+
+    Aplica exactamente las mismas reglas que LeadIndex.query; sirve para
+    recorrer filas que no están en el snapshot.
+    """
+    for field, values in (filters or {}).items():
+        wanted = {normalize_text(v) for v in values}
+        if normalize_text(lead.get(field)) not in wanted:
+            return False
+    if search:
+        fields = _search_fields(lead)
+        for term in _search_terms(search):
+            if not _term_matches(term, fields, match == 'prefix'):
+                return False
+    return True
+
+
+def encode_cursor(position):
+    raw = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key, id_key = json.loads(raw)
+        return (tuple(key), tuple(id_key))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+
+
+def _walk_descending(order, after=None):
+    """
+    Recorrer un orden ascendente de entradas en orden descendente dentro de
+    cada grupo de sort_key, con los grupos en el mismo orden (vacíos al
+    final), a partir de la entrada siguiente al cursor `after`.
+    """
+    for group in (0, 1, 2):
+        if after is not None and group < after[0][0]:
+            continue
+        lo = bisect.bisect_left(order, ((group,),))
+        hi = bisect.bisect_left(order, ((group + 1,),))
+        if after is not None and group == after[0][0]:
+            hi = max(lo, min(hi, bisect.bisect_left(order, after)))
+        for i in range(hi - 1, lo - 1, -1):
+            yield order[i]
+
+
+class LeadIndex:
+    """
+    Índices en memoria sobre el snapshot columnar de leads.
+
+    - Los filtros de FILTER_FIELDS se resuelven recorriendo las columnas
+      categóricas del LeadColumns (comparación de códigos enteros).
+    - Índice de trigramas sobre nombre, email y dígitos del teléfono.
+    - Órdenes precalculados por campo, construidos bajo demanda y mantenidos
+      con bisect en cada escritura.
+
+    Todos los índices trabajan con posiciones dentro del snapshot; los
+    diccionarios de lead sólo se materializan para la página devuelta. Se
+    registra como listener de LeadCache, de modo que se reconstruye al
+    refrescar el snapshot y se actualiza incrementalmente en cada escritura.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._store = None
+        self._grams = {}
+        self._texts = {}
+        self._sorted = {}
+
+    # -------------------- Mantenimiento del índice -------------------- #
+
+    def rebuild(self, store):
+        """Reconstruir todos los índices a partir de un LeadColumns."""
+        with self._lock:
+            self._store = store
+            self._grams = {}
+            self._texts = {}
+            self._sorted = {}
+            if store is None:
+                return
+            nombres = store.column('nombre')
+            emails = store.column('email')
+            telefonos = store.column('telefono')
+            for _, pos in store.positions():
+                self._add_texts(pos, (normalize_text(nombres[pos]),
+                                      normalize_text(emails[pos]),
+                                      _digits(telefonos[pos])))
+
+    def apply(self, old, new):
+        """Actualizar los índices tras crear o modificar un lead."""
+        with self._lock:
+            if self._store is None or not new.get('id'):
+                return
+            pos = self._store.position(new['id'])
+            if pos is None:
+                return
+            indexed = pos in self._texts
+            self._remove_texts(pos)
+            self._add_texts(pos, _search_fields(new))
+            for field in list(self._sorted):
+                if not self._move_sorted(field, pos, old if indexed else None):
+                    del self._sorted[field]
+
+    def _move_sorted(self, field, pos, old):
+        """
+        Reubicar la posición `pos` en el orden precalculado de `field` (quitar
+        la entrada de `old` e insertar la actual) sin reordenar todo.
+        Devuelve False si la entrada vieja no estaba donde se esperaba.
+        """
+        order = self._sorted[field]
+        if old is not None:
+            entry = (sort_key(field, old.get(field)), _id_key(old['id']), pos)
+            i = bisect.bisect_left(order, entry)
+            if i == len(order) or order[i] != entry:
+                return False
+            del order[i]
+        bisect.insort(order, self._sort_entries(field, [pos])[0])
+        return True
+
+    def _add_texts(self, pos, texts):
+        self._texts[pos] = texts
+        for text in texts:
+            for gram in _grams(text):
+                self._grams.setdefault(gram, set()).add(pos)
+
+    def _remove_texts(self, pos):
+        for text in self._texts.pop(pos, ()):
+            for gram in _grams(text):
+                positions = self._grams.get(gram)
+                if positions is not None:
+                    positions.discard(pos)
+                    if not positions:
+                        del self._grams[gram]
+
+    def _sort_entries(self, field, positions):
+        """Entradas (clave, clave_id, posición) ordenables para `positions`."""
+        store = self._store
+        ids = store.column('id')
+        if field in FILTER_FIELDS:
+            # Una clave por valor distinto, no por fila
+            keys = [sort_key(field, value) for value in store.dictionary(field)]
+            codes = store.codes(field)
+            return [(keys[codes[pos]], _id_key(ids[pos]), pos) for pos in positions]
+        column = store.column(field)
+        return [(sort_key(field, column[pos]), _id_key(ids[pos]), pos) for pos in positions]
+
+    def _sorted_positions(self, field):
+        order = self._sorted.get(field)
+        if order is None:
+            order = sorted(self._sort_entries(field, self._texts))
+            self._sorted[field] = order
+        return order
+
+    # ---------------------------- Consultas ---------------------------- #
+
+    def _search(self, search, prefix, candidates):
+        for term in _search_terms(search):
+            if len(term) >= NGRAM:
+                grams = sorted(_grams(term), key=lambda g: len(self._grams.get(g, ())))
+                positions = set(self._grams.get(grams[0], ()))
+                for gram in grams[1:]:
+                    positions &= self._grams.get(gram, set())
+                    if not positions:
+                        break
+                if candidates is not None:
+                    positions &= candidates
+            else:
+                positions = set(self._texts) if candidates is None else candidates
+            # Los trigramas sólo preseleccionan: se verifica sobre el texto
+            candidates = {pos for pos in positions
+                          if _term_matches(term, self._texts[pos], prefix)}
+        return candidates
+
+    def query(self, filters=None, search=None, match='substring', sort='id',
+              descending=False, cursor=None, limit=DEFAULT_LIMIT):
+        """
+        Filtrar, buscar, ordenar y paginar leads.
+
+        `filters` es un dict campo → lista de valores aceptados (OR dentro del
+        campo, AND entre campos). `cursor` es el valor `next_cursor` devuelto
+        por la página anterior. Devuelve un dict con `data`, `total` y
+        `next_cursor`.
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f'Campo de orden no soportado: {sort}')
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        after = decode_cursor(cursor) if cursor else None
+
+        with self._lock:
+            if self._store is None:
+                return {'data': [], 'total': 0, 'next_cursor': None}
+            candidates = None
+            for field, values in (filters or {}).items():
+                if field not in FILTER_FIELDS:
+                    raise ValueError(f'Campo de filtro no soportado: {field}')
+                wanted = {normalize_text(v) for v in values}
+                positions = set(self._store.select(
+                    field, lambda value: normalize_text(value) in wanted))
+                positions &= self._texts.keys()
+                candidates = positions if candidates is None else candidates & positions
+            if search:
+                candidates = self._search(search, match == 'prefix', candidates)
+
+            total = len(self._texts) if candidates is None else len(candidates)
+            if candidates is not None and len(candidates) * 8 < len(self._texts):
+                order = sorted(self._sort_entries(sort, candidates))
+                candidates = None
+            else:
+                order = self._sorted_positions(sort)
+
+            if descending:
+                walk = _walk_descending(order, after)
+            else:
+                start = bisect.bisect_right(order, after + (float('inf'),)) if after else 0
+                walk = (order[i] for i in range(start, len(order)))
+
+            page = []
+            last = None
+            has_more = False
+            for entry in walk:
+                if candidates is not None and entry[2] not in candidates:
+                    continue
+                if len(page) == limit:
+                    has_more = True
+                    break
+                page.append(entry[2])
+                last = entry
+            data = self._store.leads(page)
+
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor([list(last[0]), list(last[1])])
+        return {'data': data, 'total': total, 'next_cursor': next_cursor}
@@ -0,0 +1,556 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+
+from sqlalchemy import and_, case, func, inspect, or_, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.models.lead import Lead, LeadSyncState
+from src.models.user import db
+from src.services.google_sheets import sheets_service
+from src.services.lead_aggregates import PIPELINE_STAGES
+from src.services.lead_calendar import (DEFAULT_LIMIT as TASKS_DEFAULT_LIMIT,
+                                        MAX_LIMIT as TASKS_MAX_LIMIT,
+                                        UPCOMING_TASKS_LIMIT, task_entry, task_ordinal)
+from src.services.lead_index import (DEFAULT_LIMIT, FILTER_FIELDS, MAX_LIMIT,
+                                     NUMERIC_FIELDS, SORT_FIELDS, _digits, _number,
+                                     _search_terms, decode_cursor, encode_cursor,
+                                     normalize_text)
+from src.services.lead_store import LEAD_HEADERS, normalize_amount, parse_amount
+from src.services.receivables import (AGING_BUCKETS, DEBTOR_SORTS,
+                                      DEFAULT_LIMIT as DEBTORS_DEFAULT_LIMIT,
+                                      MAX_LIMIT as DEBTORS_MAX_LIMIT, UNDATED_BUCKET,
+                                      _empty_summary, _rounded, aging_bucket,
+                                      debtor_entry, reference_ordinal)
+from src.utils.metrics import registry
+
+
+# De dónde leen las rutas de consulta: 'sheets' (snapshot en memoria) o
+# 'sqlite' (réplica local en la base de la app)
+READ_BACKEND = os.environ.get('LEADS_READ_BACKEND', 'sheets')
+# Cada cuánto el worker revisa si el sheet cambió (segundos)
+SYNC_INTERVAL = float(os.environ.get('LEADS_REPLICA_SYNC_INTERVAL', 30))
+UPSERT_CHUNK_SIZE = 500
+
+# Valor para ordenar los ids no numéricos después de los numéricos
+_TEXT_ID = 1e308
+_ISO_TIMESTAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def row_hash(lead):
+    """Huella del contenido de un lead: detecta cambios sin comparar campo a campo."""
+    raw = '\x1f'.join(str(lead.get(h, '')) for h in LEAD_HEADERS).encode('utf-8')
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+
+def _modified(value):
+    """fecha_modificacion comparable como texto, o '' si no tiene formato ISO."""
+    value = str(value or '').strip()
+    return value if _ISO_TIMESTAMP_RE.match(value) else ''
+
+
+def lead_columns(lead, row_number=None):
+    """Valores de las columnas de la tabla `leads` para un lead del sheet."""
+    columns = {
+        'id': lead['id'],
+        'row_number': row_number,
+        'row_hash': row_hash(lead),
+        'data': json.dumps({h: lead.get(h, '') for h in LEAD_HEADERS}, ensure_ascii=False),
+        'id_num': _number(lead['id']),
+        'estado': lead['estado'],
+        'pipeline': lead['pipeline'],
+        'fuente': lead['fuente'],
+        'vendedor': lead['vendedor'],
+        'producto_interes': lead['producto_interes'],
+        'tipo_pago': lead['tipo_pago'],
+        'monto': parse_amount(lead['monto_pendiente']),
+        'monto_pendiente_num': normalize_amount(lead['monto_pendiente']),
+        'task_due': task_ordinal(lead),
+        'ref_date': reference_ordinal(lead),
+        'telefono_digits': _digits(lead['telefono']),
+    }
+    for field in SORT_FIELDS:
+        if field != 'id':
+            columns[f'{field}_key'] = normalize_text(lead[field])
+    return columns
+
+
+def _sort_keys(field):
+    """
+    Expresiones (grupo, valor) equivalentes a lead_index.sort_key: números
+    primero, luego texto, vacíos al final. El grupo siempre se ordena
+    ascendente; el sentido pedido se aplica al valor y al id.
+    """
+    if field in NUMERIC_FIELDS:
+        number, key = ((Lead.id_num, Lead.id) if field == 'id'
+                       else (Lead.monto_pendiente_num, Lead.monto_pendiente_key))
+        group = case((number.isnot(None), 0), (key != '', 1), else_=2)
+        return group, func.coalesce(number, key)
+    key = getattr(Lead, f'{field}_key')
+    return case((key == '', 2), else_=1), key
+
+
+def _like(column, term, prefix):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    if not prefix:
+        return column.like(f'%{escaped}%', escape='\\')
+    return or_(column.like(f'{escaped}%', escape='\\'),
+               column.like(f'% {escaped}%', escape='\\'))
+
+
+def _id_order():
+    return (func.coalesce(Lead.id_num, _TEXT_ID), Lead.id)
+
+
+class LeadReplica:
+    """
+    Réplica de lectura de la hoja Leads en la base SQLite de la app.
+
+    Se registra como listener de LeadCache: cada snapshot nuevo se compara
+    fila a fila con la tabla por hash de contenido y sólo se escriben las
+    filas que cambiaron (y se borran las que ya no están); cada escritura
+    local llega por `apply` y se replica en el momento. Todo el trabajo se
+    hace en un hilo aparte, que además refresca el snapshot cada
+    SYNC_INTERVAL segundos para que la réplica siga al sheet aunque ninguna
+    lectura pase ya por el cache.
+
+    Expone los mismos métodos de consulta que GoogleSheetsService, así que las
+    rutas pueden leer de uno u otro indistintamente. El sheet sigue siendo la
+    fuente de verdad: las escrituras van siempre a Google.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.app = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._ops = deque()
+        self._thread = None
+        self._error = None
+        self._error_since = None
+        self._synced_at = None
+        self._stats = {'syncs': 0, 'skipped': 0, 'upserted': 0, 'deleted': 0,
+                       'kept_newer': 0, 'writes': 0, 'errors': 0}
+
+    def init_app(self, app):
+        """Preparar la base y arrancar el worker de sincronización."""
+        self.app = app
+        with app.app_context():
+            columns = {c['name'] for c in inspect(db.engine).get_columns(Lead.__tablename__)}
+            if columns != set(Lead.__table__.columns.keys()):
+                # Tabla de una versión anterior: al ser una copia del sheet
+                # basta con recrearla y volver a sincronizar
+                print('La réplica de leads cambió de esquema: se reconstruye')
+                LeadSyncState.__table__.drop(db.engine, checkfirst=True)
+                Lead.__table__.drop(db.engine, checkfirst=True)
+                db.create_all()
+            # WAL: las lecturas no se bloquean mientras el worker escribe
+            db.session.execute(text('PRAGMA journal_mode=WAL'))
+            db.session.commit()
+            state = db.session.get(LeadSyncState, 1)
+            if state is not None:
+                self._synced_at = state.synced_at
+        self.service.cache.add_listener(self)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='leads-replica', daemon=True)
+            self._thread.start()
+        registry.gauge('leads_replica_lag_seconds', 'Antigüedad de la réplica SQLite de leads',
+                       self._data_age)
+
+    # ------------------------ Listener del cache ------------------------ #
+
+    def rebuild(self, store):
+        if store is None:
+            # Invalidaciones: la réplica sigue sirviendo hasta el próximo snapshot
+            return
+        with self._lock:
+            self._ops.append(('store', (self.service.spreadsheet_id, store)))
+        self._wake.set()
+
+    def apply(self, old, new):
+        if not new.get('id'):
+            return
+        with self._lock:
+            self._ops.append(('lead', (dict(new), self.service.cache.row_of(new['id']))))
+        self._wake.set()
+
+    # ---------------------------- Worker ---------------------------- #
+
+    def _run(self):
+        next_refresh = 0.0
+        while True:
+            self._wake.wait(max(0.0, next_refresh - time.monotonic()))
+            self._wake.clear()
+            if time.monotonic() >= next_refresh:
+                next_refresh = time.monotonic() + SYNC_INTERVAL
+                try:
+                    # Si el snapshot expiró se vuelve a descargar y llega por rebuild()
+                    self.service._snapshot()
+                except Exception as e:
+                    print(f'Error al refrescar los leads para la réplica: {e}')
+            try:
+                with self.app.app_context():
+                    self._drain()
+                self._error = None
+                self._error_since = None
+            except Exception as e:
+                print(f'Error al sincronizar la réplica de leads: {e}')
+                self._stats['errors'] += 1
+                self._error = str(e)
+                self._error_since = self._error_since or time.time()
+                db_retry = time.monotonic() + min(SYNC_INTERVAL, 5)
+                next_refresh = min(next_refresh, db_retry)
+
+    def _drain(self):
+        with self._lock:
+            ops = list(self._ops)
+            self._ops.clear()
+        # Sólo importa el último snapshot; las escrituras se aplican todas
+        last_store = max((i for i, (kind, _) in enumerate(ops) if kind == 'store'),
+                         default=None)
+        try:
+            for i, (kind, payload) in enumerate(ops):
+                if kind == 'lead':
+                    self._apply_write(*payload)
+                elif i == last_store:
+                    self._sync_store(*payload)
+        except Exception:
+            db.session.rollback()
+            # Se reintenta en la próxima vuelta
+            with self._lock:
+                self._ops.extendleft(reversed(ops))
+            raise
+
+    def _state(self):
+        state = db.session.get(LeadSyncState, 1)
+        if state is None:
+            state = LeadSyncState(id=1, version=0, rows=0)
+            db.session.add(state)
+        return state
+
+    def _upsert(self, rows):
+        """INSERT … ON CONFLICT DO UPDATE por lotes (una sentencia, executemany)."""
+        if not rows:
+            return
+        statement = sqlite_insert(Lead.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=['id'],
+            set_={name: statement.excluded[name] for name in rows[0] if name != 'id'})
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            db.session.execute(statement, rows[start:start + UPSERT_CHUNK_SIZE])
+
+    def _apply_write(self, lead, row_number):
+        """Replicar una escritura local (crear/actualizar) de inmediato."""
+        if row_number is None:
+            current = db.session.get(Lead, lead['id'])
+            row_number = current.row_number if current is not None else None
+        self._upsert([lead_columns(lead, row_number)])
+        state = self._state()
+        state.version += 1
+        db.session.commit()
+        self._stats['writes'] += 1
+
+    def _sync_store(self, spreadsheet_id, store):
+        """
+        Llevar la tabla al contenido de `store` escribiendo sólo diferencias.
+
+        Una fila de la tabla con fecha_modificacion posterior a la del sheet
+        se conserva: es una escritura local que todavía no llegó al snapshot
+        (otro worker, o un snapshot publicado antes de escribir). Por lo mismo
+        sólo se borran las filas ausentes que no son más nuevas que el
+        snapshot.
+        """
+        state = self._state()
+        fingerprint = f'{store.fingerprint:08x}'
+        if state.spreadsheet_id == spreadsheet_id and state.fingerprint == fingerprint:
+            self._stats['skipped'] += 1
+            self._synced_at = state.synced_at = time.time()
+            db.session.commit()
+            return
+        if state.spreadsheet_id != spreadsheet_id:
+            db.session.query(Lead).delete()
+
+        known = {lead_id: (hash_, modified) for lead_id, hash_, modified in
+                 db.session.query(Lead.id, Lead.row_hash, Lead.fecha_modificacion_key)}
+        changed = []
+        watermark = ''
+        kept = 0
+        for lead_id, pos in store.positions():
+            lead = store.lead(pos)
+            modified = _modified(lead['fecha_modificacion'])
+            watermark = max(watermark, modified)
+            current = known.pop(lead_id, None)
+            if current is not None:
+                if current[0] == row_hash(lead):
+                    continue
+                if modified and _modified(current[1]) > modified:
+                    kept += 1
+                    continue
+            row_number = self.service.cache.row_of(lead_id) or pos + self.service.cache.FIRST_ROW
+            changed.append(lead_columns(lead, row_number))
+        removed = [lead_id for lead_id, (_, modified) in known.items()
+                   if not (_modified(modified) > watermark)]
+
+        self._upsert(changed)
+        for start in range(0, len(removed), UPSERT_CHUNK_SIZE):
+            chunk = removed[start:start + UPSERT_CHUNK_SIZE]
+            db.session.query(Lead).filter(Lead.id.in_(chunk)).delete(synchronize_session=False)
+        if changed or removed or state.spreadsheet_id != spreadsheet_id:
+            state.version += 1
+        state.spreadsheet_id = spreadsheet_id
+        state.fingerprint = fingerprint
+        state.watermark = watermark or state.watermark
+        state.rows = db.session.query(func.count(Lead.id)).scalar()
+        state.synced_at = time.time()
+        db.session.commit()
+        self._synced_at = state.synced_at
+        self._stats['syncs'] += 1
+        self._stats['upserted'] += len(changed)
+        self._stats['deleted'] += len(removed)
+        self._stats['kept_newer'] += kept
+
+    # ---------------------------- Estado ---------------------------- #
+
+    def _data_age(self):
+        if self._synced_at is None:
+            return None
+        return round(time.time() - self._synced_at, 3)
+
+    def degraded(self):
+        """
+        Estado de degradación de la réplica, o None si está al día.
+
+        La réplica queda vieja cuando no se puede refrescar el snapshot de
+        Sheets o cuando falla la escritura en la base.
+        """
+        degraded = self.service.degraded()
+        if degraded is None and self._error is None:
+            return None
+        if degraded is None:
+            degraded = {'stale': True, 'error': self._error, 'status': None,
+                        'since': datetime.fromtimestamp(self._error_since).strftime('%Y-%m-%d %H:%M:%S')}
+        degraded['data_age'] = self._data_age()
+        return degraded
+
+    def data_version(self):
+        """Versión de la réplica (base de los ETags), compartida entre procesos."""
+        state = db.session.get(LeadSyncState, 1)
+        return f'sql.{state.version}' if state is not None else None
+
+    def get_stats(self):
+        state = db.session.get(LeadSyncState, 1)
+        stats = dict(self._stats)
+        stats['pending'] = len(self._ops)
+        stats['age'] = self._data_age()
+        stats['error'] = self._error
+        stats['state'] = state.to_dict() if state is not None else None
+        return stats
+
+    # --------------------------- Consultas --------------------------- #
+
+    def get_all_leads(self):
+        """Todos los leads, en el orden del sheet."""
+        rows = db.session.query(Lead.data).order_by(Lead.row_number, *_id_order())
+        return [json.loads(data) for (data,) in rows]
+
+    def get_lead(self, lead_id):
+        lead = db.session.get(Lead, str(lead_id))
+        return lead.to_dict() if lead is not None else None
+
+    def query_leads(self, filters=None, search=None, match='substring',
+                    sort='id', descending=False, cursor=None, limit=None):
+        """
+        Filtrar, buscar, ordenar y paginar con las mismas reglas que
+        LeadIndex.query (el cursor de una página sólo vale para este backend).
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f'Campo de orden no soportado: {sort}')
+        limit = max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+        after = decode_cursor(cursor) if cursor else None
+
+        conditions = []
+        for field, values in (filters or {}).items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f'Campo de filtro no soportado: {field}')
+            wanted = {normalize_text(v) for v in values}
+            conditions.append(getattr(Lead, f'{field}_key').in_(wanted))
+        if search:
+            fields = (Lead.nombre_key, Lead.email_key, Lead.telefono_digits)
+            for term in _search_terms(search):
+                conditions.append(or_(*[_like(column, term, match == 'prefix')
+                                        for column in fields]))
+        total = db.session.query(func.count(Lead.id)).filter(*conditions).scalar()
+
+        # El id desempata, como en el índice en memoria
+        group, value = _sort_keys(sort)
+        keys = (value,) + _id_order()
+        query = db.session.query(Lead.data, group, *keys).filter(*conditions)
+        if after:
+            try:
+                (after_group, after_value), (after_id_num, after_id) = after
+            except (TypeError, ValueError):
+                raise ValueError('Cursor inválido')
+            bound = tuple_(*keys)
+            position = (after_value, after_id_num, after_id)
+            query = query.filter(or_(group > after_group, and_(
+                group == after_group, bound < position if descending else bound > position)))
+        query = query.order_by(group.asc(),
+                               *[key.desc() if descending else key.asc() for key in keys])
+        rows = query.limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor([[last[1], last[2]], [last[3], last[4]]])
+        data = [json.loads(row[0]) for row in rows]
+        return {'data': data, 'total': total, 'next_cursor': next_cursor}
+
+    def get_pipeline_stats(self):
+        stats = {stage: {'count': 0, 'value': 0.0} for stage in PIPELINE_STAGES}
+        rows = (db.session.query(Lead.pipeline, func.count(Lead.id), func.sum(Lead.monto))
+                .filter(Lead.estado == 'Activo').group_by(Lead.pipeline))
+        for pipeline, count, value in rows:
+            if pipeline in stats:
+                stats[pipeline] = {'count': count, 'value': round(value or 0.0, 2)}
+        return stats
+
+    def get_cobranza_data(self):
+        return self.get_receivables(sort='id', limit=0)['data']
+
+    def _debtor_conditions(self, vendedores, productos):
+        conditions = [Lead.tipo_pago == 'Crédito', Lead.monto > 0]
+        if vendedores:
+            conditions.append(Lead.vendedor_key.in_({normalize_text(v) for v in vendedores}))
+        if productos:
+            conditions.append(Lead.producto_interes_key.in_(
+                {normalize_text(v) for v in productos}))
+        return conditions
+
+    def get_receivables(self, sort='monto', descending=False, vendedores=None,
+                        productos=None, cursor=None, limit=None):
+        """
+        Deudores ordenados y paginados (misma respuesta que
+        ReceivablesLedger.debtors); `limit=0` devuelve todos.
+        """
+        if sort not in DEBTOR_SORTS:
+            raise ValueError(f'Campo de orden no soportado: {sort}')
+        conditions = self._debtor_conditions(vendedores, productos)
+        total = db.session.query(func.count(Lead.id)).filter(*conditions).scalar()
+
+        if sort == 'monto':
+            keys = (Lead.monto,)
+        elif sort == 'dias':
+            keys = (case((Lead.ref_date.is_(None), 1), else_=0),
+                    -func.coalesce(Lead.ref_date, 0))
+        else:
+            keys = ()
+        keys += _id_order()
+        query = db.session.query(Lead.data, Lead.monto, Lead.ref_date, *keys).filter(*conditions)
+        if cursor:
+            try:
+                key, id_key = decode_cursor(cursor)
+                position = tuple(key) + tuple(id_key)
+                if len(position) != len(keys):
+                    raise ValueError('Cursor inválido')
+            except (TypeError, ValueError):
+                raise ValueError('Cursor inválido')
+            bound = tuple_(*keys)
+            query = query.filter(bound < position if descending else bound > position)
+        query = query.order_by(*[key.desc() if descending else key.asc() for key in keys])
+        if limit != 0:
+            limit = max(1, min(int(limit or DEBTORS_DEFAULT_LIMIT), DEBTORS_MAX_LIMIT))
+            rows = query.limit(limit + 1).all()
+        else:
+            rows = query.all()
+
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            last = list(rows[-1][3:])
+            next_cursor = encode_cursor([last[:-2], last[-2:]])
+        today = date.today()
+        data = [debtor_entry(json.loads(row[0]), row[1], row[2], today) for row in rows]
+        return {'data': data, 'total': total, 'next_cursor': next_cursor}
+
+    def get_receivables_summary(self, vendedores=None, productos=None):
+        conditions = self._debtor_conditions(vendedores, productos)
+        total = _empty_summary()
+        by_seller = {}
+        by_product = {}
+        for column, groups in ((Lead.vendedor_key, by_seller),
+                               (Lead.producto_interes_key, by_product)):
+            name = Lead.vendedor if column is Lead.vendedor_key else Lead.producto_interes
+            rows = (db.session.query(func.min(name), func.count(Lead.id), func.sum(Lead.monto))
+                    .filter(*conditions).group_by(column))
+            for value, count, amount in rows:
+                groups[value] = {'count': count, 'amount': amount or 0.0}
+        for bucket in by_seller.values():
+            total['count'] += bucket['count']
+            total['amount'] += bucket['amount']
+        aging = {name: _empty_summary() for name, _, _ in AGING_BUCKETS}
+        aging[UNDATED_BUCKET] = _empty_summary()
+        today = date.today().toordinal()
+        rows = (db.session.query(Lead.ref_date, func.count(Lead.id), func.sum(Lead.monto))
+                .filter(*conditions).group_by(Lead.ref_date))
+        for reference, count, amount in rows:
+            bucket = aging[aging_bucket(today - reference if reference is not None else None)]
+            bucket['count'] += count
+            bucket['amount'] += amount or 0.0
+        return _rounded({'total': total, 'by_seller': by_seller,
+                         'by_product': by_product, 'aging': aging})
+
+    def get_dashboard_metrics(self):
+        activos = Lead.estado == 'Activo'
+
+        def distribution(column):
+            rows = (db.session.query(column, func.count(Lead.id))
+                    .filter(activos).group_by(column))
+            return {value: count for value, count in rows}
+
+        today = date.today()
+        rows = (db.session.query(Lead.data, Lead.task_due)
+                .filter(Lead.task_due >= today.toordinal())
+                .order_by(Lead.task_due, *_id_order()).limit(UPCOMING_TASKS_LIMIT))
+        tareas = [task_entry(json.loads(data), due, today) for data, due in rows]
+        return {
+            "total_leads": db.session.query(func.count(Lead.id)).filter(activos).scalar(),
+            "pipeline_distribution": distribution(Lead.pipeline),
+            "source_distribution": distribution(Lead.fuente),
+            "upcoming_tasks": tareas
+        }
+
+    def get_tasks(self, start, end, vendedores=None, cursor=None, limit=None):
+        """Tareas agendadas entre dos fechas (misma respuesta que LeadCalendar.query)."""
+        limit = max(1, min(int(limit or TASKS_DEFAULT_LIMIT), TASKS_MAX_LIMIT))
+        conditions = [Lead.task_due >= start.toordinal(), Lead.task_due <= end.toordinal()]
+        if vendedores:
+            conditions.append(Lead.vendedor_key.in_({normalize_text(v) for v in vendedores}))
+        total = db.session.query(func.count(Lead.id)).filter(*conditions).scalar()
+
+        keys = (Lead.task_due,) + _id_order()
+        query = db.session.query(Lead.data, *keys).filter(*conditions)
+        if cursor:
+            try:
+                (after_due,), (after_id_num, after_id) = decode_cursor(cursor)
+            except (TypeError, ValueError):
+                raise ValueError('Cursor inválido')
+            query = query.filter(tuple_(*keys) > (after_due, after_id_num, after_id))
+        rows = query.order_by(*keys).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([[rows[-1][1]], [rows[-1][2], rows[-1][3]]])
+        today = date.today()
+        data = [task_entry(json.loads(row[0]), row[1], today) for row in rows]
+        return {'data': data, 'total': total, 'next_cursor': next_cursor}
+
+
+# Réplica global (sólo se activa con LEADS_READ_BACKEND=sqlite)
+lead_replica = LeadReplica(sheets_service)
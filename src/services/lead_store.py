@@ -0,0 +1,266 @@
+import functools
+import re
+import threading
+import zlib
+from array import array
+from datetime import date, datetime
+
+
+LEAD_HEADERS = [
+    "id", "nombre", "telefono", "email", "fuente", "registro",
+    "producto_interes", "estado", "pipeline", "vendedor", "comentarios",
+    "fecha_ultimo_contacto", "proxima_accion", "fecha_proxima_accion",
+    "conversacion", "tipo_pago", "monto_pendiente", "comprobante",
+    "fecha_creacion", "fecha_modificacion"
+]
+
+# Columnas con pocos valores distintos: se guardan como códigos de diccionario
+CATEGORICAL_FIELDS = ('estado', 'pipeline', 'vendedor', 'fuente',
+                      'producto_interes', 'tipo_pago')
+# Columnas que además se guardan ya convertidas
+AMOUNT_FIELDS = ('monto_pendiente',)
+DATE_FIELDS = ('registro', 'fecha_ultimo_contacto', 'fecha_proxima_accion')
+
+_DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y', '%d-%m-%Y',
+                 '%d/%m/%Y %H:%M:%S', '%Y/%m/%d')
+
+_ISO_DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(?:[ T]|$)')
+# Todo lo que no es dígito ni separador (moneda, espacios, signos)
+_AMOUNT_JUNK_RE = re.compile(r'[^\d.,]')
+
+_INDEX = {field: i for i, field in enumerate(LEAD_HEADERS)}
+
+
+def row_to_lead(row):
+    """Convertir una fila del sheet en un diccionario de lead."""
+    row = list(row) + [''] * (len(LEAD_HEADERS) - len(row))
+    return {LEAD_HEADERS[i]: row[i] for i in range(len(LEAD_HEADERS))}
+
+
+@functools.lru_cache(maxsize=16384)
+def normalize_amount(value):
+    """
+    Monto escrito a mano como float, o None si no es un número.
+
+    Acepta símbolos de moneda y espacios ("$ 1.500", "S/ 250"), coma o punto
+    decimal ("450,75", "2500.50") y separadores de miles en cualquiera de los
+    dos formatos ("3.200,00", "1,234.56"). Con un solo separador seguido de
+    exactamente tres dígitos ("1.500", "1,500") se lo toma como de miles.
+    """
+    text = str(value or '').strip()
+    negative = text.startswith('-') or (text.startswith('(') and text.endswith(')'))
+    text = _AMOUNT_JUNK_RE.sub('', text).strip('.,')
+    if not text or not any(c.isdigit() for c in text):
+        return None
+    decimal = None
+    if '.' in text and ',' in text:
+        decimal = '.' if text.rfind('.') > text.rfind(',') else ','
+    elif text.count('.') == 1 or text.count(',') == 1:
+        separator = '.' if '.' in text else ','
+        if len(text) - text.index(separator) - 1 != 3:
+            decimal = separator
+    if decimal is None:
+        number = text.replace('.', '').replace(',', '')
+    else:
+        thousands = ',' if decimal == '.' else '.'
+        number = text.replace(thousands, '').replace(decimal, '.')
+    try:
+        amount = float(number)
+    except ValueError:
+        return None
+    return -amount if negative else amount
+
+
+def parse_amount(value):
+    """Monto pendiente como float (0 si está vacío o no es numérico)."""
+    return normalize_amount(value) or 0.0
+
+
+def parse_date(value):
+    """Fecha de una celda (varios formatos habituales), o None."""
+    value = str(value or '').strip()
+    if not value:
+        return None
+    match = _ISO_DATE_RE.match(value)
+    if match:
+        try:
+            return date(*map(int, match.groups()))
+        except ValueError:
+            return None
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+@functools.lru_cache(maxsize=16384)
+def _ordinal(value):
+    parsed = parse_date(value)
+    return parsed.toordinal() if parsed else 0
+
+
+class LeadColumns:
+    """
+    Almacenamiento columnar y compacto de los leads del snapshot.
+
+    - Las columnas de texto son listas de str (una por campo).
+    - CATEGORICAL_FIELDS se guardan como array('I') de códigos más un
+      diccionario valor ↔ código compartido por todas las filas.
+    - AMOUNT_FIELDS y DATE_FIELDS tienen además una columna ya convertida
+      (array('d') con el monto, array('l') con el ordinal de la fecha, 0 si
+      la celda está vacía o no se pudo interpretar).
+
+    Los diccionarios de lead sólo se construyen con `lead(pos)` / `leads()`
+    para las filas que realmente se devuelven.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._size = 0
+        self._text = {field: [] for field in LEAD_HEADERS
+                      if field not in CATEGORICAL_FIELDS}
+        self._codes = {field: array('I') for field in CATEGORICAL_FIELDS}
+        self._values = {field: [] for field in CATEGORICAL_FIELDS}
+        self._lookup = {field: {} for field in CATEGORICAL_FIELDS}
+        self._amounts = {field: array('d') for field in AMOUNT_FIELDS}
+        self._dates = {field: array('l') for field in DATE_FIELDS}
+        self._positions = {}
+        # CRC32 del contenido descargado: identifica la versión de los datos
+        self.fingerprint = 0
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Construir el almacenamiento a partir de las filas crudas del sheet."""
+        store = cls()
+        crc = 0
+        for row in rows:
+            store._append(row)
+            crc = zlib.crc32('\x1f'.join(map(str, row)).encode('utf-8') + b'\x1e', crc)
+        store.fingerprint = crc
+        return store
+
+    def __len__(self):
+        return self._size
+
+    def __getstate__(self):
+        # Se serializa para compartir el snapshot entre procesos
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    # --------------------------- Escritura --------------------------- #
+
+    def _encode(self, field, value):
+        lookup = self._lookup[field]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self._values[field])
+            self._values[field].append(value)
+        return code
+
+    def _append(self, row):
+        row = list(row) + [''] * (len(LEAD_HEADERS) - len(row))
+        for field, column in self._text.items():
+            column.append(row[_INDEX[field]])
+        for field, column in self._codes.items():
+            column.append(self._encode(field, row[_INDEX[field]]))
+        for field, column in self._amounts.items():
+            column.append(parse_amount(row[_INDEX[field]]))
+        for field, column in self._dates.items():
+            column.append(_ordinal(row[_INDEX[field]]))
+        lead_id = row[0]
+        if lead_id:
+            self._positions[lead_id] = self._size
+        self._size += 1
+
+    def upsert(self, lead):
+        """
+        Reemplazar (por id) o agregar un lead. Devuelve (posición, lead anterior
+        materializado o None).
+        """
+        with self._lock:
+            pos = self._positions.get(lead['id'])
+            if pos is None:
+                self._append([lead[h] for h in LEAD_HEADERS])
+                return self._size - 1, None
+            old = self.lead(pos)
+            for field, column in self._text.items():
+                column[pos] = lead[field]
+            for field, column in self._codes.items():
+                column[pos] = self._encode(field, lead[field])
+            for field, column in self._amounts.items():
+                column[pos] = parse_amount(lead[field])
+            for field, column in self._dates.items():
+                column[pos] = _ordinal(lead[field])
+            return pos, old
+
+    # ---------------------------- Lectura ---------------------------- #
+
+    def position(self, lead_id):
+        return self._positions.get(lead_id)
+
+    def positions(self):
+        """Pares (id, posición) de las filas con id."""
+        return self._positions.items()
+
+    def value(self, field, pos):
+        if field in self._codes:
+            return self._values[field][self._codes[field][pos]]
+        return self._text[field][pos]
+
+    def lead(self, pos):
+        """Materializar la fila `pos` como diccionario."""
+        with self._lock:
+            return {field: self.value(field, pos) for field in LEAD_HEADERS}
+
+    def leads(self, positions=None):
+        """Materializar varias filas (todas si `positions` es None)."""
+        with self._lock:
+            if positions is None:
+                positions = range(self._size)
+            return [self.lead(pos) for pos in positions]
+
+    def column(self, field):
+        """Columna de texto completa (decodificada si es categórica)."""
+        if field in self._codes:
+            values = self._values[field]
+            return [values[code] for code in self._codes[field]]
+        return self._text[field]
+
+    def codes(self, field):
+        return self._codes[field]
+
+    def dictionary(self, field):
+        """Valores distintos de una columna categórica, indexados por código."""
+        return self._values[field]
+
+    def code_of(self, field, value):
+        return self._lookup[field].get(value)
+
+    def amounts(self, field):
+        return self._amounts[field]
+
+    def dates(self, field):
+        return self._dates[field]
+
+    def select(self, field, accept):
+        """
+        Posiciones cuyo valor categórico cumple `accept(valor)`.
+
+        El predicado se evalúa una vez por valor distinto; luego se recorre la
+        columna de códigos comparando enteros.
+        """
+        codes = {code for code, value in enumerate(self._values[field]) if accept(value)}
+        if not codes:
+            return []
+        column = self._codes[field]
+        if len(codes) == 1:
+            (code,) = codes
+            return [pos for pos, c in enumerate(column) if c == code]
+        return [pos for pos, c in enumerate(column) if c in codes]
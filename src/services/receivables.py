@@ -0,0 +1,276 @@
+import bisect
+import heapq
+import threading
+from datetime import date
+
+from src.services.lead_index import _id_key, decode_cursor, encode_cursor, normalize_text
+from src.services.lead_store import parse_amount, parse_date
+
+
+# Tramos de antigüedad de la deuda (días desde el último contacto, o desde el
+# registro si nunca se contactó al lead)
+AGING_BUCKETS = (('0-30', 0, 30), ('31-60', 31, 60), ('61-90', 61, 90), ('90+', 91, None))
+UNDATED_BUCKET = 'sin_fecha'
+DEBTOR_SORTS = ('monto', 'dias', 'id')
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def is_debtor(lead, amount):
+    return lead['tipo_pago'] == 'Crédito' and amount > 0
+
+
+def reference_ordinal(lead):
+    """Fecha desde la que corre la antigüedad de la deuda (ordinal), o None."""
+    reference = parse_date(lead['fecha_ultimo_contacto']) or parse_date(lead['registro'])
+    return reference.toordinal() if reference else None
+
+
+def aging_bucket(days):
+    if days is None:
+        return UNDATED_BUCKET
+    for name, low, high in AGING_BUCKETS:
+        if high is None or days <= high:
+            return name if days >= low else AGING_BUCKETS[0][0]
+    return AGING_BUCKETS[-1][0]
+
+
+def debtor_entry(lead, amount, reference, today):
+    """Lead de cobranza con el monto normalizado y su antigüedad."""
+    days = today.toordinal() - reference if reference is not None else None
+    entry = dict(lead)
+    entry['amount'] = round(amount, 2)
+    entry['reference_date'] = date.fromordinal(reference).isoformat() if reference else None
+    entry['age_days'] = days
+    entry['aging_bucket'] = aging_bucket(days)
+    return entry
+
+
+def _sort_keys(lead_id, amount, reference):
+    """Clave de cada orden: (clave, clave del id, id)."""
+    id_key = _id_key(lead_id)
+    # `dias` ascendente = la deuda más reciente primero; sin fecha al final
+    days_key = (0, -reference) if reference is not None else (1, 0)
+    return {'monto': ((amount,), id_key, lead_id),
+            'dias': (days_key, id_key, lead_id),
+            'id': ((), id_key, lead_id)}
+
+
+def _empty_summary():
+    return {'count': 0, 'amount': 0.0}
+
+
+class ReceivablesLedger:
+    """
+    Libro de cuentas por cobrar (leads a crédito con monto pendiente).
+
+    Los montos se normalizan una sola vez al cargar el snapshot (columna de
+    montos del LeadColumns) o al escribir un lead. Se mantienen:
+
+    - listas ordenadas por monto, antigüedad e id, globales y por vendedor,
+      para paginar deudores con bisect sin recorrer el sheet;
+    - conteo y total por (vendedor, producto);
+    - conteo y total por (vendedor, producto, fecha de referencia), de donde
+      salen los tramos de antigüedad del día sin recalcular cada deuda.
+
+    Como listener de LeadCache se reconstruye en cada refresco y se ajusta
+    por diferencia en cada escritura.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._store = None
+        self._reset()
+
+    def _reset(self):
+        self._debtors = {}
+        self._sorted = {sort: {None: []} for sort in DEBTOR_SORTS}
+        self._groups = {}
+        self._days = {}
+        self._names = {'vendedor': {}, 'producto': {}}
+
+    # ------------------------- Mantenimiento ------------------------- #
+
+    def rebuild(self, store):
+        with self._lock:
+            self._store = store
+            self._reset()
+            if store is None:
+                return
+            credito = store.code_of('tipo_pago', 'Crédito')
+            if credito is None:
+                return
+            tipos = store.codes('tipo_pago')
+            montos = store.amounts('monto_pendiente')
+            contactos = store.dates('fecha_ultimo_contacto')
+            registros = store.dates('registro')
+            vendedores = store.codes('vendedor')
+            productos = store.codes('producto_interes')
+            seller_names = store.dictionary('vendedor')
+            product_names = store.dictionary('producto_interes')
+            for lead_id, pos in store.positions():
+                if tipos[pos] != credito or montos[pos] <= 0:
+                    continue
+                reference = contactos[pos] or registros[pos] or None
+                self._add(lead_id, montos[pos], reference,
+                          seller_names[vendedores[pos]], product_names[productos[pos]],
+                          insort=False)
+            for lists in self._sorted.values():
+                for entries in lists.values():
+                    entries.sort()
+
+    def apply(self, old, new):
+        with self._lock:
+            if self._store is None or not new.get('id'):
+                return
+            self._remove(new['id'])
+            amount = parse_amount(new['monto_pendiente'])
+            if is_debtor(new, amount):
+                self._add(new['id'], amount, reference_ordinal(new),
+                          new['vendedor'], new['producto_interes'])
+
+    def _add(self, lead_id, amount, reference, seller_name, product_name, insort=True):
+        seller = normalize_text(seller_name)
+        product = normalize_text(product_name)
+        self._names['vendedor'].setdefault(seller, seller_name)
+        self._names['producto'].setdefault(product, product_name)
+        self._debtors[lead_id] = (amount, reference, seller, product)
+        for sort, entry in _sort_keys(lead_id, amount, reference).items():
+            for key in (None, seller):
+                entries = self._sorted[sort].setdefault(key, [])
+                if insort:
+                    bisect.insort(entries, entry)
+                else:
+                    entries.append(entry)
+        self._bump(self._groups, (seller, product), 1, amount)
+        self._bump(self._days, (seller, product, reference), 1, amount)
+
+    def _remove(self, lead_id):
+        current = self._debtors.pop(lead_id, None)
+        if current is None:
+            return
+        amount, reference, seller, product = current
+        for sort, entry in _sort_keys(lead_id, amount, reference).items():
+            for key in (None, seller):
+                entries = self._sorted[sort].get(key, [])
+                i = bisect.bisect_left(entries, entry)
+                if i < len(entries) and entries[i] == entry:
+                    del entries[i]
+        self._bump(self._groups, (seller, product), -1, -amount)
+        self._bump(self._days, (seller, product, reference), -1, -amount)
+
+    @staticmethod
+    def _bump(totals, key, count, amount):
+        current = totals.get(key)
+        if current is None:
+            current = totals[key] = [0, 0.0]
+        current[0] += count
+        current[1] += amount
+        if not current[0]:
+            del totals[key]
+
+    # --------------------------- Consultas --------------------------- #
+
+    def debtors(self, sort='monto', descending=False, vendedores=None, productos=None,
+                cursor=None, limit=DEFAULT_LIMIT, today=None):
+        """
+        Deudores ordenados por `sort` (monto, dias o id) y paginados.
+
+        `vendedores` y `productos` filtran sin distinguir mayúsculas ni
+        tildes. Con `limit=None` se devuelven todos. Devuelve `data`,
+        `total` y `next_cursor`.
+        """
+        if sort not in DEBTOR_SORTS:
+            raise ValueError(f'Campo de orden no soportado: {sort}')
+        if limit is not None:
+            limit = max(1, min(int(limit), MAX_LIMIT))
+        after = None
+        if cursor:
+            key, id_key = decode_cursor(cursor)
+            after = (key, id_key + (float('inf'),)) if not descending else (key, id_key)
+        today = today or date.today()
+        sellers = {normalize_text(v) for v in vendedores} if vendedores else None
+        products = {normalize_text(v) for v in productos} if productos else None
+
+        with self._lock:
+            if self._store is None:
+                return {'data': [], 'total': 0, 'next_cursor': None}
+            lists = self._sorted[sort]
+            selected = [lists.get(s, []) for s in sellers] if sellers else [lists[None]]
+            walks = []
+            for entries in selected:
+                if descending:
+                    start = bisect.bisect_left(entries, after) if after else len(entries)
+                    walks.append(map(entries.__getitem__, range(start - 1, -1, -1)))
+                else:
+                    start = bisect.bisect_right(entries, after) if after else 0
+                    walks.append(map(entries.__getitem__, range(start, len(entries))))
+            walk = walks[0] if len(walks) == 1 else heapq.merge(*walks, reverse=descending)
+
+            page = []
+            for entry in walk:
+                if products is not None and self._debtors[entry[2]][3] not in products:
+                    continue
+                page.append(entry)
+                if limit is not None and len(page) > limit:
+                    break
+            has_more = limit is not None and len(page) > limit
+            page = page[:limit]
+            total = sum(count for (seller, product), (count, _) in self._groups.items()
+                        if (sellers is None or seller in sellers)
+                        and (products is None or product in products))
+            store = self._store
+            data = []
+            for _, _, lead_id in page:
+                amount, reference, _, _ = self._debtors[lead_id]
+                data.append(debtor_entry(store.lead(store.position(lead_id)),
+                                         amount, reference, today))
+
+        next_cursor = None
+        if has_more:
+            key, id_key, _ = page[-1]
+            next_cursor = encode_cursor([list(key), list(id_key)])
+        return {'data': data, 'total': total, 'next_cursor': next_cursor}
+
+    def summary(self, vendedores=None, productos=None, today=None):
+        """Total adeudado, por vendedor, por producto y por tramo de antigüedad."""
+        today = (today or date.today()).toordinal()
+        sellers = {normalize_text(v) for v in vendedores} if vendedores else None
+        products = {normalize_text(v) for v in productos} if productos else None
+
+        def selected(seller, product):
+            return ((sellers is None or seller in sellers)
+                    and (products is None or product in products))
+
+        with self._lock:
+            total = _empty_summary()
+            by_seller = {}
+            by_product = {}
+            for (seller, product), (count, amount) in self._groups.items():
+                if not selected(seller, product):
+                    continue
+                for bucket in (total,
+                               by_seller.setdefault(self._names['vendedor'][seller], _empty_summary()),
+                               by_product.setdefault(self._names['producto'][product], _empty_summary())):
+                    bucket['count'] += count
+                    bucket['amount'] += amount
+            aging = {name: _empty_summary() for name, _, _ in AGING_BUCKETS}
+            aging[UNDATED_BUCKET] = _empty_summary()
+            # Una entrada por (vendedor, producto, día), no por deuda
+            for (seller, product, reference), (count, amount) in self._days.items():
+                if not selected(seller, product):
+                    continue
+                days = today - reference if reference is not None else None
+                bucket = aging[aging_bucket(days)]
+                bucket['count'] += count
+                bucket['amount'] += amount
+        return _rounded({'total': total, 'by_seller': by_seller,
+                         'by_product': by_product, 'aging': aging})
+
+
+def _rounded(summary):
+    for group in (summary['by_seller'], summary['by_product'], summary['aging']):
+        for bucket in group.values():
+            bucket['amount'] = round(bucket['amount'], 2)
+    summary['total']['amount'] = round(summary['total']['amount'], 2)
+    return summary
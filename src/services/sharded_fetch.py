@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def shard_ranges(first_row, last_row, shard_size):
+    """Dividir [first_row, last_row] en rangos de a lo sumo `shard_size` filas."""
+    shards = []
+    start = first_row
+    while start <= last_row:
+        end = min(start + shard_size - 1, last_row)
+        shards.append((start, end))
+        start = end + 1
+    return shards
+
+
+def fetch_rows_sharded(read_range, first_row, last_row, shard_size, concurrency,
+                       retries=2, label='Leads'):
+    """
+    Descargar las filas [first_row, last_row] en paralelo.
+
+    `read_range(start, end)` devuelve las filas de ese rango; se llama desde
+    varios hilos, así que debe ser thread-safe (el transporte de Sheets toma
+    un cliente distinto del pool para cada llamada). Los shards se
+    reensamblan en orden; si alguno falla sólo se reintentan los fallidos,
+    hasta `retries` veces, y luego se propaga el último error.
+    """
+    shards = shard_ranges(first_row, last_row, shard_size)
+    if not shards:
+        return []
+
+    def fetch(shard):
+        return read_range(*shard)
+
+    results = [None] * len(shards)
+    pending = list(range(len(shards)))
+    with ThreadPoolExecutor(max_workers=max(1, concurrency),
+                            thread_name_prefix='sheets-fetch') as pool:
+        for attempt in range(retries + 1):
+            futures = {i: pool.submit(fetch, shards[i]) for i in pending}
+            failed = []
+            error = None
+            for i, future in futures.items():
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    failed.append(i)
+                    error = e
+            if not failed:
+                break
+            if attempt == retries:
+                raise error
+            print(f'Reintentando {len(failed)} shard(s) de {label}: {error}')
+            pending = failed
+
+    rows = []
+    for (start, end), values in zip(shards, results):
+        # La API omite las filas vacías al final de cada rango: se rellenan
+        # para que las posiciones sigan coincidiendo con las filas del sheet
+        rows.extend(values)
+        rows.extend([] for _ in range(end - start + 1 - len(values)))
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
@@ -0,0 +1,175 @@
+import contextlib
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # sin flock (Windows): los candados entre procesos no aplican
+    fcntl = None
+
+
+# Archivo donde el proceso publicador deja el snapshot para los workers
+SNAPSHOT_PATH = os.environ.get('LEADS_SNAPSHOT_PATH')
+# Cada cuánto el publicador vuelve a descargar el sheet (segundos)
+SNAPSHOT_INTERVAL = float(os.environ.get('LEADS_SNAPSHOT_INTERVAL', 10))
+# Tras una escritura se adelanta la descarga, pero nunca más seguido que esto
+SNAPSHOT_MIN_INTERVAL = float(os.environ.get('LEADS_SNAPSHOT_MIN_INTERVAL', 2))
+# Un snapshot más viejo que esto se ignora (el publicador no está vivo)
+SNAPSHOT_MAX_AGE = float(os.environ.get('LEADS_SNAPSHOT_MAX_AGE', 120))
+
+_MAGIC = b'LEADSNP1'
+# magic, versión (time_ns de la publicación), largo del cuerpo
+_HEADER = struct.Struct('<8sQQ')
+
+
+def publish_snapshot(path, spreadsheet_id, store):
+    """
+    Escribir el snapshot en `path` de forma atómica.
+
+    Se serializa a un temporal del mismo directorio y se renombra encima, así
+    que un worker nunca ve un archivo a medio escribir.
+    """
+    payload = pickle.dumps((spreadsheet_id, store), protocol=pickle.HIGHEST_PROTOCOL)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix='.leads-snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, time.time_ns(), len(payload)))
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+
+def touch(path):
+    """Actualizar la fecha del archivo (el publicador sigue vivo)."""
+    with contextlib.suppress(OSError):
+        os.utime(path)
+
+
+def change_marker(path):
+    return path + '.dirty'
+
+
+def notify_change(path):
+    """Pedir al publicador que vuelva a descargar el sheet cuanto antes."""
+    with contextlib.suppress(OSError):
+        with open(change_marker(path), 'a'):
+            pass
+
+
+@contextlib.contextmanager
+def shared_lock(path):
+    """Candado exclusivo entre procesos de la misma máquina (flock)."""
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ChangeNotifier:
+    """Listener del cache de un worker: avisa al publicador de cada escritura."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def rebuild(self, store):
+        pass
+
+    def apply(self, old, new):
+        notify_change(self.path)
+
+
+class SnapshotReader:
+    """
+    Lectura del snapshot publicado por otro proceso.
+
+    El archivo se mapea en memoria y se deserializa directamente desde el
+    mapeo, sólo cuando cambia la versión de la cabecera; mientras no cambie,
+    el worker sigue usando (y parcheando) su snapshot actual.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._version = None
+        self._lock = threading.Lock()
+
+    def load(self, spreadsheet_id, current=None):
+        """
+        Devolver el snapshot publicado para `spreadsheet_id`: `current` si la
+        versión no cambió, uno nuevo si cambió, o None si no hay snapshot
+        utilizable (sin archivo, de otro spreadsheet o demasiado viejo).
+        """
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    if time.time() - os.fstat(f.fileno()).st_mtime > SNAPSHOT_MAX_AGE:
+                        return None
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        magic, version, length = _HEADER.unpack_from(mm)
+                        if magic != _MAGIC:
+                            return None
+                        if version == self._version and current is not None:
+                            return current
+                        with memoryview(mm) as view:
+                            with view[_HEADER.size:_HEADER.size + length] as body:
+                                published_id, store = pickle.loads(body)
+            except (OSError, ValueError, struct.error, pickle.UnpicklingError) as e:
+                print(f'No se pudo leer el snapshot compartido: {e}')
+                return None
+            if published_id != spreadsheet_id:
+                return None
+            self._version = version
+            return store
+
+
+def run_publisher(service, path, interval=None):
+    """
+    Bucle del proceso publicador: descargar el sheet cada `interval`
+    segundos (o antes, si un worker escribió) y publicar el snapshot cuando
+    cambia su contenido.
+    """
+    interval = SNAPSHOT_INTERVAL if interval is None else interval
+    marker = change_marker(path)
+    published = None
+    while True:
+        started = time.monotonic()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(marker)
+        try:
+            service._require_ready()
+            store = service._download_leads()
+            key = (service.spreadsheet_id, store.fingerprint)
+            if key != published or not os.path.exists(path):
+                publish_snapshot(path, service.spreadsheet_id, store)
+                published = key
+            else:
+                touch(path)
+        except Exception as e:
+            print(f'Error al publicar el snapshot de leads: {e}')
+        while True:
+            elapsed = time.monotonic() - started
+            if elapsed >= interval or (elapsed >= SNAPSHOT_MIN_INTERVAL
+                                       and os.path.exists(marker)):
+                break
+            time.sleep(0.2)
+
+
+if __name__ == '__main__':
+    from src.services.google_sheets import sheets_service
+
+    if not SNAPSHOT_PATH:
+        raise SystemExit('LEADS_SNAPSHOT_PATH no está definida')
+    run_publisher(sheets_service, SNAPSHOT_PATH)
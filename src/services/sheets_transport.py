@@ -0,0 +1,349 @@
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # sin flock (Windows): cada proceso usa su propio limitador
+    fcntl = None
+
+from src.utils.metrics import add_sheets_time, observe_sheets_call
+
+
+# Cuotas de la API de Sheets por usuario (la cuenta de servicio) y minuto
+READ_PER_MINUTE = float(os.environ.get('LEADS_SHEETS_READ_PER_MINUTE', 60))
+WRITE_PER_MINUTE = float(os.environ.get('LEADS_SHEETS_WRITE_PER_MINUTE', 60))
+# Peticiones que se pueden hacer de golpe antes de empezar a espaciarlas
+QUOTA_BURST = float(os.environ.get('LEADS_SHEETS_QUOTA_BURST', 20))
+# Espera máxima por un token antes de fallar la llamada
+QUOTA_MAX_WAIT = float(os.environ.get('LEADS_SHEETS_QUOTA_MAX_WAIT', 30))
+# Clientes (conexiones HTTP persistentes) reutilizados entre peticiones
+POOL_SIZE = int(os.environ.get('LEADS_SHEETS_POOL_SIZE', 8))
+MAX_RETRIES = int(os.environ.get('LEADS_SHEETS_MAX_RETRIES', 4))
+BACKOFF_BASE = float(os.environ.get('LEADS_SHEETS_BACKOFF_BASE', 0.5))
+BACKOFF_MAX = float(os.environ.get('LEADS_SHEETS_BACKOFF_MAX', 16))
+# Con varios procesos (workers de gunicorn y publicador) las cuotas son de
+# la cuenta, no de cada proceso: los limitadores guardan su estado en
+# archivos junto al snapshot compartido
+QUOTA_STATE_PATH = os.environ.get('LEADS_SNAPSHOT_PATH')
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class SheetsError(Exception):
+    """
+    Error de una llamada a la API de Sheets.
+
+    `status` es el código HTTP (None si fue un error de red) y `retryable`
+    indica si tiene sentido volver a intentar más tarde (cuota, 5xx, red).
+    """
+
+    def __init__(self, message, status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def to_sheets_error(error):
+    """
+    Traducir una excepción del cliente a SheetsError.
+
+    Se reconoce HttpError por su atributo `resp` (sin importar
+    googleapiclient); los errores de socket y de httplib2 se consideran de red.
+    """
+    if isinstance(error, SheetsError):
+        return error
+    resp = getattr(error, 'resp', None)
+    status = getattr(resp, 'status', None)
+    if status is not None:
+        status = int(status)
+        retry_after = None
+        try:
+            retry_after = float(resp.get('retry-after'))
+        except (AttributeError, TypeError, ValueError):
+            pass
+        return SheetsError(str(error), status=status,
+                           retryable=status in RETRYABLE_STATUS,
+                           retry_after=retry_after)
+    if isinstance(error, OSError) or type(error).__module__.startswith('httplib2'):
+        return SheetsError(f'Error de red con Google Sheets: {error}', retryable=True)
+    return None
+
+
+def _method_name(request):
+    """'values.get', 'values.append'... a partir del methodId de la petición."""
+    method_id = getattr(request, 'methodId', None) or 'unknown'
+    return method_id.replace('sheets.spreadsheets.', '', 1)
+
+
+def _count_rows(result):
+    if not isinstance(result, dict):
+        return 0
+    if 'valueRanges' in result:
+        return sum(len(r.get('values', ())) for r in result['valueRanges'])
+    return len(result.get('values', ()))
+
+
+class TokenBucket:
+    """Limitador de tasa: `rate` tokens por segundo con ráfagas de `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait=None):
+        """
+        Tomar un token, esperando lo necesario. Devuelve los segundos
+        esperados, o None si habría que esperar más de `max_wait`.
+        """
+        waited = 0.0
+        while True:
+            delay = self._take()
+            if not delay:
+                return waited
+            if max_wait is not None and waited + delay > max_wait:
+                return None
+            time.sleep(delay)
+            waited += delay
+
+    def _take(self):
+        """Consumir un token; si no hay, los segundos hasta que haya uno."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket compartido entre los procesos de la máquina: los tokens y
+    la hora de la última actualización viven en `path`, protegidos con flock.
+    """
+
+    def __init__(self, path, rate, capacity):
+        super().__init__(rate, capacity)
+        self.path = path
+
+    def _take(self):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    tokens, updated = map(float, f.read().split())
+                except ValueError:
+                    tokens, updated = self.capacity, time.time()
+                now = time.time()
+                tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+                delay = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    delay = (1 - tokens) / self.rate
+                f.seek(0)
+                f.truncate()
+                f.write(f'{tokens!r} {now!r}')
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return delay
+
+
+def _bucket(kind, rate, capacity, state_path):
+    if state_path and fcntl is not None:
+        return SharedTokenBucket(f'{state_path}.quota-{kind}', rate, capacity)
+    return TokenBucket(rate, capacity)
+
+
+class _Call:
+    """Llamada de lectura en curso compartida por peticiones idénticas."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SheetsTransport:
+    """
+    Capa de transporte para las llamadas a la API de Sheets.
+
+    - Mantiene un pool de hasta `pool_size` clientes creados con
+      `client_factory()`; cada llamada toma uno en exclusiva (httplib2 no es
+      thread-safe) y lo devuelve al terminar, de modo que las conexiones
+      persistentes se reutilizan entre peticiones.
+    - Cada llamada consume un token del limitador de lecturas o de escrituras,
+      ajustados a las cuotas por minuto de Sheets; con LEADS_SNAPSHOT_PATH
+      los limitadores son compartidos por todos los procesos de la máquina.
+    - Las lecturas con la misma `key` que coinciden en el tiempo se resuelven
+      con una sola llamada.
+    - Los errores 429/5xx y de red se reintentan con backoff exponencial y
+      jitter (respetando Retry-After); el resto se propaga como SheetsError.
+      Las escrituras no idempotentes (values().append) sólo se reintentan si
+      es seguro que no se aplicaron: 429 o fallo antes de enviar la petición.
+    """
+
+    def __init__(self, client_factory, pool_size=None, read_per_minute=None,
+                 write_per_minute=None, burst=None, max_retries=None,
+                 quota_state_path=QUOTA_STATE_PATH):
+        self.client_factory = client_factory
+        self.pool_size = pool_size or POOL_SIZE
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        burst = burst or QUOTA_BURST
+        self._buckets = {
+            'read': _bucket('read', (read_per_minute or READ_PER_MINUTE) / 60.0,
+                            burst, quota_state_path),
+            'write': _bucket('write', (write_per_minute or WRITE_PER_MINUTE) / 60.0,
+                             burst, quota_state_path),
+        }
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._stats = {
+            'calls': 0,
+            'retries': 0,
+            'errors': 0,
+            'coalesced': 0,
+            'throttled': 0,
+            'throttle_wait': 0.0,
+        }
+
+    def reset(self):
+        """Descartar los clientes del pool (p. ej. tras reautenticar)."""
+        with self._lock:
+            self._idle = queue.LifoQueue()
+            self._created = 0
+
+    @contextmanager
+    def _client(self):
+        pool = self._idle
+        try:
+            client = pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.pool_size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    client = self.client_factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                client = pool.get()
+        try:
+            yield client
+        finally:
+            pool.put(client)
+
+    def read(self, build_request, key=None):
+        """Ejecutar una lectura; `build_request(spreadsheets)` arma la petición."""
+        if key is None:
+            return self._execute('read', build_request)
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self._stats['coalesced'] += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = self._execute('read', build_request)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.event.set()
+        return call.result
+
+    def write(self, build_request, idempotent=True):
+        """
+        Ejecutar una escritura (nunca se agrupa con otras).
+
+        Con `idempotent=False` (values().append) un 5xx o un error de red
+        no se reintenta: la petición pudo aplicarse aunque se perdiera la
+        respuesta, y repetirla duplicaría las filas.
+        """
+        return self._execute('write', build_request, idempotent=idempotent)
+
+    def _execute(self, kind, build_request, idempotent=True):
+        attempt = 0
+        while True:
+            sent = False
+            waited = self._buckets[kind].acquire(max_wait=QUOTA_MAX_WAIT)
+            if waited is None:
+                with self._lock:
+                    self._stats['errors'] += 1
+                raise SheetsError('Cuota de Google Sheets agotada; reintente más tarde',
+                                  status=429, retryable=True, retry_after=QUOTA_MAX_WAIT)
+            with self._lock:
+                self._stats['calls'] += 1
+                if waited:
+                    self._stats['throttled'] += 1
+                    self._stats['throttle_wait'] += waited
+            if waited:
+                add_sheets_time(waited)
+            method = 'unknown'
+            started = time.perf_counter()
+            try:
+                with self._client() as client:
+                    request = build_request(client.spreadsheets())
+                    method = _method_name(request)
+                    started = time.perf_counter()
+                    sent = True
+                    result = request.execute()
+                observe_sheets_call(method, '200', time.perf_counter() - started,
+                                    rows=_count_rows(result))
+                return result
+            except Exception as e:
+                error = to_sheets_error(e)
+                status = 'error' if error is None else (
+                    str(error.status) if error.status else 'network')
+                observe_sheets_call(method, status, time.perf_counter() - started)
+                if error is None:
+                    raise
+                # Conexión rechazada: la petición no llegó al servidor
+                applied = sent and not isinstance(e, ConnectionRefusedError)
+                retry = error.retryable and (idempotent or not applied or error.status == 429)
+                if not retry or attempt >= self.max_retries:
+                    with self._lock:
+                        self._stats['errors'] += 1
+                    raise error from e
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            if error.retry_after:
+                delay = max(delay, min(error.retry_after, BACKOFF_MAX))
+            attempt += 1
+            with self._lock:
+                self._stats['retries'] += 1
+            print(f'Reintentando llamada a Sheets en {delay:.2f}s: {error}')
+            time.sleep(delay)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['throttle_wait'] = round(stats['throttle_wait'], 3)
+            stats['pool_size'] = self.pool_size
+            stats['clients'] = self._created
+        return stats
@@ -0,0 +1,235 @@
+import bisect
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+from flask import Response, g, request
+
+
+# Límites de los histogramas de latencia (segundos) y de tamaño (bytes)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Perfilado por petición: con LEADS_PROFILE_DIR definido se perfilan las
+# peticiones con el encabezado X-Profile: 1 (o todas si LEADS_PROFILE_ALL=1)
+PROFILE_DIR = os.environ.get('LEADS_PROFILE_DIR')
+PROFILE_ALL = os.environ.get('LEADS_PROFILE_ALL') == '1'
+PROFILE_TOP = 40
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, (list(counts), total, count))
+                           for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {round(total, 6)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class Gauge:
+    """Valor calculado en el momento del scrape con `collect()` (número o dict)."""
+
+    def __init__(self, name, help_text, collect, label=None):
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+        self.label = label
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        try:
+            value = self.collect()
+        except Exception as e:
+            print(f'Error al calcular la métrica {self.name}: {e}')
+            return lines
+        if isinstance(value, dict):
+            for label_value, v in sorted(value.items()):
+                lines.append(f'{self.name}{_format_labels([(self.label, label_value)])} {v}')
+        elif value is not None:
+            lines.append(f'{self.name} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, collect, label=None):
+        with self._lock:
+            # Se reemplaza: el callback puede apuntar a una instancia nueva
+            self._metrics[name] = Gauge(name, help_text, collect, label)
+            return self._metrics[name]
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Registro global del proceso
+registry = MetricsRegistry()
+
+http_duration = registry.histogram(
+    'http_request_duration_seconds', 'Duración de las peticiones HTTP por ruta')
+http_sheets_time = registry.histogram(
+    'http_request_sheets_seconds', 'Tiempo de cada petición HTTP esperando a Google Sheets')
+http_response_size = registry.histogram(
+    'http_response_size_bytes', 'Tamaño del cuerpo de las respuestas', SIZE_BUCKETS)
+json_serialize = registry.histogram(
+    'json_serialize_seconds', 'Tiempo de serialización de respuestas JSON')
+sheets_calls = registry.counter(
+    'sheets_api_calls_total', 'Llamadas a la API de Sheets por método y resultado')
+sheets_duration = registry.histogram(
+    'sheets_api_duration_seconds', 'Latencia de las llamadas a la API de Sheets')
+sheets_rows = registry.counter(
+    'sheets_rows_fetched_total', 'Filas leídas de la API de Sheets')
+
+_request_state = threading.local()
+
+
+def add_sheets_time(seconds):
+    """Acumular tiempo de Sheets en la petición HTTP del hilo actual."""
+    if getattr(_request_state, 'active', False):
+        _request_state.sheets += seconds
+
+
+def observe_sheets_call(method, status, seconds, rows=0):
+    sheets_calls.inc(method=method, status=status)
+    sheets_duration.observe(seconds, method=method)
+    if rows:
+        sheets_rows.inc(rows, method=method)
+    add_sheets_time(seconds)
+
+
+def _start_request():
+    _request_state.active = True
+    _request_state.sheets = 0.0
+    g._metrics_started = time.perf_counter()
+    if PROFILE_DIR and (PROFILE_ALL or request.headers.get('X-Profile') == '1'):
+        g._profiler = cProfile.Profile()
+        g._profiler.enable()
+
+
+def _finish_request(response):
+    started = g.pop('_metrics_started', None)
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    elapsed = time.perf_counter() - started
+    labels = {'route': route, 'method': request.method}
+    http_duration.observe(elapsed, status=str(response.status_code), **labels)
+    http_sheets_time.observe(getattr(_request_state, 'sheets', 0.0), **labels)
+    _request_state.active = False
+    if not response.is_streamed and response.content_length is not None:
+        http_response_size.observe(response.content_length, **labels)
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        try:
+            response.headers['X-Profile-File'] = _dump_profile(profiler, route, elapsed)
+        except OSError as e:
+            print(f'No se pudo guardar el perfil de {route}: {e}')
+    return response
+
+
+def _dump_profile(profiler, route, elapsed):
+    """Guardar el perfil (.prof para snakeviz/pstats y resumen en texto)."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = '{}-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'),
+                             request.method.lower(),
+                             route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'root')
+    base = os.path.join(PROFILE_DIR, f'{name}-{os.getpid()}-{threading.get_ident()}')
+    profiler.dump_stats(base + '.prof')
+    summary = io.StringIO()
+    summary.write(f'{request.method} {request.full_path} {elapsed * 1000:.1f} ms\n\n')
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP)
+    with open(base + '.txt', 'w') as f:
+        f.write(summary.getvalue())
+    return base + '.prof'
+
+
+def metrics_endpoint():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Instrumentar todas las rutas de `app` y exponer /api/metrics."""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/api/metrics', 'metrics', metrics_endpoint)
@@ -0,0 +1,88 @@
+import gzip
+import hashlib
+import json
+import time
+
+from flask import Response, request
+
+from src.utils.metrics import json_serialize
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional: se usa json estándar
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # dependencia opcional: sólo se ofrece gzip
+    brotli = None
+
+
+# Por debajo de este tamaño no compensa comprimir
+MIN_COMPRESS_BYTES = 1024
+
+
+def dumps(payload):
+    """Serializar a JSON (bytes) con orjson si está instalado."""
+    started = time.perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    json_serialize.observe(time.perf_counter() - started)
+    return body
+
+
+def _accepted_encodings():
+    header = request.headers.get('Accept-Encoding', '')
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0'):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def compressed(body, mimetype='application/json', status=200, headers=None):
+    """Respuesta con el cuerpo comprimido según Accept-Encoding (br o gzip)."""
+    response = Response(body, status=status, mimetype=mimetype, headers=headers)
+    response.vary.add('Accept-Encoding')
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+    accepted = _accepted_encodings()
+    if brotli is not None and 'br' in accepted:
+        response.set_data(brotli.compress(body, quality=4))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accepted:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def json_response(payload, status=200):
+    """Equivalente a jsonify con el serializador rápido y compresión."""
+    return compressed(dumps(payload), status=status)
+
+
+def conditional_json(data_version, build_payload):
+    """
+    Responder JSON con ETag derivado de la versión de los datos.
+
+    Si el cliente envía un If-None-Match que coincide se devuelve 304 sin
+    construir ni serializar el cuerpo; si no, se llama a `build_payload()`.
+    El ETag incluye la URL completa para que cada combinación de filtros
+    tenga el suyo.
+    """
+    if data_version is None:
+        return json_response(build_payload())
+    etag = hashlib.blake2b(f'{data_version}|{request.full_path}'.encode('utf-8'),
+                           digest_size=12).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.vary.add('Accept-Encoding')
+    else:
+        response = json_response(build_payload())
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response